@@ -0,0 +1,427 @@
+# Lint as: python3
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+"""Publishes annotations to consumer processes in shared memory.
+
+An AnnotationBus holds the annotations of recent frames as fixed-width
+records, RECORD_DTYPE, in a multiprocessing shared_memory block. The inference
+process writes the annotations of every frame once. Any number of consumers,
+such as analytics and recording processes, read them as NumPy structured
+array views, so fanning out to more consumers costs nothing per consumer.
+
+Each frame has a header with its timestamp and the position and number of its
+records, which are always contiguous. As with frame_bus, headers carry
+seqlock-style sequence tags, and every consumer has its own cursor. A
+consumer that falls behind skips to the oldest frame still held, counting the
+frames it missed. Records do not hold class names: the writer maps shot
+classification class names to class ids through the label map, and consumers
+look names up from the label map.
+
+Example:
+  # Inference process.
+  bus = annotation_bus.AnnotationBus.create(num_frames=256)
+  while ...:
+    annotations = []
+    engine.run(timestamp, frame, annotations)
+    bus.write(timestamp, annotations)
+
+  # Consumer process, given bus.name.
+  bus = annotation_bus.AnnotationBus.attach(name)
+  for frame in bus.reader():
+    confident = frame.records[frame.records['confidence_score'] > 0.5]
+    if frame.valid():
+      count(confident['class_id'])
+"""
+
+import dataclasses
+import math
+import time
+from typing import Iterator, List, Optional, Union
+
+import numpy as np
+from automl_video_ondevice import frame_bus
+from automl_video_ondevice import sinks
+from automl_video_ondevice.types import NormalizedBoundingBox
+from automl_video_ondevice.types import ObjectTrackingAnnotation
+from automl_video_ondevice.types import ShotClassificationAnnotation
+
+# Shot classification annotations have no track or box, and use -1 and NaN in
+# their place, as in sinks. Their class id is their index in the label map.
+RECORD_DTYPE = np.dtype([
+    ('timestamp', '<f8'),
+    ('track_id', '<i4'),
+    ('class_id', '<i4'),
+    ('confidence_score', '<f4'),
+    ('left', '<f4'),
+    ('top', '<f4'),
+    ('right', '<f4'),
+    ('bottom', '<f4'),
+])
+
+_HEADER_DTYPE = np.dtype([
+    ('tag', '<i8'),
+    ('timestamp', '<f8'),
+    ('start', '<i8'),  # Position of the first record, counting every record.
+    ('count', '<i8'),
+])
+
+_MAGIC = 0x41425553  # 'ABUS'
+# Indices into the control block.
+_MAGIC_INDEX = 0
+_NUM_FRAMES = 1
+_MAX_RECORDS = 2
+_HEAD = 3  # Number of frames published so far.
+_CLOSED = 4  # Set once the writer will publish no more frames.
+# End of the records written or being written, counting every record. Records
+# before this minus the ring size have been overwritten.
+_RECORDS_RESERVED = 5
+_CONTROL_SIZE = 8
+_ALIGNMENT = 64
+
+
+@dataclasses.dataclass
+class AnnotationFrame:
+  """The annotations of a frame, viewed in place in shared memory."""
+  sequence: int  # Position in the stream of published frames.
+  timestamp: float
+  records: np.ndarray  # Read-only RECORD_DTYPE view.
+  _bus: 'AnnotationBus'
+  _header: int
+  _tag: int
+  _start: int
+
+  def valid(self):
+    # type: () -> bool
+    """Returns whether the bus still holds this frame's records.
+
+    Check after using the records: False means the writer reused them in the
+    meantime, and results computed from them must be discarded.
+    """
+    # pylint: disable=protected-access
+    bus = self._bus
+    return (int(bus._headers['tag'][self._header]) == self._tag and
+            int(bus._control[_RECORDS_RESERVED]) <=
+            self._start + bus.max_records)
+    # pylint: enable=protected-access
+
+  def annotations(self, label_list=None):
+    # pylint: disable=line-too-long
+    # type: (Optional[List[str]]) -> List[Union[ObjectTrackingAnnotation, ShotClassificationAnnotation]]
+    # pylint: enable=line-too-long
+    """Copies the records into annotations.
+
+    Args:
+      label_list: Class names indexed by class id, as loaded from the label
+        map. Without it, class names are empty.
+
+    Returns:
+      The annotations, as the engine output them.
+    """
+    annotations = []
+    for record in self.records.tolist():
+      (timestamp, track_id, class_id, score, left, top, right, bottom) = record
+      class_name = ''
+      if label_list is not None and 0 <= class_id < len(label_list):
+        class_name = label_list[class_id]
+      if math.isnan(left):
+        annotations.append(
+            ShotClassificationAnnotation(
+                timestamp=timestamp,
+                class_name=class_name,
+                confidence_score=score))
+        continue
+      annotations.append(
+          ObjectTrackingAnnotation(
+              timestamp=timestamp,
+              track_id=track_id,
+              class_id=class_id,
+              class_name=class_name,
+              confidence_score=score,
+              bbox=NormalizedBoundingBox(
+                  left=left, top=top, right=right, bottom=bottom)))
+    return annotations
+
+
+class AnnotationBus:
+  """A shared memory ring of annotation records, with one writer."""
+
+  def __init__(self, block, owner):
+    """Use AnnotationBus.create or AnnotationBus.attach instead."""
+    self._block = block
+    self._owner = owner
+    self._control = np.ndarray((_CONTROL_SIZE,),
+                               dtype=np.int64,
+                               buffer=block.buf)
+    if self._control[_MAGIC_INDEX] != _MAGIC:
+      raise ValueError('{} is not an annotation bus.'.format(block.name))
+    self.num_frames = int(self._control[_NUM_FRAMES])
+    self.max_records = int(self._control[_MAX_RECORDS])
+    self._headers = np.ndarray((self.num_frames,),
+                               dtype=_HEADER_DTYPE,
+                               buffer=block.buf,
+                               offset=_CONTROL_SIZE * 8)
+    self._records = np.ndarray((self.max_records,),
+                               dtype=RECORD_DTYPE,
+                               buffer=block.buf,
+                               offset=_records_offset(self.num_frames))
+    if not owner:
+      self._records.flags.writeable = False
+
+  @classmethod
+  def create(cls, num_frames=256, max_records=None, name=None):
+    # type: (int, Optional[int], Optional[str]) -> AnnotationBus
+    """Creates a bus, owned by the calling process, which is its writer.
+
+    Args:
+      num_frames: How many frames the bus holds. Consumers more than this many
+        frames behind the writer skip frames.
+      max_records: How many records the bus holds, over all frames. Defaults
+        to 32 per frame. Frames with many annotations leave fewer frames held.
+      name: Name of the shared memory block, or None for a unique one.
+
+    Returns:
+      The bus. Consumers in other processes attach to it by its name.
+    """
+    if frame_bus.shared_memory is None:
+      raise RuntimeError('The annotation bus needs Python 3.8 or later.')
+    if num_frames < 2:
+      raise ValueError('The annotation bus needs at least 2 frames.')
+    if max_records is None:
+      max_records = 32 * num_frames
+    size = _records_offset(num_frames) + max_records * RECORD_DTYPE.itemsize
+    block = frame_bus.shared_memory.SharedMemory(
+        name=name, create=True, size=size)
+    control = np.ndarray((_CONTROL_SIZE,), dtype=np.int64, buffer=block.buf)
+    control[:] = 0
+    control[_NUM_FRAMES] = num_frames
+    control[_MAX_RECORDS] = max_records
+    np.ndarray((num_frames,),
+               dtype=_HEADER_DTYPE,
+               buffer=block.buf,
+               offset=_CONTROL_SIZE * 8)['tag'] = 0
+    # Written last, so that attaching never sees a partial header.
+    control[_MAGIC_INDEX] = _MAGIC
+    del control
+    return cls(block, owner=True)
+
+  @classmethod
+  def attach(cls, name):
+    # type: (str) -> AnnotationBus
+    """Attaches to a bus created by another process, to read from it."""
+    if frame_bus.shared_memory is None:
+      raise RuntimeError('The annotation bus needs Python 3.8 or later.')
+    return cls(frame_bus.attach_shared_memory(name), owner=False)
+
+  @property
+  def name(self):
+    # type: () -> str
+    return self._block.name
+
+  @property
+  def head(self):
+    # type: () -> int
+    """Number of frames published so far."""
+    return int(self._control[_HEAD])
+
+  @property
+  def closed(self):
+    # type: () -> bool
+    return bool(self._control[_CLOSED])
+
+  def write(self, timestamp, annotations, label_list=None):
+    # pylint: disable=line-too-long
+    # type: (Union[int, float], List[Union[ObjectTrackingAnnotation, ShotClassificationAnnotation]], Optional[List[str]]) -> int
+    # pylint: enable=line-too-long
+    """Publishes the annotations of a single frame.
+
+    Shot classification output may contain None entries, which are skipped.
+
+    Args:
+      timestamp: The timestamp of the frame.
+      annotations: The annotations output by the engine for that frame.
+      label_list: Class names indexed by class id, as loaded from the label
+        map. Needed for shot classification annotations, which only carry a
+        class name.
+
+    Returns:
+      The frame's sequence number.
+
+    Raises:
+      ValueError: If a shot classification annotation's class is not in the
+        label list.
+    """
+    snapshots = [sinks.snapshot(a) for a in annotations if a is not None]
+    records = np.empty(len(snapshots), dtype=RECORD_DTYPE)
+    records['timestamp'] = timestamp
+    if snapshots:
+      (records['track_id'], records['class_id'], class_names,
+       records['confidence_score'], records['left'], records['top'],
+       records['right'], records['bottom']) = zip(*snapshots)
+      shots = np.flatnonzero(np.isnan(records['left']))
+      if shots.size:
+        records['class_id'][shots] = [
+            _class_id(class_names[i], label_list) for i in shots
+        ]
+    return self.write_records(timestamp, records)
+
+  def write_records(self, timestamp, records):
+    # type: (Union[int, float], np.ndarray) -> int
+    """Publishes a frame of records already in RECORD_DTYPE."""
+    if not self._owner:
+      raise ValueError('Only the process that created the bus can write.')
+    count = len(records)
+    if count > self.max_records:
+      raise ValueError('A frame has {} records, but the bus holds {}.'.format(
+          count, self.max_records))
+    sequence = self.head
+    header = sequence % self.num_frames
+    start = int(self._control[_RECORDS_RESERVED])
+    # Keeps every frame's records contiguous, wrapping early if needed.
+    if start % self.max_records + count > self.max_records:
+      start += self.max_records - start % self.max_records
+
+    # Odd while being written: readers of the frames this overwrites see it.
+    self._headers['tag'][header] = 2 * sequence + 1
+    self._control[_RECORDS_RESERVED] = start + count
+    position = start % self.max_records
+    self._records[position:position + count] = records
+    self._headers['timestamp'][header] = timestamp
+    self._headers['start'][header] = start
+    self._headers['count'][header] = count
+    self._headers['tag'][header] = 2 * sequence + 2
+    self._control[_HEAD] = sequence + 1
+    return sequence
+
+  def close_writer(self):
+    """Tells consumers no more frames will be published."""
+    if not self._owner:
+      raise ValueError('Only the process that created the bus can write.')
+    self._control[_CLOSED] = 1
+
+  def reader(self, from_start=False):
+    # type: (bool) -> AnnotationReader
+    """Returns a reader of every frame published.
+
+    Args:
+      from_start: Whether to start with the oldest frame still held, rather
+        than the next frame published.
+    """
+    return AnnotationReader(self, from_start)
+
+  def close(self):
+    """Detaches from the bus, and removes it if this process created it.
+
+    Records read from the bus must no longer be referenced.
+    """
+    del self._control, self._headers, self._records
+    self._block.close()
+    if self._owner:
+      self._block.unlink()
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, exc_type, exc_value, traceback):
+    self.close()
+
+
+class AnnotationReader:
+  """A consumer's cursor over the frames of an AnnotationBus."""
+
+  def __init__(self, bus, from_start, poll_interval=0.0005):
+    # type: (AnnotationBus, bool, float) -> None
+    self._bus = bus
+    self._poll_interval = poll_interval
+    self.read_frames = 0
+    self.skipped = 0  # Frames overwritten before being read.
+    self._cursor = bus.head
+    if from_start:
+      self._cursor = max(0, self._cursor - bus.num_frames + 1)
+
+  def __iter__(self):
+    # type: () -> Iterator[AnnotationFrame]
+    while True:
+      frame = self.read()
+      if frame is None:
+        return
+      yield frame
+
+  def read(self, timeout=None):
+    # type: (Optional[float]) -> Optional[AnnotationFrame]
+    """Returns the next frame, polling until it is published.
+
+    Args:
+      timeout: Longest time to wait, in seconds. None waits forever.
+
+    Returns:
+      The frame, or None once the writer is closed and every frame was read.
+
+    Raises:
+      TimeoutError: If no frame was published in time.
+    """
+    # pylint: disable=protected-access
+    bus = self._bus
+    deadline = None if timeout is None else time.monotonic() + timeout
+    while True:
+      head = bus.head
+      if self._cursor < head:
+        # The header after the newest frame may already be being overwritten.
+        oldest = max(0, head - bus.num_frames + 1)
+        if self._cursor < oldest:
+          self.skipped += oldest - self._cursor
+          self._cursor = oldest
+          continue
+        index = self._cursor % bus.num_frames
+        tag = 2 * self._cursor + 2
+        timestamp, start, count = (float(bus._headers['timestamp'][index]),
+                                   int(bus._headers['start'][index]),
+                                   int(bus._headers['count'][index]))
+        position = start % bus.max_records
+        frame = AnnotationFrame(self._cursor, timestamp,
+                                bus._records[position:position + count], bus,
+                                index, tag, start)
+        self._cursor += 1
+        if not frame.valid():
+          # Overwritten already, as records wrap before headers do when
+          # frames have many annotations.
+          self.skipped += 1
+          continue
+        self.read_frames += 1
+        return frame
+      if bus.closed and self._cursor >= bus.head:
+        return None
+      if deadline is not None and time.monotonic() >= deadline:
+        raise TimeoutError('No frame published within {}s.'.format(timeout))
+      time.sleep(self._poll_interval)
+    # pylint: enable=protected-access
+
+
+def _class_id(class_name, label_list):
+  # type: (str, Optional[List[str]]) -> int
+  """Returns the index of a shot classification class in the label list."""
+  if label_list is None:
+    raise ValueError(
+        'Writing shot classification annotations needs the label list.')
+  try:
+    return label_list.index(class_name)
+  except ValueError:
+    raise ValueError('{!r} is not in the label list.'.format(class_name))
+
+
+def _records_offset(num_frames):
+  # type: (int) -> int
+  """Returns where the records start, aligned to a cache line."""
+  header = _CONTROL_SIZE * 8 + num_frames * _HEADER_DTYPE.itemsize
+  return (header + _ALIGNMENT - 1) // _ALIGNMENT * _ALIGNMENT
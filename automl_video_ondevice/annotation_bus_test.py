@@ -0,0 +1,119 @@
+# Lint as: python3
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+"""Tests for the shared memory annotation bus."""
+
+import unittest
+
+from automl_video_ondevice import annotation_bus
+from automl_video_ondevice.types import NormalizedBoundingBox
+from automl_video_ondevice.types import ObjectTrackingAnnotation
+from automl_video_ondevice.types import ShotClassificationAnnotation
+
+_LABELS = ['Cat', 'Dog']
+
+
+def _tracked(track_id, class_id, score):
+  return ObjectTrackingAnnotation(
+      timestamp=0,
+      track_id=track_id,
+      class_id=class_id,
+      class_name=_LABELS[class_id],
+      confidence_score=score,
+      bbox=NormalizedBoundingBox(left=0.1, top=0.2, right=0.3, bottom=0.4))
+
+
+class AnnotationBusTest(unittest.TestCase):
+
+  def setUp(self):
+    super().setUp()
+    self.bus = annotation_bus.AnnotationBus.create(num_frames=4,
+                                                   max_records=8)
+    self.consumer = annotation_bus.AnnotationBus.attach(self.bus.name)
+
+  def tearDown(self):
+    self.consumer.close()
+    self.bus.close()
+    super().tearDown()
+
+  def test_object_tracking_round_trip(self):
+    reader = self.consumer.reader()
+    annotations = [_tracked(1, 0, 0.5), _tracked(2, 1, 0.75)]
+    self.assertEqual(self.bus.write(10, annotations), 0)
+    frame = reader.read(timeout=1)
+    self.assertEqual(frame.timestamp, 10)
+    self.assertEqual(list(frame.records['class_id']), [0, 1])
+    self.assertTrue(frame.valid())
+    read = frame.annotations(_LABELS)
+    self.assertEqual([a.class_name for a in read], ['Cat', 'Dog'])
+    self.assertEqual([a.track_id for a in read], [1, 2])
+    self.assertEqual(read[1].confidence_score, 0.75)
+    self.assertAlmostEqual(read[0].bbox.bottom, 0.4, places=6)
+    self.assertEqual(read[0].timestamp, 10)
+
+  def test_shot_classification_round_trip(self):
+    reader = self.consumer.reader()
+    self.bus.write(5, [
+        ShotClassificationAnnotation(
+            timestamp=5, class_name='Dog', confidence_score=0.5), None
+    ], _LABELS)
+    frame = reader.read(timeout=1)
+    self.assertEqual(list(frame.records['class_id']), [1])
+    (annotation,) = frame.annotations(_LABELS)
+    self.assertIsInstance(annotation, ShotClassificationAnnotation)
+    self.assertEqual(annotation.class_name, 'Dog')
+    self.assertEqual(annotation.confidence_score, 0.5)
+
+  def test_shot_classification_needs_label_list(self):
+    shot = ShotClassificationAnnotation(
+        timestamp=0, class_name='Bird', confidence_score=0.5)
+    with self.assertRaisesRegex(ValueError, 'needs the label list'):
+      self.bus.write(0, [shot])
+    with self.assertRaisesRegex(ValueError, 'Bird'):
+      self.bus.write(0, [shot], _LABELS)
+    self.assertEqual(self.bus.head, 0)
+
+  def test_slow_reader_skips_overwritten_frames(self):
+    reader = self.consumer.reader(from_start=True)
+    for timestamp in range(10):
+      self.bus.write(timestamp, [_tracked(timestamp, 0, 0.5)])
+    self.bus.close_writer()
+    timestamps = [frame.timestamp for frame in reader]
+    self.assertEqual(timestamps, [7, 8, 9])
+    self.assertEqual(reader.skipped, 7)
+
+  def test_records_wrap_before_headers(self):
+    reader = self.consumer.reader()
+    self.bus.write(0, [_tracked(i, 0, 0.5) for i in range(5)])
+    frame = reader.read(timeout=1)
+    self.assertTrue(frame.valid())
+    # Five more records do not fit after the first five, and overwrite them.
+    self.bus.write(1, [_tracked(i, 0, 0.5) for i in range(5)])
+    self.assertFalse(frame.valid())
+    self.assertEqual(reader.read(timeout=1).timestamp, 1)
+
+  def test_only_the_creator_writes(self):
+    with self.assertRaises(ValueError):
+      self.consumer.write(0, [])
+    with self.assertRaises(ValueError):
+      self.consumer.close_writer()
+
+  def test_read_timeout(self):
+    with self.assertRaises(TimeoutError):
+      self.consumer.reader().read(timeout=0.01)
+
+
+if __name__ == '__main__':
+  unittest.main()
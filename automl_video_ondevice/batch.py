@@ -0,0 +1,269 @@
+# Lint as: python3
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+r"""Runs object tracking over a directory of video files and frame folders.
+
+Each worker process loads the model once, then files are handed out to
+workers as they become free. Results are written as one file per input, in any
+of the formats of the sinks module.
+
+Requires cv2 from `sudo apt-get install python3-opencv`
+
+  python3 -m automl_video_ondevice.batch \
+    --model data/traffic_model.tflite \
+    --labels data/traffic_label_map.pbtxt \
+    --input_dir data \
+    --output_dir /tmp/traffic_results
+"""
+
+import argparse
+import dataclasses
+import multiprocessing
+import os
+import time
+from typing import Iterator, List, Tuple
+
+import numpy as np
+from automl_video_ondevice import object_tracking as vot
+from automl_video_ondevice import prefork
+from automl_video_ondevice import sinks
+
+SINKS = {
+    'jsonl': sinks.JsonlSink,
+    'csv': sinks.CsvSink,
+    'binary': sinks.BinarySink,
+}
+
+VIDEO_EXTENSIONS = ('.mp4', '.avi', '.mov', '.mkv', '.webm')
+IMAGE_EXTENSIONS = ('.bmp', '.jpg', '.jpeg', '.png')
+
+# Per-process worker state, populated by _init_worker.
+_worker_engine = None
+_worker_initial_state = None
+_worker_config = None
+
+
+@dataclasses.dataclass
+class FileResult:
+  """Summary of a single processed input."""
+  input_path: str
+  output_path: str
+  frames: int
+  annotations: int
+  seconds: float
+
+
+def find_inputs(input_dir):
+  # type: (str) -> List[str]
+  """Finds every video file and frame folder under a directory.
+
+  A frame folder is any directory directly containing image files, such as
+  data/traffic_frames.
+
+  Args:
+    input_dir: The directory to walk.
+
+  Returns:
+    Sorted list of video file and frame folder paths.
+  """
+  inputs = []
+  for dirpath, _, filenames in os.walk(input_dir):
+    if any(name.lower().endswith(IMAGE_EXTENSIONS) for name in filenames):
+      inputs.append(dirpath)
+    for name in filenames:
+      if name.lower().endswith(VIDEO_EXTENSIONS):
+        inputs.append(os.path.join(dirpath, name))
+  return sorted(inputs)
+
+
+def iterate_frames(input_path, frame_rate):
+  # type: (str, float) -> Iterator[Tuple[int, np.ndarray]]
+  """Decodes a video file or frame folder.
+
+  Args:
+    input_path: Path of a video file or frame folder.
+    frame_rate: Frame rate assumed for frame folders, used for timestamps.
+
+  Yields:
+    Tuples of (timestamp in microseconds, BGR frame).
+  """
+  import cv2  # pylint: disable=g-import-not-at-top,import-outside-toplevel
+
+  if os.path.isdir(input_path):
+    names = sorted(
+        name for name in os.listdir(input_path)
+        if name.lower().endswith(IMAGE_EXTENSIONS))
+    for i, name in enumerate(names):
+      frame = cv2.imread(os.path.join(input_path, name))
+      if frame is not None:
+        yield int(i / frame_rate * 1000 * 1000), frame
+    return
+
+  cap = cv2.VideoCapture(input_path)
+  try:
+    while cap.isOpened():
+      ret, frame = cap.read()
+      if not ret:
+        break
+      yield int(cap.get(cv2.CAP_PROP_POS_MSEC) * 1000), frame
+  finally:
+    cap.release()
+
+
+def _init_worker(model_path, label_map_path, config):
+  """Loads the model once per worker process."""
+  global _worker_engine, _worker_initial_state, _worker_config
+  # Trackers and motion gates are attached per file, since they hold per-video
+  # state.
+  _worker_engine = vot.load(
+      model_path, label_map_path,
+      dataclasses.replace(
+          config, tracker=vot.Tracker.NONE, motion_threshold=0.0))
+  _worker_initial_state = _worker_engine.get_state()
+  _worker_config = config
+
+
+def _process_input(job):
+  # type: (Tuple[str, str, float, str, bool]) -> FileResult
+  """Runs the worker's engine over a single input, writing its results."""
+  import cv2  # pylint: disable=g-import-not-at-top,import-outside-toplevel
+
+  input_path, output_path, frame_rate, output_format, compress = job
+  start = time.monotonic()
+
+  # Every file starts from a clean recurrent state and a fresh tracker.
+  _worker_engine.set_state(_worker_initial_state)
+  engine = vot.attach_tracker(_worker_engine, _worker_config)
+  input_size = engine.input_size()
+
+  os.makedirs(os.path.dirname(output_path), exist_ok=True)
+  frames = 0
+  total_annotations = 0
+  # Batch output must be complete, so the sink may buffer every frame rather
+  # than dropping any.
+  with SINKS[output_format](
+      output_path, compress=compress, max_queue_size=0) as sink:
+    for timestamp, frame in iterate_frames(input_path, frame_rate):
+      resized_frame = cv2.resize(frame, (input_size.width, input_size.height))
+      rgb_frame = cv2.cvtColor(resized_frame, cv2.COLOR_BGR2RGB)
+
+      annotations = []
+      if not engine.run(timestamp, rgb_frame, annotations):
+        continue
+      frames += 1
+      total_annotations += len(annotations)
+      sink.write(timestamp, annotations)
+
+  return FileResult(
+      input_path=input_path,
+      output_path=output_path,
+      frames=frames,
+      annotations=total_annotations,
+      seconds=time.monotonic() - start)
+
+
+def _output_path(input_path, input_dir, output_dir, output_format):
+  relative_path = os.path.relpath(input_path, input_dir)
+  if relative_path == '.':
+    relative_path = os.path.basename(os.path.abspath(input_path))
+  return os.path.join(output_dir,
+                      relative_path + SINKS[output_format].extension)
+
+
+def main():
+  default_model = 'data/traffic_model.tflite'
+  default_labels = 'data/traffic_label_map.pbtxt'
+  parser = argparse.ArgumentParser()
+  parser.add_argument('--model', help='model path', default=default_model)
+  parser.add_argument(
+      '--labels', help='label file path', default=default_labels)
+  parser.add_argument(
+      '--input_dir',
+      help='directory of video files and frame folders',
+      required=True)
+  parser.add_argument(
+      '--output_dir', help='directory to write results to', required=True)
+  parser.add_argument(
+      '--threshold', type=float, default=0.2, help='class score threshold')
+  parser.add_argument(
+      '--use_tracker', action='store_true', help='use an object tracker')
+  parser.add_argument(
+      '--workers',
+      type=int,
+      default=os.cpu_count(),
+      help='number of worker processes')
+  parser.add_argument(
+      '--frame_rate',
+      type=float,
+      default=30.0,
+      help='frame rate assumed for frame folders')
+  parser.add_argument(
+      '--output_format',
+      choices=sorted(SINKS.keys()),
+      default='jsonl',
+      help='format of the result files')
+  parser.add_argument(
+      '--compress', action='store_true', help='gzip the result files')
+  args = parser.parse_args()
+
+  inputs = find_inputs(args.input_dir)
+  if not inputs:
+    print('No videos or frame folders found in {}.'.format(args.input_dir))
+    return
+  jobs = [(input_path,
+           _output_path(input_path, args.input_dir, args.output_dir,
+                        args.output_format), args.frame_rate,
+           args.output_format, args.compress) for input_path in inputs]
+
+  config = vot.ObjectTrackingConfig(
+      score_threshold=args.threshold,
+      tracker=vot.Tracker.FAST_INACCURATE
+      if args.use_tracker else vot.Tracker.NONE)
+
+  # Forked workers share the parent's already imported modules copy-on-write,
+  # instead of each importing OpenCV and numpy again.
+  import cv2  # pylint: disable=g-import-not-at-top,import-outside-toplevel,unused-import
+  if 'fork' in multiprocessing.get_all_start_methods():
+    context = multiprocessing.get_context('fork')
+    # Likewise for the model file and label map.
+    prefork.preload(args.model, args.labels)
+  else:
+    context = multiprocessing.get_context()
+
+  print('Processing {} inputs with {} workers.'.format(len(jobs), args.workers))
+  start = time.monotonic()
+  total_frames = 0
+  with context.Pool(
+      args.workers,
+      initializer=_init_worker,
+      initargs=(args.model, args.labels, config)) as pool:
+    # chunksize=1 hands out one file at a time, so long files do not hold up a
+    # queue of short ones behind them.
+    for i, result in enumerate(
+        pool.imap_unordered(_process_input, jobs, chunksize=1)):
+      total_frames += result.frames
+      latency = (result.seconds / result.frames *
+                 1000) if result.frames else 0.0
+      print('[{}/{}] {}: {} frames, {} annotations, {:.2f}s ({:.1f} ms/frame)'
+            .format(i + 1, len(jobs), result.input_path, result.frames,
+                    result.annotations, result.seconds, latency))
+
+  elapsed = time.monotonic() - start
+  print('Processed {} frames from {} inputs in {:.2f}s ({:.1f} fps).'.format(
+      total_frames, len(jobs), elapsed, total_frames / elapsed))
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,479 @@
+# Lint as: python3
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+r"""Reproducible latency and throughput benchmark for object tracking.
+
+Each configuration (model and tracker) runs for a fixed number of iterations
+over real frames, after a warm-up. Latency percentiles, throughput and the
+machine the benchmark ran on are output as JSON, so that results can be
+compared across hardware and releases.
+
+GPUs are hidden unless --allow_gpu is passed, so by default everything runs on
+the CPU.
+
+With --memory, the Python memory each frame uses and retains is also traced,
+along with how much the process's resident memory grew, and with --baseline
+the run fails if they grew compared to an earlier output.
+
+python3 -m automl_video_ondevice.benchmark \
+  --model data/traffic_model.tflite \
+  --labels data/traffic_label_map.pbtxt \
+  --trackers none,fast_inaccurate \
+  --iterations 200 \
+  --output /tmp/benchmark.json
+"""
+
+import argparse
+import contextlib
+import dataclasses
+import json
+import os
+import platform
+import resource
+import sys
+import time
+import tracemalloc
+from typing import Dict, List, Optional
+
+import numpy as np
+from automl_video_ondevice import object_tracking as vot
+from automl_video_ondevice import profiling
+from automl_video_ondevice.types import Size
+import automl_video_ondevice.utils as vot_utils
+
+IMAGE_EXTENSIONS = ('.bmp', '.jpg', '.jpeg', '.png')
+
+
+@dataclasses.dataclass
+class MemoryStats:
+  """Python memory use per frame, as traced by tracemalloc.
+
+  Only allocations made through Python and NumPy are traced, not those made
+  natively by TFLite, TensorFlow or OpenCV. Those show up in rss_growth_kb.
+  Memory allocated and freed within a run only shows in the peak; the block
+  count is of blocks still allocated after runs, not of every allocation.
+  """
+  iterations: int
+  peak_bytes_per_frame: float  # Mean of the peak traced memory within a run.
+  retained_bytes_per_frame: float  # Traced memory growth per run.
+  retained_blocks_per_frame: float  # Traced memory block growth per run.
+  # Resident memory growth of the process from before the engine was loaded
+  # to the end of the traced runs, or None where it cannot be read.
+  rss_growth_kb: Optional[int]
+  # The lines that retained the most memory, as "file:line size".
+  top_retained: List[str] = dataclasses.field(default_factory=list)
+
+
+@dataclasses.dataclass
+class BenchmarkResult:
+  """Latency and throughput of a single benchmark configuration."""
+  model: str
+  format: str
+  tracker: str
+  iterations: int
+  warmup_iterations: int
+  cold_latency_ms: float  # Latency of the very first run.
+  mean_latency_ms: float
+  p50_latency_ms: float
+  p90_latency_ms: float
+  p99_latency_ms: float
+  max_latency_ms: float
+  throughput_fps: float  # Timed iterations per second of wall time.
+  # Time spent in each stage inside the engine, with --profile only.
+  stages: Dict[str, profiling.StageStats] = dataclasses.field(
+      default_factory=dict)
+  # Allocations per frame, with --memory only.
+  memory: Optional[MemoryStats] = None
+
+
+def load_frames(frames_dir, input_size):
+  # type: (str, Size) -> List[np.ndarray]
+  """Loads a folder of images as RGB frames of the engine's input size.
+
+  Args:
+    frames_dir: Directory of image files, read in sorted order.
+    input_size: The size to resize frames to.
+
+  Returns:
+    The frames, ready to be passed to an engine.
+  """
+  import cv2  # pylint: disable=g-import-not-at-top,import-outside-toplevel
+
+  frames = []
+  for name in sorted(os.listdir(frames_dir)):
+    if not name.lower().endswith(IMAGE_EXTENSIONS):
+      continue
+    frame = cv2.imread(os.path.join(frames_dir, name))
+    if frame is None:
+      continue
+    resized_frame = cv2.resize(frame, (input_size.width, input_size.height))
+    frames.append(cv2.cvtColor(resized_frame, cv2.COLOR_BGR2RGB))
+  if not frames:
+    raise ValueError('No frames found in {}.'.format(frames_dir))
+  return frames
+
+
+def run_benchmark(engine,
+                  frames,
+                  iterations,
+                  warmup_iterations,
+                  frame_rate,
+                  profiler=None):
+  # pylint: disable=line-too-long
+  # type: (vot.BaseObjectDetectionInference, List[np.ndarray], int, int, float, Optional[profiling.Profiler]) -> dict
+  # pylint: enable=line-too-long
+  """Times an engine over frames, cycling through them as needed.
+
+  Args:
+    engine: A loaded engine, optionally wrapped by a tracker.
+    frames: Frames of the engine's input size.
+    iterations: How many runs are timed.
+    warmup_iterations: How many runs happen before timing starts.
+    frame_rate: Frame rate used to compute timestamps.
+    profiler: If set, records the stages of the timed runs.
+
+  Returns:
+    Dictionary of the latency and throughput fields of BenchmarkResult.
+  """
+  frame_interval_us = 1000 * 1000 / frame_rate
+
+  def timed_run(i):
+    annotations = []
+    run_start = time.perf_counter()
+    engine.run(int(i * frame_interval_us), frames[i % len(frames)], annotations)
+    return (time.perf_counter() - run_start) * 1000
+
+  cold_latency_ms = float('nan')
+  for i in range(warmup_iterations):
+    latency_ms = timed_run(i)
+    if i == 0:
+      cold_latency_ms = latency_ms
+
+  latencies_ms = []
+  with profiler or contextlib.nullcontext():
+    start = time.perf_counter()
+    for i in range(warmup_iterations, warmup_iterations + iterations):
+      latencies_ms.append(timed_run(i))
+    elapsed = time.perf_counter() - start
+  if not warmup_iterations:
+    cold_latency_ms = latencies_ms[0]
+
+  p50, p90, p99 = np.percentile(latencies_ms, [50, 90, 99])
+  return {
+      'cold_latency_ms': cold_latency_ms,
+      'mean_latency_ms': float(np.mean(latencies_ms)),
+      'p50_latency_ms': float(p50),
+      'p90_latency_ms': float(p90),
+      'p99_latency_ms': float(p99),
+      'max_latency_ms': float(np.max(latencies_ms)),
+      'throughput_fps': iterations / elapsed,
+  }
+
+
+def current_rss_kb():
+  # type: () -> Optional[int]
+  """Returns the resident memory of the process now, or None if unknown.
+
+  Unlike ru_maxrss, which only ever grows over the process's lifetime, this
+  goes down as memory is freed, so that differences between two points are
+  attributable to what ran in between.
+  """
+  try:
+    with open('/proc/self/statm', 'r') as f:
+      resident_pages = int(f.read().split()[1])
+  except (OSError, ValueError, IndexError):
+    return None
+  return resident_pages * resource.getpagesize() // 1024
+
+
+def measure_memory(engine,
+                   frames,
+                   iterations,
+                   first_index,
+                   frame_rate,
+                   start_rss_kb=None):
+  # pylint: disable=line-too-long
+  # type: (vot.BaseObjectDetectionInference, List[np.ndarray], int, int, float, Optional[int]) -> MemoryStats
+  # pylint: enable=line-too-long
+  """Traces the Python memory use of an engine over frames.
+
+  Tracing slows every allocation down, so this runs separately from timing.
+
+  Args:
+    engine: A loaded and warmed up engine, optionally wrapped by a tracker.
+    frames: Frames of the engine's input size.
+    iterations: How many runs are traced.
+    first_index: Index of the first frame, continuing after earlier runs so
+      that timestamps keep increasing.
+    frame_rate: Frame rate used to compute timestamps.
+    start_rss_kb: Resident memory before the engine was loaded, as returned by
+      current_rss_kb, which the resident memory growth is measured from.
+
+  Returns:
+    The memory use per frame.
+  """
+  frame_interval_us = 1000 * 1000 / frame_rate
+  was_tracing = tracemalloc.is_tracing()
+  if not was_tracing:
+    tracemalloc.start()
+  try:
+    start_snapshot = tracemalloc.take_snapshot()
+    start_bytes, _ = tracemalloc.get_traced_memory()
+    peak_bytes = []
+    for i in range(first_index, first_index + iterations):
+      before_bytes, _ = tracemalloc.get_traced_memory()
+      tracemalloc.reset_peak()
+      annotations = []
+      engine.run(int(i * frame_interval_us), frames[i % len(frames)],
+                 annotations)
+      del annotations
+      _, peak = tracemalloc.get_traced_memory()
+      peak_bytes.append(peak - before_bytes)
+    end_bytes, _ = tracemalloc.get_traced_memory()
+    differences = tracemalloc.take_snapshot().compare_to(
+        start_snapshot, 'lineno')
+  finally:
+    if not was_tracing:
+      tracemalloc.stop()
+
+  top_retained = [
+      '{}:{} {:+d}B'.format(difference.traceback[0].filename,
+                            difference.traceback[0].lineno,
+                            difference.size_diff)
+      for difference in differences[:5]
+      if difference.size_diff > 0
+  ]
+  retained_blocks = sum(difference.count_diff for difference in differences)
+  end_rss_kb = current_rss_kb()
+  rss_growth_kb = None
+  if start_rss_kb is not None and end_rss_kb is not None:
+    rss_growth_kb = end_rss_kb - start_rss_kb
+  return MemoryStats(
+      iterations=iterations,
+      peak_bytes_per_frame=float(np.mean(peak_bytes)),
+      retained_bytes_per_frame=(end_bytes - start_bytes) / iterations,
+      retained_blocks_per_frame=retained_blocks / iterations,
+      rss_growth_kb=rss_growth_kb,
+      top_retained=top_retained)
+
+
+def compare_to_baseline(results,
+                        baseline,
+                        tolerance,
+                        slack_bytes,
+                        slack_rss_kb=1024.0):
+  # type: (List[BenchmarkResult], dict, float, float, float) -> List[str]
+  """Checks memory results against an earlier benchmark output.
+
+  Args:
+    results: Results of the current run, with memory measured.
+    baseline: A JSON report written by an earlier run with --memory.
+    tolerance: Allowed relative increase, e.g. 0.1 for 10%.
+    slack_bytes: Allowed absolute increase per frame, so that values close to
+      zero do not fail on noise.
+    slack_rss_kb: Allowed absolute increase of the resident memory growth.
+
+  Returns:
+    A description of every regression; empty if there are none.
+  """
+  baseline_memory = {(result['model'], result['tracker']): result['memory']
+                     for result in baseline.get('results', [])
+                     if result.get('memory')}
+  regressions = []
+  for result in results:
+    expected = baseline_memory.get((result.model, result.tracker))
+    if result.memory is None or expected is None:
+      continue
+    for field in ('peak_bytes_per_frame', 'retained_bytes_per_frame'):
+      actual = getattr(result.memory, field)
+      limit = expected[field] * (1 + tolerance) + slack_bytes
+      if actual > limit:
+        regressions.append('{} [{}]: {} is {:.0f}, baseline {:.0f}'.format(
+            result.model, result.tracker, field, actual, expected[field]))
+    actual_rss = result.memory.rss_growth_kb
+    expected_rss = expected.get('rss_growth_kb')
+    if actual_rss is None or expected_rss is None:
+      continue
+    if actual_rss > max(expected_rss, 0) * (1 + tolerance) + slack_rss_kb:
+      regressions.append('{} [{}]: rss_growth_kb is {}, baseline {}'.format(
+          result.model, result.tracker, actual_rss, expected_rss))
+  return regressions
+
+
+def environment():
+  # type: () -> dict
+  """Describes the machine and software the benchmark runs on."""
+  return {
+      'platform': platform.platform(),
+      'machine': platform.machine(),
+      'processor': platform.processor(),
+      'cpu_count': os.cpu_count(),
+      'python': platform.python_version(),
+      'numpy': np.__version__,
+  }
+
+
+def main():
+  parser = argparse.ArgumentParser()
+  parser.add_argument(
+      '--model',
+      action='append',
+      help='model path; may be passed several times to compare engines')
+  parser.add_argument(
+      '--labels',
+      help='label file path',
+      default='data/traffic_label_map.pbtxt')
+  parser.add_argument(
+      '--trackers',
+      default='none',
+      help='comma separated trackers to benchmark each model with, e.g. '
+      'none,fast_inaccurate,basic')
+  parser.add_argument(
+      '--frames_dir',
+      default='data/traffic_frames',
+      help='directory of frames to run on')
+  parser.add_argument(
+      '--iterations', type=int, default=200, help='number of timed runs')
+  parser.add_argument(
+      '--warmup', type=int, default=10, help='number of runs before timing')
+  parser.add_argument(
+      '--threshold', type=float, default=0.2, help='class score threshold')
+  parser.add_argument(
+      '--frame_rate',
+      type=float,
+      default=30.0,
+      help='frame rate used for timestamps')
+  parser.add_argument(
+      '--allow_gpu',
+      action='store_true',
+      help='let TensorFlow models use GPUs instead of only the CPU')
+  parser.add_argument(
+      '--profile',
+      action='store_true',
+      help='also time each stage inside the engines and trackers')
+  parser.add_argument(
+      '--memory',
+      action='store_true',
+      help='also trace Python memory use per frame with tracemalloc')
+  parser.add_argument(
+      '--memory_iterations',
+      type=int,
+      default=50,
+      help='number of runs traced with --memory')
+  parser.add_argument(
+      '--baseline',
+      help='JSON output of an earlier --memory run; exits with an error if '
+      'memory use regressed compared to it')
+  parser.add_argument(
+      '--tolerance',
+      type=float,
+      default=0.1,
+      help='allowed relative memory increase over the baseline')
+  parser.add_argument(
+      '--slack_bytes',
+      type=float,
+      default=1024.0,
+      help='allowed absolute increase of bytes per frame over the baseline')
+  parser.add_argument(
+      '--slack_rss_kb',
+      type=float,
+      default=1024.0,
+      help='allowed absolute increase of resident memory growth over the '
+      'baseline, in kB')
+  parser.add_argument(
+      '--output', help='file to write JSON results to; defaults to stdout')
+  args = parser.parse_args()
+
+  if args.iterations < 1:
+    raise ValueError('--iterations must be at least 1.')
+  if not args.allow_gpu:
+    os.environ['CUDA_VISIBLE_DEVICES'] = '-1'
+  model_paths = args.model or ['data/traffic_model.tflite']
+  trackers = [
+      vot.Tracker[name.strip().upper()] for name in args.trackers.split(',')
+  ]
+
+  # Without --output, stdout only gets the JSON report, so that it can be
+  # piped or stored as a baseline. Progress, including what the library
+  # prints while loading, goes to stderr.
+  log = sys.stdout if args.output else sys.stderr
+  with contextlib.redirect_stdout(log):
+    results = []
+    for model_path in model_paths:
+      for tracker in trackers:
+        config = vot.ObjectTrackingConfig(
+            score_threshold=args.threshold, tracker=tracker)
+        start_rss_kb = current_rss_kb()
+        engine = vot.load(model_path, args.labels, config)
+        frames = load_frames(args.frames_dir, engine.input_size())
+        profiler = profiling.Profiler() if args.profile else None
+        result = BenchmarkResult(
+            model=model_path,
+            format=vot_utils.format_from_filename(model_path).name.lower(),
+            tracker=tracker.name.lower(),
+            iterations=args.iterations,
+            warmup_iterations=args.warmup,
+            **run_benchmark(engine, frames, args.iterations, args.warmup,
+                            args.frame_rate, profiler))
+        if profiler is not None:
+          result.stages = profiler.stats()
+        if args.memory:
+          result.memory = measure_memory(engine, frames, args.memory_iterations,
+                                         args.warmup + args.iterations,
+                                         args.frame_rate, start_rss_kb)
+        results.append(result)
+        print('{} [{}]: p50 {:.1f}ms, p90 {:.1f}ms, p99 {:.1f}ms, '
+              'max {:.1f}ms, {:.1f} fps'.format(result.model, result.tracker,
+                                                result.p50_latency_ms,
+                                                result.p90_latency_ms,
+                                                result.p99_latency_ms,
+                                                result.max_latency_ms,
+                                                result.throughput_fps))
+        if profiler is not None:
+          print(profiler.summary())
+        if result.memory is not None:
+          print('  memory: peak {:.0f}B/frame, retained {:.0f}B/frame, '
+                '{:.1f} blocks/frame, RSS growth {}kB'.format(
+                    result.memory.peak_bytes_per_frame,
+                    result.memory.retained_bytes_per_frame,
+                    result.memory.retained_blocks_per_frame,
+                    result.memory.rss_growth_kb))
+        del engine
+
+  report = {
+      'environment': environment(),
+      'frames_dir': args.frames_dir,
+      'results': [dataclasses.asdict(result) for result in results],
+  }
+  if args.output:
+    with open(args.output, 'w') as f:
+      json.dump(report, f, indent=2)
+  else:
+    json.dump(report, sys.stdout, indent=2)
+    print()
+
+  if args.baseline:
+    with open(args.baseline, 'r') as f:
+      baseline = json.load(f)
+    regressions = compare_to_baseline(results, baseline, args.tolerance,
+                                      args.slack_bytes, args.slack_rss_kb)
+    for regression in regressions:
+      print('Memory regression: ' + regression, file=sys.stderr)
+    if regressions:
+      sys.exit(1)
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,322 @@
+# Lint as: python3
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+r"""Evaluates throughput against accuracy over a sweep of operating points.
+
+Runs object tracking over a labeled clip for every combination of score
+threshold, detection interval, tracker and input resolution. Reports
+throughput, precision, recall, F1 and ID switches of each, and marks the
+Pareto frontier: the operating points that no other point beats on both
+throughput and accuracy.
+
+Ground truth is a JSONL file in the format written by sinks.JsonlSink, with one
+line per frame of the clip, in order. Objects should have a track_id for ID
+switches to be counted. Without human labels, --make_reference writes the
+model's own output at interval 1 and without tracking, which then measures how
+far faster operating points drift from the full-quality one.
+
+The model's input size is fixed, so resolution sets the size frames are
+captured at: frames are downscaled to it before being resized to the input
+size, as a lower-resolution camera would provide them.
+
+python3 -m automl_video_ondevice.evaluate \
+  --model data/traffic_model.tflite \
+  --labels data/traffic_label_map.pbtxt \
+  --frames_dir data/traffic_frames \
+  --ground_truth /tmp/traffic_ground_truth.jsonl \
+  --thresholds 0.2,0.3,0.4 \
+  --intervals 1,2,4 \
+  --trackers none,fast_inaccurate \
+  --resolutions native,0.5 \
+  --output /tmp/operating_points.json
+"""
+
+import argparse
+import dataclasses
+import itertools
+import json
+import time
+from typing import List, Optional, Tuple
+
+import numpy as np
+from automl_video_ondevice import batch
+from automl_video_ondevice import object_tracking as vot
+from automl_video_ondevice import sinks
+from automl_video_ondevice.object_tracking import registry
+from automl_video_ondevice.object_tracking import synthetic
+
+QUALITY_METRICS = ('f1', 'precision', 'recall')
+_WARMUP_ITERATIONS = 3
+
+
+@dataclasses.dataclass
+class OperatingPoint:
+  score_threshold: float
+  detection_interval: int
+  tracker: str
+  # 'native', a scale such as '0.5', or a size such as '320x240'.
+  resolution: str
+
+
+@dataclasses.dataclass
+class EvaluationResult:
+  """Throughput and accuracy of a single operating point."""
+  point: OperatingPoint
+  frames: int
+  fps: float  # Including resizing, as a camera pipeline would.
+  mean_latency_ms: float
+  precision: float
+  recall: float
+  f1: float
+  id_switches: Optional[int]  # None if the ground truth has no track ids.
+  pareto: bool = False
+
+
+def load_ground_truth(path):
+  # type: (str) -> List[List[vot.ObjectTrackingAnnotation]]
+  """Reads the annotations of every frame from a JSONL ground truth file."""
+  return [annotations for _, annotations in sinks.read_jsonl(path)]
+
+
+def capture_size(resolution, width, height):
+  # type: (str, int, int) -> Tuple[int, int]
+  """Returns the (width, height) frames are captured at for a resolution."""
+  if resolution == 'native':
+    return width, height
+  if 'x' in resolution:
+    capture_width, capture_height = resolution.split('x')
+    return int(capture_width), int(capture_height)
+  scale = float(resolution)
+  return max(1, int(round(width * scale))), max(1, int(round(height * scale)))
+
+
+def evaluate_point(engine_registry, model_path, label_map_path, point, frames,
+                   ground_truth, min_iou):
+  # pylint: disable=line-too-long
+  # type: (registry.EngineRegistry, str, str, OperatingPoint, List[Tuple[int, np.ndarray]], List[List[vot.ObjectTrackingAnnotation]], float) -> EvaluationResult
+  # pylint: enable=line-too-long
+  """Runs a clip at a single operating point, scoring it against ground truth.
+
+  Args:
+    engine_registry: Shares the loaded model between operating points, as
+      long as the caller holds a stream of it.
+    model_path: Path to the model.
+    label_map_path: Path to the labelmap .pbtxt file.
+    point: The operating point to evaluate.
+    frames: (timestamp, BGR frame) of every frame of the clip.
+    ground_truth: Annotations of every frame, in the same order.
+    min_iou: How much a predicted box must overlap a ground truth box of the
+      same class to count as a match.
+
+  Returns:
+    The throughput and accuracy of the operating point.
+  """
+  import cv2  # pylint: disable=g-import-not-at-top,import-outside-toplevel
+
+  config = vot.ObjectTrackingConfig(
+      score_threshold=point.score_threshold,
+      tracker=vot.Tracker[point.tracker.upper()],
+      detection_interval=point.detection_interval,
+      warmup_iterations=_WARMUP_ITERATIONS)
+  stream = engine_registry.load(model_path, label_map_path, config)
+  input_size = stream.input_size()
+
+  has_track_ids = any(
+      annotation.track_id >= 0
+      for annotations in ground_truth
+      for annotation in annotations)
+  scorer = synthetic.TrackScorer(min_iou, match_classes=True)
+  predicted = 0
+  elapsed = 0.0
+  try:
+    for (timestamp, frame), expected in zip(frames, ground_truth):
+      height, width = frame.shape[:2]
+      start = time.perf_counter()
+      captured = cv2.resize(frame,
+                            capture_size(point.resolution, width, height))
+      resized = cv2.resize(captured, (input_size.width, input_size.height))
+      rgb_frame = cv2.cvtColor(resized, cv2.COLOR_BGR2RGB)
+      annotations = []
+      stream.run(timestamp, rgb_frame, annotations)
+      elapsed += time.perf_counter() - start
+
+      predicted += len(annotations)
+      scorer.update(expected, [False] * len(expected), annotations)
+  finally:
+    engine_registry.release(stream)
+
+  precision = scorer.matches / predicted if predicted else 0.0
+  recall = scorer.matches / (scorer.matches + scorer.misses) if (
+      scorer.matches + scorer.misses) else 0.0
+  f1 = 2 * precision * recall / (precision + recall) if (precision +
+                                                          recall) else 0.0
+  return EvaluationResult(
+      point=point,
+      frames=len(frames),
+      fps=len(frames) / elapsed if elapsed else 0.0,
+      mean_latency_ms=elapsed / len(frames) * 1000 if frames else 0.0,
+      precision=precision,
+      recall=recall,
+      f1=f1,
+      id_switches=scorer.id_switches if has_track_ids else None)
+
+
+def mark_pareto_frontier(results, quality_metric='f1'):
+  # type: (List[EvaluationResult], str) -> None
+  """Marks the results that no other result beats on both fps and quality."""
+  for result in results:
+    quality = getattr(result, quality_metric)
+    result.pareto = not any(
+        other.fps >= result.fps and
+        getattr(other, quality_metric) >= quality and
+        (other.fps > result.fps or getattr(other, quality_metric) > quality)
+        for other in results)
+
+
+def make_reference(model_path, label_map_path, frames, score_threshold, path):
+  # type: (str, str, List[Tuple[int, np.ndarray]], float, str) -> None
+  """Writes the model's full-quality output as reference ground truth."""
+  import cv2  # pylint: disable=g-import-not-at-top,import-outside-toplevel
+
+  engine = vot.load(model_path, label_map_path,
+                    vot.ObjectTrackingConfig(score_threshold=score_threshold))
+  input_size = engine.input_size()
+  with sinks.JsonlSink(path, max_queue_size=0) as sink:
+    for timestamp, frame in frames:
+      resized = cv2.resize(frame, (input_size.width, input_size.height))
+      annotations = []
+      engine.run(timestamp, cv2.cvtColor(resized, cv2.COLOR_BGR2RGB),
+                 annotations)
+      sink.write(timestamp, annotations)
+
+
+def main():
+  parser = argparse.ArgumentParser()
+  parser.add_argument(
+      '--model', help='model path', default='data/traffic_model.tflite')
+  parser.add_argument(
+      '--labels',
+      help='label file path',
+      default='data/traffic_label_map.pbtxt')
+  parser.add_argument(
+      '--frames_dir',
+      default='data/traffic_frames',
+      help='directory of frames, or a video file, of the labeled clip')
+  parser.add_argument(
+      '--ground_truth',
+      required=True,
+      help='JSONL ground truth, one line per frame')
+  parser.add_argument(
+      '--make_reference',
+      action='store_true',
+      help='write the model output to --ground_truth first, as pseudo labels')
+  parser.add_argument(
+      '--reference_threshold',
+      type=float,
+      default=0.2,
+      help='score threshold of the reference written by --make_reference')
+  parser.add_argument(
+      '--thresholds', default='0.2,0.3,0.4', help='score thresholds to sweep')
+  parser.add_argument(
+      '--intervals', default='1,2,4', help='detection intervals to sweep')
+  parser.add_argument(
+      '--trackers', default='none,fast_inaccurate', help='trackers to sweep')
+  parser.add_argument(
+      '--resolutions',
+      default='native',
+      help='capture resolutions to sweep: native, a scale or WIDTHxHEIGHT')
+  parser.add_argument(
+      '--frame_rate',
+      type=float,
+      default=30.0,
+      help='frame rate assumed for frame folders')
+  parser.add_argument(
+      '--min_iou',
+      type=float,
+      default=0.5,
+      help='overlap for a prediction to match a ground truth box')
+  parser.add_argument(
+      '--quality',
+      choices=QUALITY_METRICS,
+      default='f1',
+      help='accuracy metric the Pareto frontier is computed with')
+  parser.add_argument('--output', help='file to write JSON results to')
+  args = parser.parse_args()
+
+  frames = list(batch.iterate_frames(args.frames_dir, args.frame_rate))
+  if args.make_reference:
+    make_reference(args.model, args.labels, frames, args.reference_threshold,
+                   args.ground_truth)
+  ground_truth = load_ground_truth(args.ground_truth)
+  if len(ground_truth) != len(frames):
+    raise ValueError('Ground truth has {} frames, but the clip has {}.'.format(
+        len(ground_truth), len(frames)))
+
+  points = []
+  for threshold, interval, tracker, resolution in itertools.product(
+      args.thresholds.split(','), args.intervals.split(','),
+      args.trackers.split(','), args.resolutions.split(',')):
+    tracker = tracker.strip().lower()
+    # The interval only changes anything with a tracker.
+    if tracker == 'none' and int(interval) != 1:
+      continue
+    points.append(
+        OperatingPoint(
+            score_threshold=float(threshold),
+            detection_interval=int(interval),
+            tracker=tracker,
+            resolution=resolution.strip()))
+
+  engine_registry = registry.EngineRegistry()
+  # Holds on to the model for the whole sweep, so that it is loaded and warmed
+  # up once rather than for every operating point.
+  model = engine_registry.load(
+      args.model, args.labels,
+      vot.ObjectTrackingConfig(warmup_iterations=_WARMUP_ITERATIONS))
+  try:
+    results = [
+        evaluate_point(engine_registry, args.model, args.labels, point,
+                       frames, ground_truth, args.min_iou) for point in points
+    ]
+  finally:
+    engine_registry.release(model)
+  mark_pareto_frontier(results, args.quality)
+
+  print('{:>9} {:>8} {:<16} {:<10} {:>7} {:>9} {:>7} {:>6} {:>11}'.format(
+      'threshold', 'interval', 'tracker', 'resolution', 'fps', 'precision',
+      'recall', 'f1', 'id switches'))
+  for result in sorted(results, key=lambda r: -r.fps):
+    point = result.point
+    print('{:>9.2f} {:>8} {:<16} {:<10} {:>7.2f} {:>9.3f} {:>7.3f} {:>6.3f} '
+          '{:>11} {}'.format(
+              point.score_threshold, point.detection_interval, point.tracker,
+              point.resolution, result.fps, result.precision, result.recall,
+              result.f1,
+              '-' if result.id_switches is None else result.id_switches,
+              '*' if result.pareto else ''))
+  print('* Pareto frontier of fps and {}.'.format(args.quality))
+
+  if args.output:
+    with open(args.output, 'w') as f:
+      json.dump({
+          'quality_metric': args.quality,
+          'results': [dataclasses.asdict(result) for result in results],
+      },
+                f,
+                indent=2)
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,372 @@
+# Lint as: python3
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+"""Hands frames from a capture process to inference workers in shared memory.
+
+A FrameBus is a ring of fixed-size frame slots in a multiprocessing
+shared_memory block. A single writer publishes frames into the slots in turn,
+and any number of readers, in any process, get NumPy views of the slots, which
+engines can run on without the frame ever being copied or pickled.
+
+Every slot carries a sequence tag, written as a seqlock: odd while the writer
+fills the slot, and even once the frame is complete. Readers check the tag
+before and after use, so a frame overwritten while a worker was still running
+on it is detected rather than silently mixed up.
+
+Frames are handed out without locks: each reader has a cursor that steps
+through the frame sequence with a stride. Workers i of n read frames i, i + n,
+i + 2n and so on, so that n workers split the stream between themselves. A
+reader with a stride of 1 sees every frame. A reader that falls more than a
+ring behind skips to the oldest frame still available, counting the frames it
+missed.
+
+Example:
+  # Capture process.
+  bus = frame_bus.FrameBus.create(num_slots=16, shape=(256, 256, 3))
+  for timestamp, frame in frames:
+    bus.write(timestamp, frame)
+  bus.close_writer()
+
+  # Worker i of n, given bus.name.
+  bus = frame_bus.FrameBus.attach(name)
+  reader = bus.reader(index=i, stride=n)
+  for frame in reader:
+    annotations = []
+    engine.run(frame.timestamp, frame.image, annotations)
+    if frame.valid():
+      publish(annotations)
+"""
+
+import dataclasses
+import time
+from typing import Iterator, Optional, Tuple
+
+import numpy as np
+
+try:
+  from multiprocessing import shared_memory  # pylint: disable=g-import-not-at-top
+except ImportError:  # Before Python 3.8.
+  shared_memory = None
+
+_MAGIC = 0x46425553  # 'FBUS'
+# Indices into the control block.
+_MAGIC_INDEX = 0
+_NUM_SLOTS = 1
+_DTYPE = 2
+_NDIM = 3
+_SHAPE = 4  # Up to 4 dimensions.
+_HEAD = 8  # Number of frames published so far.
+_CLOSED = 9  # Set once the writer will publish no more frames.
+_CONTROL_SIZE = 16
+_SLOT_FIELDS = 2  # Sequence tag, timestamp.
+_ALIGNMENT = 64
+
+
+@dataclasses.dataclass
+class BusFrame:
+  """A frame read from the bus, viewed in place in shared memory."""
+  sequence: int  # Position in the stream of published frames.
+  timestamp: int
+  image: np.ndarray  # Read-only view of the slot.
+  _slots: np.ndarray
+  _slot: int
+  _tag: int
+
+  def valid(self):
+    # type: () -> bool
+    """Returns whether the slot still holds this frame.
+
+    Check after using the image: False means the writer reused the slot in
+    the meantime, and results computed from the image must be discarded.
+    """
+    return int(self._slots[self._slot, 0]) == self._tag
+
+
+def attach_shared_memory(name):
+  """Attaches to an existing block without taking ownership of it."""
+  try:
+    return shared_memory.SharedMemory(name=name, track=False)
+  except TypeError:  # Before Python 3.13, attaching always registers.
+    pass
+  # pylint: disable=g-import-not-at-top,import-outside-toplevel,protected-access
+  from multiprocessing import resource_tracker
+  # Children of the creator share its resource tracker. Any other process
+  # starts its own, which would unlink the block when the process exits,
+  # although the creator still owns it.
+  own_tracker = resource_tracker._resource_tracker._fd is None
+  block = shared_memory.SharedMemory(name=name)
+  if own_tracker:
+    resource_tracker.unregister(block._name, 'shared_memory')
+  # pylint: enable=g-import-not-at-top,import-outside-toplevel,protected-access
+  return block
+
+
+class FrameBus:
+  """A shared memory ring of frame slots, with one writer."""
+
+  def __init__(self, block, owner):
+    """Use FrameBus.create or FrameBus.attach instead."""
+    self._block = block
+    self._owner = owner
+    self._control = np.ndarray((_CONTROL_SIZE,),
+                               dtype=np.int64,
+                               buffer=block.buf)
+    if self._control[_MAGIC_INDEX] != _MAGIC:
+      raise ValueError('{} is not a frame bus.'.format(block.name))
+    self.num_slots = int(self._control[_NUM_SLOTS])
+    self.dtype = np.dtype(chr(self._control[_DTYPE]))
+    self.shape = tuple(
+        int(size)
+        for size in self._control[_SHAPE:_SHAPE + self._control[_NDIM]])
+    self._slots = np.ndarray((self.num_slots, _SLOT_FIELDS),
+                             dtype=np.int64,
+                             buffer=block.buf,
+                             offset=_CONTROL_SIZE * 8)
+    self._frames = np.ndarray((self.num_slots,) + self.shape,
+                              dtype=self.dtype,
+                              buffer=block.buf,
+                              offset=_data_offset(self.num_slots))
+    if not owner:
+      self._frames.flags.writeable = False
+
+  @classmethod
+  def create(cls, shape, dtype=np.uint8, num_slots=8, name=None):
+    # type: (Tuple[int, ...], np.dtype, int, Optional[str]) -> FrameBus
+    """Creates a bus, owned by the calling process, which is its writer.
+
+    Args:
+      shape: Shape of every frame, such as (height, width, 3).
+      dtype: Data type of every frame.
+      num_slots: How many frames the ring holds. Readers more than this many
+        frames behind the writer skip frames.
+      name: Name of the shared memory block, or None for a unique one.
+
+    Returns:
+      The bus. Readers in other processes attach to it by its name.
+    """
+    if shared_memory is None:
+      raise RuntimeError('The frame bus needs Python 3.8 or later.')
+    if not 1 <= len(shape) <= 4:
+      raise ValueError('Frames must have 1 to 4 dimensions.')
+    if num_slots < 2:
+      raise ValueError('The frame bus needs at least 2 slots.')
+    dtype = np.dtype(dtype)
+    size = _data_offset(num_slots) + num_slots * int(
+        np.prod(shape)) * dtype.itemsize
+    block = shared_memory.SharedMemory(name=name, create=True, size=size)
+    control = np.ndarray((_CONTROL_SIZE,), dtype=np.int64, buffer=block.buf)
+    control[:] = 0
+    control[_NUM_SLOTS] = num_slots
+    control[_DTYPE] = ord(dtype.char)
+    control[_NDIM] = len(shape)
+    control[_SHAPE:_SHAPE + len(shape)] = shape
+    np.ndarray((num_slots, _SLOT_FIELDS),
+               dtype=np.int64,
+               buffer=block.buf,
+               offset=_CONTROL_SIZE * 8)[:] = 0
+    # Written last, so that attaching never sees a partial header.
+    control[_MAGIC_INDEX] = _MAGIC
+    del control
+    return cls(block, owner=True)
+
+  @classmethod
+  def attach(cls, name):
+    # type: (str) -> FrameBus
+    """Attaches to a bus created by another process, to read from it."""
+    if shared_memory is None:
+      raise RuntimeError('The frame bus needs Python 3.8 or later.')
+    return cls(attach_shared_memory(name), owner=False)
+
+  @property
+  def name(self):
+    # type: () -> str
+    return self._block.name
+
+  @property
+  def head(self):
+    # type: () -> int
+    """Number of frames published so far."""
+    return int(self._control[_HEAD])
+
+  @property
+  def closed(self):
+    # type: () -> bool
+    return bool(self._control[_CLOSED])
+
+  def slot(self):
+    # type: () -> np.ndarray
+    """Returns the writable slot the next frame is published from.
+
+    Decoding straight into it, e.g. with cv2.VideoCapture.read(bus.slot()),
+    saves write() copying the frame. Call publish() once it is filled.
+    """
+    self._check_writer()
+    sequence = self.head
+    slot = sequence % self.num_slots
+    # Odd while being written: readers of the frame this slot held see it
+    # was overwritten.
+    self._slots[slot, 0] = 2 * sequence + 1
+    return self._frames[slot]
+
+  def publish(self, timestamp):
+    # type: (int) -> int
+    """Publishes the frame filled into slot(), returning its sequence."""
+    self._check_writer()
+    sequence = self.head
+    slot = sequence % self.num_slots
+    if self._slots[slot, 0] != 2 * sequence + 1:
+      raise RuntimeError('publish() called without slot().')
+    self._slots[slot, 1] = timestamp
+    self._slots[slot, 0] = 2 * sequence + 2
+    self._control[_HEAD] = sequence + 1
+    return sequence
+
+  def write(self, timestamp, frame):
+    # type: (int, np.ndarray) -> int
+    """Copies a frame into the next slot and publishes it.
+
+    Args:
+      timestamp: The frame's timestamp.
+      frame: Array of the bus's shape. It is cast to the bus's dtype.
+
+    Returns:
+      The frame's sequence number.
+    """
+    np.copyto(self.slot(), frame, casting='unsafe')
+    return self.publish(timestamp)
+
+  def close_writer(self):
+    """Tells readers no more frames will be published."""
+    self._check_writer()
+    self._control[_CLOSED] = 1
+
+  def reader(self, index=0, stride=1, from_start=False):
+    # type: (int, int, bool) -> BusReader
+    """Returns a reader of every stride-th frame, starting at index.
+
+    Args:
+      index: Which frames of each group of stride frames to read, in
+        [0, stride).
+      stride: Number of readers splitting the stream between themselves.
+      from_start: Whether to start with the oldest frame still in the ring,
+        rather than the next frame published.
+    """
+    if not 0 <= index < stride:
+      raise ValueError('Reader index must be in [0, stride).')
+    return BusReader(self, index, stride, from_start)
+
+  def close(self):
+    """Detaches from the bus, and removes it if this process created it.
+
+    Frames read from the bus must no longer be referenced.
+    """
+    del self._control, self._slots, self._frames
+    self._block.close()
+    if self._owner:
+      self._block.unlink()
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, exc_type, exc_value, traceback):
+    self.close()
+
+  def _check_writer(self):
+    if not self._owner:
+      raise ValueError('Only the process that created the bus can write.')
+
+
+class BusReader:
+  """A cursor over every stride-th frame of a FrameBus."""
+
+  def __init__(self, bus, index, stride, from_start, poll_interval=0.0005):
+    # type: (FrameBus, int, int, bool, float) -> None
+    self._bus = bus
+    self._index = index
+    self._stride = stride
+    self._poll_interval = poll_interval
+    self.read_frames = 0
+    self.skipped = 0  # Frames of this reader overwritten before being read.
+    start = bus.head
+    if from_start:
+      start = max(0, start - bus.num_slots + 1)
+    self._cursor = self._first_at_or_after(start)
+
+  def __iter__(self):
+    # type: () -> Iterator[BusFrame]
+    while True:
+      frame = self.read()
+      if frame is None:
+        return
+      yield frame
+
+  def read(self, timeout=None):
+    # type: (Optional[float]) -> Optional[BusFrame]
+    """Returns this reader's next frame, polling until it is published.
+
+    Args:
+      timeout: Longest time to wait, in seconds. None waits forever.
+
+    Returns:
+      The frame, or None once the writer is closed and every frame was read.
+
+    Raises:
+      TimeoutError: If no frame was published in time.
+    """
+    bus = self._bus
+    deadline = None if timeout is None else time.monotonic() + timeout
+    while True:
+      head = bus.head
+      if self._cursor < head:
+        # The slot after the newest frame may already be being overwritten.
+        oldest = max(0, head - bus.num_slots + 1)
+        if self._cursor < oldest:
+          self._skip_to(oldest)
+          continue
+        slot = self._cursor % bus.num_slots
+        tag = 2 * self._cursor + 2
+        # pylint: disable=protected-access
+        timestamp = int(bus._slots[slot, 1])
+        if int(bus._slots[slot, 0]) != tag:
+          self._skip_to(self._cursor + 1)
+          continue
+        frame = BusFrame(self._cursor, timestamp, bus._frames[slot],
+                         bus._slots, slot, tag)
+        # pylint: enable=protected-access
+        self._cursor += self._stride
+        self.read_frames += 1
+        return frame
+      if bus.closed and self._cursor >= bus.head:
+        return None
+      if deadline is not None and time.monotonic() >= deadline:
+        raise TimeoutError('No frame published within {}s.'.format(timeout))
+      time.sleep(self._poll_interval)
+
+  def _first_at_or_after(self, sequence):
+    # type: (int) -> int
+    offset = (self._index - sequence) % self._stride
+    return sequence + offset
+
+  def _skip_to(self, sequence):
+    target = self._first_at_or_after(sequence)
+    self.skipped += (target - self._cursor) // self._stride
+    self._cursor = target
+
+
+def _data_offset(num_slots):
+  # type: (int) -> int
+  """Returns where the frame data starts, aligned to a cache line."""
+  header = (_CONTROL_SIZE + num_slots * _SLOT_FIELDS) * 8
+  return (header + _ALIGNMENT - 1) // _ALIGNMENT * _ALIGNMENT
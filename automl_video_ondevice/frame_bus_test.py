@@ -0,0 +1,100 @@
+# Lint as: python3
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+"""Tests for the shared memory frame bus."""
+
+import unittest
+
+import numpy as np
+from automl_video_ondevice import frame_bus
+
+
+class FrameBusTest(unittest.TestCase):
+
+  def setUp(self):
+    super().setUp()
+    self.bus = frame_bus.FrameBus.create((4, 6, 3), num_slots=4)
+    self.worker = frame_bus.FrameBus.attach(self.bus.name)
+
+  def tearDown(self):
+    self.worker.close()
+    self.bus.close()
+    super().tearDown()
+
+  def test_attach_reads_layout(self):
+    self.assertEqual(self.worker.shape, (4, 6, 3))
+    self.assertEqual(self.worker.dtype, np.uint8)
+    self.assertEqual(self.worker.num_slots, 4)
+
+  def test_write_and_read(self):
+    reader = self.worker.reader()
+    self.assertEqual(self.bus.write(33, np.full((4, 6, 3), 7)), 0)
+    frame = reader.read(timeout=1)
+    self.assertEqual((frame.sequence, frame.timestamp), (0, 33))
+    np.testing.assert_array_equal(frame.image, 7)
+    self.assertFalse(frame.image.flags.writeable)
+    self.assertTrue(frame.valid())
+
+  def test_slot_and_publish(self):
+    reader = self.worker.reader()
+    self.bus.slot()[:] = 3
+    self.bus.publish(1)
+    np.testing.assert_array_equal(reader.read(timeout=1).image, 3)
+    with self.assertRaises(RuntimeError):
+      self.bus.publish(2)
+
+  def test_overwritten_frame_is_invalid(self):
+    reader = self.worker.reader()
+    self.bus.write(0, np.zeros((4, 6, 3)))
+    frame = reader.read(timeout=1)
+    # Starting to fill the frame's slot again invalidates it.
+    for timestamp in range(1, 4):
+      self.bus.write(timestamp, np.zeros((4, 6, 3)))
+    self.assertTrue(frame.valid())
+    self.bus.slot()
+    self.assertFalse(frame.valid())
+
+  def test_strided_readers_split_the_stream(self):
+    readers = [self.worker.reader(index=i, stride=2) for i in range(2)]
+    for timestamp in range(3):
+      self.bus.write(timestamp, np.zeros((4, 6, 3)))
+    self.bus.close_writer()
+    self.assertEqual([f.timestamp for f in readers[0]], [0, 2])
+    self.assertEqual([f.timestamp for f in readers[1]], [1])
+
+  def test_slow_reader_skips_overwritten_frames(self):
+    reader = self.worker.reader(from_start=True)
+    for timestamp in range(10):
+      self.bus.write(timestamp, np.zeros((4, 6, 3)))
+    self.bus.close_writer()
+    self.assertEqual([f.timestamp for f in reader], [7, 8, 9])
+    self.assertEqual(reader.skipped, 7)
+    self.assertEqual(reader.read_frames, 3)
+
+  def test_invalid_reader_index(self):
+    with self.assertRaises(ValueError):
+      self.worker.reader(index=2, stride=2)
+
+  def test_only_the_creator_writes(self):
+    with self.assertRaises(ValueError):
+      self.worker.write(0, np.zeros((4, 6, 3)))
+
+  def test_read_timeout(self):
+    with self.assertRaises(TimeoutError):
+      self.worker.reader().read(timeout=0.01)
+
+
+if __name__ == '__main__':
+  unittest.main()
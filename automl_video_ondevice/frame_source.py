@@ -0,0 +1,313 @@
+# Lint as: python3
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+"""Decodes video on a background thread, ahead of the inference loop.
+
+A FrameSource reads frames from a video file, a camera or a GStreamer pipeline
+while the caller runs inference on the previous frame, so decoding and
+inference latencies overlap instead of adding up. Frames are decoded into a
+small pool of reusable buffers, and handed over through a bounded queue with
+one of two policies:
+
+  LATEST_ONLY  Keeps only the newest frame, dropping older ones the caller was
+               too slow to read. The default for live sources.
+  LOSSLESS     Keeps every frame, pausing decoding while the queue is full.
+               The default for files.
+
+Requires cv2 from `sudo apt-get install python3-opencv`
+
+Example:
+  with frame_source.FrameSource('/dev/video0') as source:
+    for frame in source:
+      annotations = []
+      engine.run(frame.timestamp, preprocess(frame.image), annotations)
+"""
+
+import collections
+import dataclasses
+import enum
+import os
+import threading
+import time
+from typing import Iterator, Optional, Tuple, Union
+
+import numpy as np
+from automl_video_ondevice import metrics
+
+Source = Union[str, int]
+
+# Returned by _take_buffer once the source is closed.
+_STOP = object()
+
+
+class Policy(enum.Enum):
+  LATEST_ONLY = 1
+  LOSSLESS = 2
+
+
+@dataclasses.dataclass
+class Frame:
+  index: int  # Position among the decoded frames, including dropped ones.
+  timestamp: int  # Microseconds.
+  # BGR, as decoded. Only valid until the next frame is read, after which its
+  # buffer is reused; copy it to keep it longer.
+  image: np.ndarray
+
+
+def is_live(source):
+  # type: (Source) -> bool
+  """Returns whether a source is a camera or stream, rather than a file."""
+  if isinstance(source, int):
+    return True
+  if '!' in source:  # A GStreamer pipeline.
+    return 'filesrc' not in source
+  return source.startswith(('/dev/video', 'rtsp://', 'http://', 'https://'))
+
+
+def open_capture(source):
+  """Opens a cv2.VideoCapture with the backend matching the source.
+
+  Args:
+    source: A video file path, a camera index, a V4L2 device path such as
+      '/dev/video0', a stream URL, or a GStreamer pipeline ending in appsink.
+
+  Returns:
+    The opened cv2.VideoCapture.
+
+  Raises:
+    ValueError: If the source cannot be opened.
+  """
+  import cv2  # pylint: disable=g-import-not-at-top,import-outside-toplevel
+
+  if isinstance(source, int):
+    capture = cv2.VideoCapture(source)
+  elif '!' in source:
+    capture = cv2.VideoCapture(source, cv2.CAP_GSTREAMER)
+  elif source.startswith('/dev/video'):
+    capture = cv2.VideoCapture(source, cv2.CAP_V4L2)
+  else:
+    capture = cv2.VideoCapture(source)
+  if not capture.isOpened():
+    raise ValueError('Could not open video source {!r}.'.format(source))
+  return capture
+
+
+class FrameSource:
+  """Decodes frames on a background thread into reusable buffers."""
+
+  def __init__(self,
+               source,
+               policy=None,
+               max_queue_size=4,
+               stream_timestamps=None):
+    # type: (Source, Optional[Policy], int, Optional[bool]) -> None
+    """Constructor for FrameSource.
+
+    Args:
+      source: Anything open_capture accepts.
+      policy: What to do when frames are decoded faster than they are read.
+        Defaults to LATEST_ONLY for live sources and LOSSLESS for files.
+      max_queue_size: How many frames LOSSLESS decodes ahead. LATEST_ONLY
+        always keeps a single frame.
+      stream_timestamps: Whether timestamps come from the stream position
+        (CAP_PROP_POS_MSEC), rather than the wall clock time each frame was
+        captured at. Defaults to the stream position for files only. For live
+        sources, capture times come from the stream position too when the
+        backend reports one, shifted onto the wall clock, and otherwise from
+        the time each frame was grabbed, before it is decoded.
+    """
+    import cv2  # pylint: disable=g-import-not-at-top,import-outside-toplevel
+
+    live = is_live(source)
+    self.policy = policy or (Policy.LATEST_ONLY if live else Policy.LOSSLESS)
+    self._capacity = 1 if self.policy == Policy.LATEST_ONLY else max(
+        1, max_queue_size)
+    self._stream_timestamps = (not live if stream_timestamps is None else
+                               stream_timestamps)
+    self._position_property = cv2.CAP_PROP_POS_MSEC
+    self._capture = open_capture(source)
+    self.frame_rate = self._capture.get(cv2.CAP_PROP_FPS)
+    self.frame_size = (int(self._capture.get(cv2.CAP_PROP_FRAME_WIDTH)),
+                       int(self._capture.get(cv2.CAP_PROP_FRAME_HEIGHT)))
+
+    self.decoded = 0
+    self.dropped = 0
+    # One buffer per queued frame, plus the one being decoded and the one held
+    # by the caller. They are allocated by the first reads.
+    self._free_buffers = [None] * (self._capacity + 2)
+    self._ready = collections.deque()
+    self._held_buffer = None
+    self._condition = threading.Condition()
+    self._stopped = False
+    self._finished = False
+    self._error = None
+    # Wall clock minus stream position, in microseconds, for live sources.
+    self._clock_offset = None
+
+    labels = {'source': _source_label(source)}
+    self._decoded_counter = metrics.default_registry.counter(
+        'automl_video_source_frames_total', 'Frames decoded by frame sources.',
+        labels)
+    self._dropped_counter = metrics.default_registry.counter(
+        'automl_video_source_frames_dropped_total',
+        'Frames dropped by frame sources because a newer frame was decoded '
+        'before they were read.', labels)
+    self._queue_depth = metrics.default_registry.gauge(
+        'automl_video_source_queue_depth',
+        'Decoded frames waiting to be read from frame sources.', labels)
+    self._queue_depth.set_function(lambda: len(self._ready))
+
+    self._thread = threading.Thread(target=self._decode_loop, daemon=True)
+    self._thread.start()
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, exc_type, exc_value, traceback):
+    self.close()
+
+  def __iter__(self):
+    # type: () -> Iterator[Frame]
+    while True:
+      frame = self.read()
+      if frame is None:
+        return
+      yield frame
+
+  def read(self, timeout=None):
+    # type: (Optional[float]) -> Optional[Frame]
+    """Returns the next frame, waiting for it to be decoded if needed.
+
+    The image of the previously read frame is reused from then on.
+
+    Args:
+      timeout: Longest time to wait, in seconds. None waits forever.
+
+    Returns:
+      The next frame, or None once the source has no more frames.
+
+    Raises:
+      TimeoutError: If no frame was decoded in time.
+    """
+    with self._condition:
+      if self._held_buffer is not None:
+        self._free_buffers.append(self._held_buffer)
+        self._held_buffer = None
+      if not self._condition.wait_for(lambda: self._ready or self._finished,
+                                      timeout):
+        raise TimeoutError('No frame decoded within {}s.'.format(timeout))
+      if not self._ready:
+        if self._error is not None:
+          raise self._error
+        return None
+      frame = self._ready.popleft()
+      self._held_buffer = frame.image
+      # Lets LOSSLESS decoding continue.
+      self._condition.notify_all()
+      return frame
+
+  def close(self):
+    """Stops decoding and releases the capture."""
+    with self._condition:
+      if self._stopped:
+        return
+      self._stopped = True
+      self._condition.notify_all()
+    self._thread.join()
+    self._capture.release()
+    for metric in (self._decoded_counter, self._dropped_counter,
+                   self._queue_depth):
+      metrics.default_registry.unregister(metric)
+
+  def _take_buffer(self):
+    """Returns a free buffer to decode into, or _STOP once closed."""
+    with self._condition:
+      if self.policy == Policy.LOSSLESS:
+        self._condition.wait_for(
+            lambda: len(self._ready) < self._capacity or self._stopped)
+      if self._stopped:
+        return _STOP
+      # LATEST_ONLY always has a free buffer: see the pool size.
+      return self._free_buffers.pop()
+
+  def _queue_frame(self, frame):
+    # type: (Frame) -> bool
+    with self._condition:
+      if self._stopped:
+        return False
+      if len(self._ready) >= self._capacity:
+        self._free_buffers.append(self._ready.popleft().image)
+        self.dropped += 1
+        self._dropped_counter.inc()
+      self._ready.append(frame)
+      self.decoded += 1
+      self._decoded_counter.inc()
+      self._condition.notify_all()
+      return True
+
+  def _decode_loop(self):
+    index = 0
+    try:
+      while True:
+        buffer = self._take_buffer()
+        if buffer is _STOP:
+          break
+        ret, timestamp, image = self._read_into(buffer)
+        if not ret:
+          break
+        if not self._queue_frame(Frame(index, timestamp, image)):
+          break
+        index += 1
+    except Exception as e:  # pylint: disable=broad-except
+      self._error = e
+    finally:
+      with self._condition:
+        self._finished = True
+        self._condition.notify_all()
+
+  def _read_into(self, buffer):
+    # type: (Optional[np.ndarray]) -> Tuple[bool, int, Optional[np.ndarray]]
+    """Returns whether a frame was read, its timestamp and the frame."""
+    if not self._capture.grab():
+      return False, 0, None
+    timestamp = self._timestamp(time.time())
+    if buffer is None:
+      ret, image = self._capture.retrieve()
+    else:
+      # Decodes in place when the buffer has the frame's size and type.
+      ret, image = self._capture.retrieve(buffer)
+    return ret, timestamp, image
+
+  def _timestamp(self, grabbed_at):
+    # type: (float) -> int
+    """Returns the timestamp of the frame just grabbed, in microseconds."""
+    position_us = self._capture.get(self._position_property) * 1000
+    if self._stream_timestamps:
+      return int(position_us)
+    if position_us <= 0:
+      return int(grabbed_at * 1000 * 1000)
+    # The backend's capture times, on the wall clock.
+    if self._clock_offset is None:
+      self._clock_offset = grabbed_at * 1000 * 1000 - position_us
+    return int(self._clock_offset + position_us)
+
+
+def _source_label(source):
+  # type: (Source) -> str
+  # Files are labelled by full path, so that files of the same name in
+  # different directories do not share metrics.
+  if isinstance(source, str) and not is_live(source):
+    return os.path.abspath(source)
+  return str(source)
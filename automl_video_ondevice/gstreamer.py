@@ -0,0 +1,377 @@
+# Lint as: python3
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+"""Captures frames already scaled and converted for inference by GStreamer.
+
+build_pipeline asks the decoder or camera and the videoscale and videoconvert
+elements to emit frames at the engine's input size, in RGB, so no full-size
+frame is resized or converted in Python. An optional tee branch also emits
+the full-size BGR frames, for rendering results on.
+
+Capture reads from such a pipeline with the best backend available:
+
+  gstreamer  The GStreamer Python bindings (python3-gi). Supports the display
+             branch.
+  opencv     cv2.VideoCapture, when OpenCV was built with GStreamer. It reads a
+             single branch: with a display branch, the full-size frames are
+             read and inference frames are resized from them in Python.
+  python     Any source cv2 can open without GStreamer, resized and converted
+             in Python. Used when GStreamer is unavailable.
+
+Example:
+  with gstreamer.Capture('/dev/video0', engine.input_size(),
+                         display=True) as capture:
+    for frame in capture:
+      annotations = []
+      engine.run(frame.timestamp, frame.image, annotations)
+      render(frame.display_image, annotations)
+"""
+
+import dataclasses
+import time
+from typing import Iterator, Optional, Union
+
+import numpy as np
+from automl_video_ondevice import frame_source
+from automl_video_ondevice.types import Size
+
+Source = Union[str, int]
+
+# The Jetson CSI (ribbon cable) camera.
+NVARGUS_SOURCE = 'nvargus'
+
+BACKENDS = ('gstreamer', 'opencv', 'python')
+
+
+@dataclasses.dataclass
+class CapturedFrame:
+  timestamp: int  # Microseconds.
+  image: np.ndarray  # RGB, at the input size.
+  # Full-size BGR frame, or None without a display branch. With the python
+  # backend it is only valid until the next frame is read.
+  display_image: Optional[np.ndarray]
+
+
+def gstreamer_available():
+  # type: () -> bool
+  """Returns whether the GStreamer Python bindings can be used."""
+  try:
+    import gi  # pylint: disable=g-import-not-at-top,import-outside-toplevel
+    gi.require_version('Gst', '1.0')
+    from gi.repository import Gst  # pylint: disable=g-import-not-at-top,import-outside-toplevel
+    return Gst.init_check(None)
+  except (ImportError, ValueError):
+    return False
+
+
+def opencv_has_gstreamer():
+  # type: () -> bool
+  """Returns whether cv2.VideoCapture can open GStreamer pipelines."""
+  import cv2  # pylint: disable=g-import-not-at-top,import-outside-toplevel
+
+  for line in cv2.getBuildInformation().splitlines():
+    if line.strip().startswith('GStreamer:'):
+      return 'YES' in line
+  return False
+
+
+def source_elements(source, capture_size=None):
+  # type: (Source, Optional[Size]) -> str
+  """Returns the elements producing raw video from a source.
+
+  Args:
+    source: A camera index, a V4L2 device path, NVARGUS_SOURCE, a video file
+      path, or elements ending in raw video, such as 'videotestsrc'.
+    capture_size: Size to request from cameras, or None for their default.
+
+  Returns:
+    A GStreamer pipeline description, without a sink.
+  """
+  caps = ''
+  if capture_size is not None:
+    caps = ', width={}, height={}'.format(capture_size.width,
+                                          capture_size.height)
+  if isinstance(source, int):
+    source = '/dev/video{}'.format(source)
+  if source == NVARGUS_SOURCE:
+    return 'nvarguscamerasrc ! video/x-raw(memory:NVMM){}'.format(caps)
+  if source.startswith('/dev/video'):
+    # Cameras only support some sizes and formats, so the capture size is
+    # reached by converting and scaling what the camera negotiates, as
+    # requiring it of v4l2src fails on most cameras.
+    return ('v4l2src device={} ! videoconvert ! '
+            'videoscale method=0 add-borders=false ! video/x-raw{}'.format(
+                source, caps))
+  if source.startswith('videotestsrc') or '!' in source:
+    return source
+  return 'filesrc location="{}" ! decodebin'.format(source)
+
+
+def build_pipeline(source,
+                   input_size,
+                   display=False,
+                   display_size=None,
+                   capture_size=None,
+                   live=None):
+  # pylint: disable=line-too-long
+  # type: (Source, Size, bool, Optional[Size], Optional[Size], Optional[bool]) -> str
+  # pylint: enable=line-too-long
+  """Builds a pipeline emitting RGB frames at the input size.
+
+  Args:
+    source: Anything source_elements accepts.
+    input_size: The engine's input size, as returned by engine.input_size().
+    display: Whether to add a tee branch emitting BGR frames for rendering, to
+      an appsink named 'display'. The inference frames go to an appsink named
+      'inference'.
+    display_size: Size of the display frames. None keeps the capture size.
+    capture_size: Size to request from cameras.
+    live: Whether the source is live, in which case sinks keep only the newest
+      frame. Otherwise sinks block the pipeline until frames are read. Defaults
+      to True for everything but files.
+
+  Returns:
+    The pipeline description.
+  """
+  if live is None:
+    live = source == NVARGUS_SOURCE or (
+        frame_source.is_live(source) and
+        not str(source).startswith('videotestsrc'))
+  if live:
+    sink = 'appsink name={} drop=true max-buffers=1 sync=false'
+  else:
+    sink = 'appsink name={} max-buffers=4 sync=false'
+
+  # Scales before converting, so that only input-sized frames are converted.
+  # On Jetson, nvvidconv scales in hardware.
+  if source == NVARGUS_SOURCE:
+    scale = 'nvvidconv ! video/x-raw{}, format=BGRx ! videoconvert'
+  else:
+    scale = ('videoscale method=0 add-borders=false ! video/x-raw{} ! '
+             'videoconvert')
+  inference_branch = '{} ! video/x-raw, format=RGB ! {}'.format(
+      scale.format(', width={}, height={}'.format(input_size.width,
+                                                  input_size.height)),
+      sink.format('inference'))
+  if not display:
+    return '{} ! {}'.format(source_elements(source, capture_size),
+                            inference_branch)
+
+  if display_size is not None:
+    display_convert = scale.format(', width={}, height={}'.format(
+        display_size.width, display_size.height))
+  elif source == NVARGUS_SOURCE:
+    display_convert = scale.format('')
+  else:
+    display_convert = 'videoconvert'
+  display_branch = '{} ! video/x-raw, format=BGR ! {}'.format(
+      display_convert, sink.format('display'))
+  return '{} ! tee name=t t. ! queue ! {} t. ! queue ! {}'.format(
+      source_elements(source, capture_size), inference_branch, display_branch)
+
+
+class Capture:
+  """Reads input-sized RGB frames, and optionally full-size display frames."""
+
+  def __init__(self,
+               source,
+               input_size,
+               display=False,
+               display_size=None,
+               capture_size=None,
+               backend=None):
+    # pylint: disable=line-too-long
+    # type: (Source, Size, bool, Optional[Size], Optional[Size], Optional[str]) -> None
+    # pylint: enable=line-too-long
+    """Constructor for Capture.
+
+    Args:
+      source: Anything source_elements accepts. The python backend only takes
+        camera indices, device paths and files.
+      input_size: The engine's input size.
+      display: Whether to also read full-size BGR frames for rendering.
+      display_size: Size of the display frames. None keeps the capture size.
+      capture_size: Size to request from cameras.
+      backend: One of BACKENDS, or None to pick the best one available.
+
+    Raises:
+      ValueError: If the backend is unknown, or cannot read the source.
+    """
+    self._input_size = input_size
+    self._display = display
+    self._display_size = display_size
+    if backend is None:
+      if gstreamer_available():
+        backend = 'gstreamer'
+      elif opencv_has_gstreamer():
+        backend = 'opencv'
+      else:
+        print('Warning: GStreamer is unavailable, so frames are resized and '
+              'converted in Python.')
+        backend = 'python'
+    if backend not in BACKENDS:
+      raise ValueError('Unknown backend {!r}, expected one of {}.'.format(
+          backend, ', '.join(BACKENDS)))
+    self.backend = backend
+
+    self._pipeline = None
+    self._source = None
+    if backend == 'gstreamer':
+      self._pipeline = _GstPipeline(
+          build_pipeline(source, input_size, display, display_size,
+                         capture_size), display)
+    elif backend == 'opencv' and not display:
+      self._source = frame_source.FrameSource(
+          build_pipeline(source, input_size, capture_size=capture_size))
+    elif backend == 'opencv':
+      self._source = frame_source.FrameSource(
+          _display_pipeline(source, capture_size))
+    else:
+      if isinstance(source, str) and (source == NVARGUS_SOURCE or
+                                      source.startswith('videotestsrc') or
+                                      '!' in source):
+        # These are GStreamer elements, which cv2 cannot open without it.
+        raise ValueError(
+            '{!r} needs GStreamer, which is unavailable.'.format(source))
+      self._source = frame_source.FrameSource(source)
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, exc_type, exc_value, traceback):
+    self.close()
+
+  def __iter__(self):
+    # type: () -> Iterator[CapturedFrame]
+    while True:
+      frame = self.read()
+      if frame is None:
+        return
+      yield frame
+
+  def read(self):
+    # type: () -> Optional[CapturedFrame]
+    """Returns the next frame, or None once the source has no more frames."""
+    if self._pipeline is not None:
+      return self._pipeline.read()
+    frame = self._source.read()
+    if frame is None:
+      return None
+    if self.backend == 'opencv' and not self._display:
+      return CapturedFrame(frame.timestamp, frame.image, None)
+    return self._convert(frame)
+
+  def _convert(self, frame):
+    # type: (frame_source.Frame) -> CapturedFrame
+    import cv2  # pylint: disable=g-import-not-at-top,import-outside-toplevel
+
+    image = cv2.cvtColor(
+        cv2.resize(frame.image,
+                   (self._input_size.width, self._input_size.height)),
+        cv2.COLOR_BGR2RGB)
+    display_image = None
+    if self._display:
+      display_image = frame.image
+      if self._display_size is not None:
+        display_image = cv2.resize(
+            display_image,
+            (self._display_size.width, self._display_size.height))
+    return CapturedFrame(frame.timestamp, image, display_image)
+
+  def close(self):
+    if self._pipeline is not None:
+      self._pipeline.close()
+    if self._source is not None:
+      self._source.close()
+
+
+def _display_pipeline(source, capture_size):
+  # type: (Source, Optional[Size]) -> str
+  """Builds a pipeline emitting full-size BGR frames only."""
+  if source == NVARGUS_SOURCE:
+    convert = 'nvvidconv ! video/x-raw, format=BGRx ! videoconvert'
+  else:
+    convert = 'videoconvert'
+  return '{} ! {} ! video/x-raw, format=BGR ! appsink'.format(
+      source_elements(source, capture_size), convert)
+
+
+class _GstPipeline:
+  """Runs a pipeline with the GStreamer Python bindings, pulling its sinks."""
+
+  def __init__(self, description, display):
+    # pylint: disable=g-import-not-at-top,import-outside-toplevel
+    import gi
+    gi.require_version('Gst', '1.0')
+    from gi.repository import GLib
+    from gi.repository import Gst
+    # pylint: enable=g-import-not-at-top,import-outside-toplevel
+    self._gst = Gst
+    try:
+      self._pipeline = Gst.parse_launch(description)
+    except GLib.Error as e:
+      raise ValueError('Could not build pipeline {!r}: {}'.format(
+          description, e))
+    self._inference_sink = self._pipeline.get_by_name('inference')
+    self._display_sink = self._pipeline.get_by_name(
+        'display') if display else None
+    self._start = time.time()
+    self._pipeline.set_state(Gst.State.PLAYING)
+
+  def read(self):
+    # type: () -> Optional[CapturedFrame]
+    sample = self._inference_sink.emit('pull-sample')
+    if sample is None:  # End of stream.
+      return None
+    pts = sample.get_buffer().pts
+    image = self._to_array(sample)
+    display_image = None
+    if self._display_sink is not None:
+      # Both branches get every frame, but a live display sink may have
+      # dropped some: skips ahead to the inference frame.
+      while True:
+        display_sample = self._display_sink.emit('pull-sample')
+        if display_sample is None:
+          break
+        if display_sample.get_buffer().pts >= pts:
+          display_image = self._to_array(display_sample)
+          break
+    if pts == self._gst.CLOCK_TIME_NONE:
+      timestamp = int((time.time() - self._start) * 1000 * 1000)
+    else:
+      timestamp = pts // 1000
+    return CapturedFrame(timestamp, image, display_image)
+
+  def _to_array(self, sample):
+    # type: (...) -> np.ndarray
+    """Copies a 3 channel sample out of its buffer, removing row padding."""
+    structure = sample.get_caps().get_structure(0)
+    width = structure.get_value('width')
+    height = structure.get_value('height')
+    buffer = sample.get_buffer()
+    ret, map_info = buffer.map(self._gst.MapFlags.READ)
+    if not ret:
+      raise RuntimeError('Could not map a GStreamer buffer.')
+    try:
+      data = np.frombuffer(map_info.data, dtype=np.uint8)
+      stride = len(data) // height
+      return np.ascontiguousarray(
+          data[:stride * height].reshape(height, stride)[:, :width * 3]
+          .reshape(height, width, 3))
+    finally:
+      buffer.unmap(map_info)
+
+  def close(self):
+    self._pipeline.set_state(self._gst.State.NULL)
@@ -0,0 +1,737 @@
+# Lint as: python3
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+r"""Serves an object tracking model over HTTP, batching concurrent requests.
+
+Requests from many clients are queued, and coalesced into batches of at most
+max_batch_size frames, waiting at most max_queue_delay_ms after the first
+queued request for others to join it. Each batch goes through the engine's
+run_batch, which runs the whole batch in a single invocation on engines that
+support it, such as TensorFlow frozen graphs, and one frame after the other on
+the others, such as TFLite.
+
+Inputs and outputs are described by a Triton config.pbtxt, such as
+deepstream/vot/config.pbtxt, and requests follow the KServe v2 inference
+protocol that Triton implements, including its binary tensor extension:
+
+  GET  /v2/health/ready
+  GET  /v2/models/vot           Inputs and outputs.
+  GET  /v2/models/vot/config    The parsed config.pbtxt.
+  POST /v2/models/vot/infer     One frame, shaped as the input dims, or a
+                                batch of them.
+
+The server listens on a TCP port, or on a Unix socket with --socket.
+
+python3 -m automl_video_ondevice.inference_server \
+  --model data/traffic_model.tflite \
+  --labels data/traffic_label_map.pbtxt \
+  --model_config deepstream/vot/config.pbtxt \
+  --max_batch_size 8 --max_queue_delay_ms 2
+"""
+
+import argparse
+import collections
+import dataclasses
+import http.client
+import http.server
+import json
+import os
+import re
+import socket
+import socketserver
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from automl_video_ondevice import metrics
+from automl_video_ondevice import object_tracking as vot
+from automl_video_ondevice.object_tracking.base_object_detection import BaseObjectDetectionInference
+
+# Triton data types, and their KServe v2 names.
+DATA_TYPES = {
+    'TYPE_BOOL': ('BOOL', np.bool_),
+    'TYPE_UINT8': ('UINT8', np.uint8),
+    'TYPE_INT8': ('INT8', np.int8),
+    'TYPE_INT16': ('INT16', np.int16),
+    'TYPE_INT32': ('INT32', np.int32),
+    'TYPE_INT64': ('INT64', np.int64),
+    'TYPE_FP16': ('FP16', np.float16),
+    'TYPE_FP32': ('FP32', np.float32),
+    'TYPE_FP64': ('FP64', np.float64),
+}
+
+_NUMPY_TYPES = {name: dtype for name, dtype in DATA_TYPES.values()}
+
+# The outputs of TensorFlow object detection models this server can fill.
+OUTPUTS = ('detection_boxes', 'detection_scores', 'detection_classes',
+           'num_detections')
+
+# A comment, a quoted string, punctuation or a word.
+_TOKEN = re.compile(r'\s*(?:#[^\n]*|("(?:[^"\\]|\\.)*")|([{}\[\]:,;])|'
+                    r'([^\s{}\[\]:,;"#]+))')
+
+
+def parse_text_proto(text):
+  # type: (str) -> Dict[str, list]
+  """Parses a protobuf text format message, without needing its schema.
+
+  Args:
+    text: The message, such as the contents of a Triton config.pbtxt.
+
+  Returns:
+    A dictionary from each field name to the list of its values, which are
+    strings, numbers, or dictionaries for nested messages.
+
+  Raises:
+    ValueError: If the text is not well formed.
+  """
+  tokens = []
+  position = 0
+  text = text.strip()
+  while position < len(text):
+    match = _TOKEN.match(text, position)
+    if match is None or match.end() == position:
+      raise ValueError('Unexpected character at {}: {!r}'.format(
+          position, text[position:position + 20]))
+    position = match.end()
+    string, punctuation, word = match.groups()
+    if string is not None:
+      tokens.append(('value', json.loads(string)))
+    elif punctuation is not None:
+      tokens.append(('punctuation', punctuation))
+    elif word is not None:
+      tokens.append(('word', word))
+  message, position = _parse_message(tokens, 0, None)
+  return message
+
+
+def _parse_message(tokens, position, end):
+  message = collections.defaultdict(list)
+  while position < len(tokens):
+    kind, token = tokens[position]
+    if kind == 'punctuation' and token == end:
+      return dict(message), position + 1
+    if kind == 'punctuation' and token in ',;':
+      position += 1
+      continue
+    if kind != 'word':
+      raise ValueError('Expected a field name, got {!r}.'.format(token))
+    position += 1
+    if tokens[position:position + 1] == [('punctuation', ':')]:
+      position += 1
+    values, position = _parse_value(tokens, position)
+    message[token].extend(values)
+  if end is not None:
+    raise ValueError('Missing {!r}.'.format(end))
+  return dict(message), position
+
+
+def _parse_value(tokens, position):
+  """Returns the values of a field, which is several for a [...] list."""
+  if position >= len(tokens):
+    raise ValueError('Missing a field value.')
+  kind, token = tokens[position]
+  if kind == 'punctuation' and token == '{':
+    message, position = _parse_message(tokens, position + 1, '}')
+    return [message], position
+  if kind == 'punctuation' and token == '[':
+    values = []
+    position += 1
+    while tokens[position] != ('punctuation', ']'):
+      if tokens[position] == ('punctuation', ','):
+        position += 1
+        continue
+      value, position = _parse_value(tokens, position)
+      values.extend(value)
+    return values, position + 1
+  if kind == 'value':
+    return [token], position + 1
+  if kind == 'word':
+    return [_parse_scalar(token)], position + 1
+  raise ValueError('Unexpected {!r}.'.format(token))
+
+
+def _parse_scalar(word):
+  for parse in (int, float):
+    try:
+      return parse(word)
+    except ValueError:
+      pass
+  return {'true': True, 'false': False}.get(word, word)  # Enums are strings.
+
+
+@dataclasses.dataclass
+class TensorConfig:
+  name: str
+  data_type: str  # A Triton type, such as 'TYPE_FP32'.
+  dims: List[int]  # Without the batch dimension, when the model batches.
+
+
+@dataclasses.dataclass
+class ModelConfig:
+  """The parts of a Triton model configuration this server uses."""
+  name: str
+  platform: str
+  max_batch_size: int  # 0 when the model does not take a batch dimension.
+  inputs: List[TensorConfig]
+  outputs: List[TensorConfig]
+  default_model_filename: str = ''
+  # From dynamic_batching, 0 when not set.
+  max_queue_delay_microseconds: int = 0
+
+  def to_dict(self):
+    return dataclasses.asdict(self)
+
+
+def load_model_config(path):
+  # type: (str) -> ModelConfig
+  """Reads a Triton config.pbtxt.
+
+  Args:
+    path: Path to the config.pbtxt.
+
+  Returns:
+    The ModelConfig.
+
+  Raises:
+    ValueError: If the file does not exist, or does not describe an image
+      input and outputs.
+  """
+  if not os.path.isfile(path):
+    raise ValueError('Model config {} does not exist.'.format(path))
+  with open(path) as f:
+    message = parse_text_proto(f.read())
+
+  def tensors(field):
+    return [
+        TensorConfig(
+            name=tensor['name'][0],
+            data_type=tensor.get('data_type', ['TYPE_FP32'])[0],
+            dims=[int(dim) for dim in tensor.get('dims', [])])
+        for tensor in message.get(field, [])
+    ]
+
+  dynamic_batching = message.get('dynamic_batching', [{}])[0]
+  config = ModelConfig(
+      name=message.get('name', [os.path.basename(os.path.dirname(path))])[0],
+      platform=message.get('platform', [''])[0],
+      max_batch_size=int(message.get('max_batch_size', [0])[0]),
+      inputs=tensors('input'),
+      outputs=tensors('output'),
+      default_model_filename=message.get('default_model_filename', [''])[0],
+      max_queue_delay_microseconds=int(
+          dynamic_batching.get('max_queue_delay_microseconds', [0])[0]))
+  if len(config.inputs) != 1 or len(config.inputs[0].dims) != 3:
+    raise ValueError('{} must have a single HWC image input.'.format(path))
+  for tensor in config.inputs + config.outputs:
+    if tensor.data_type not in DATA_TYPES:
+      raise ValueError('Unsupported data type {} of {}.'.format(
+          tensor.data_type, tensor.name))
+  for tensor in config.outputs:
+    if _output_kind(tensor.name) not in OUTPUTS:
+      raise ValueError('Unknown output {}, expected one of {}.'.format(
+          tensor.name, ', '.join(OUTPUTS)))
+  return config
+
+
+def _output_kind(name):
+  # 'import/detection_boxes:0' is 'detection_boxes'.
+  return name.split('/')[-1].split(':')[0]
+
+
+@dataclasses.dataclass
+class _Request:
+  timestamps: List[int]
+  frames: List[np.ndarray]
+  arrival: float  # time.monotonic()
+  done: threading.Event
+  annotations: Optional[List[list]] = None
+  error: Optional[Exception] = None
+
+
+class DynamicBatcher:
+  """Coalesces frames from concurrent callers into batches for an engine."""
+
+  def __init__(self, engine, max_batch_size=8, max_queue_delay_ms=2.0):
+    # type: (BaseObjectDetectionInference, int, float) -> None
+    """Constructor for DynamicBatcher.
+
+    Args:
+      engine: The engine to run batches on, without a tracker since frames
+        come from unrelated callers.
+      max_batch_size: Most frames per batch. A single request with more
+        frames still runs, as a batch of its own.
+      max_queue_delay_ms: Longest time the first queued request waits for
+        others to join its batch.
+    """
+    self.engine = engine
+    self.max_batch_size = max(1, max_batch_size)
+    self.max_queue_delay = max_queue_delay_ms / 1000
+    self._queue = collections.deque()
+    self._condition = threading.Condition()
+    self._stopped = False
+
+    self._batch_size = metrics.default_registry.histogram(
+        'automl_video_server_batch_size', 'Frames per batch run.',
+        buckets=(1, 2, 4, 8, 16, 32, 64, 128))
+    self._queue_delay = metrics.default_registry.histogram(
+        'automl_video_server_queue_delay_seconds',
+        'Time requests waited for their batch to run.')
+    self._queue_depth = metrics.default_registry.gauge(
+        'automl_video_server_queue_depth', 'Requests waiting to be batched.')
+    self._queue_depth.set_function(lambda: len(self._queue))
+
+    self._thread = threading.Thread(target=self._batch_loop, daemon=True)
+    self._thread.start()
+
+  def infer(self, timestamps, frames):
+    # type: (List[int], List[np.ndarray]) -> List[list]
+    """Runs frames as part of the next batch, blocking until it is done.
+
+    Args:
+      timestamps: The timestamp of each frame.
+      frames: The frames, each of the engine's input size.
+
+    Returns:
+      The annotations of each frame.
+
+    Raises:
+      ValueError: If there are not as many timestamps as frames.
+    """
+    if len(timestamps) != len(frames):
+      raise ValueError('Got {} timestamps for {} frames.'.format(
+          len(timestamps), len(frames)))
+    request = _Request(timestamps, frames, time.monotonic(), threading.Event())
+    with self._condition:
+      if self._stopped:
+        raise RuntimeError('The batcher is closed.')
+      self._queue.append(request)
+      self._condition.notify()
+    request.done.wait()
+    if request.error is not None:
+      raise request.error
+    return request.annotations
+
+  def close(self):
+    with self._condition:
+      self._stopped = True
+      self._condition.notify()
+    self._thread.join()
+    for metric in (self._batch_size, self._queue_delay, self._queue_depth):
+      metrics.default_registry.unregister(metric)
+
+  def _next_batch(self):
+    """Waits for a batch to fill, or for its first request's delay to pass."""
+    with self._condition:
+      self._condition.wait_for(lambda: self._queue or self._stopped)
+      if not self._queue:
+        return []
+      deadline = self._queue[0].arrival + self.max_queue_delay
+      while (sum(len(r.frames) for r in self._queue) < self.max_batch_size and
+             not self._stopped):
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+          break
+        self._condition.wait(remaining)
+
+      batch = [self._queue.popleft()]
+      size = len(batch[0].frames)
+      while (self._queue and
+             size + len(self._queue[0].frames) <= self.max_batch_size):
+        size += len(self._queue[0].frames)
+        batch.append(self._queue.popleft())
+      return batch
+
+  def _batch_loop(self):
+    while True:
+      batch = self._next_batch()
+      if not batch:
+        return
+      now = time.monotonic()
+      timestamps = []
+      frames = []
+      for request in batch:
+        self._queue_delay.observe(now - request.arrival)
+        timestamps.extend(request.timestamps)
+        frames.extend(request.frames)
+      self._batch_size.observe(len(frames))
+
+      annotations = [[] for _ in frames]
+      try:
+        self.engine.run_batch(timestamps, frames, annotations)
+      except Exception as e:  # pylint: disable=broad-except
+        if len(batch) == 1:
+          batch[0].error = e
+          batch[0].done.set()
+        else:
+          # Runs the requests again one by one, so that only the request that
+          # caused the error fails.
+          for request in batch:
+            self._run_request(request)
+        continue
+      start = 0
+      for request in batch:
+        end = start + len(request.frames)
+        request.annotations = annotations[start:end]
+        start = end
+        request.done.set()
+
+  def _run_request(self, request):
+    request.annotations = [[] for _ in request.frames]
+    try:
+      self.engine.run_batch(request.timestamps, request.frames,
+                            request.annotations)
+    except Exception as e:  # pylint: disable=broad-except
+      request.error = e
+    request.done.set()
+
+
+def to_outputs(annotations, outputs):
+  # type: (list, List[TensorConfig]) -> Dict[str, np.ndarray]
+  """Returns a frame's annotations as the model's outputs.
+
+  Args:
+    annotations: The ObjectTrackingAnnotations of a frame.
+    outputs: The outputs to fill, without their batch dimension.
+
+  Returns:
+    Each output by name, with boxes as [top, left, bottom, right] like
+    TensorFlow object detection models, and unused detections set to 0.
+  """
+  values = {}
+  for tensor in outputs:
+    kind = _output_kind(tensor.name)
+    array = np.zeros(tensor.dims, dtype=DATA_TYPES[tensor.data_type][1])
+    flat = array.reshape(-1, 4) if kind == 'detection_boxes' else array.ravel()
+    if kind == 'num_detections':
+      flat[0] = min(len(annotations), _max_detections(outputs))
+    for i, annotation in enumerate(annotations[:len(flat)]):
+      if kind == 'detection_boxes':
+        flat[i] = (annotation.bbox.top, annotation.bbox.left,
+                   annotation.bbox.bottom, annotation.bbox.right)
+      elif kind == 'detection_scores':
+        flat[i] = annotation.confidence_score
+      elif kind == 'detection_classes':
+        flat[i] = annotation.class_id
+    values[tensor.name] = array
+  return values
+
+
+def _max_detections(outputs):
+  for tensor in outputs:
+    if _output_kind(tensor.name) == 'detection_scores':
+      return int(np.prod(tensor.dims))
+  return 0
+
+
+class InferenceHandler(http.server.BaseHTTPRequestHandler):
+  """Serves the KServe v2 protocol for a single model."""
+
+  protocol_version = 'HTTP/1.1'  # Keeps connections alive between requests.
+  batcher = None  # type: DynamicBatcher
+  model_config = None  # type: ModelConfig
+
+  def do_GET(self):  # pylint: disable=invalid-name
+    model_path = '/v2/models/' + self.model_config.name
+    if self.path in ('/v2/health/ready', '/v2/health/live'):
+      self._send_json({})
+    elif self.path == model_path:
+      self._send_json(self._metadata())
+    elif self.path == model_path + '/config':
+      self._send_json(self.model_config.to_dict())
+    else:
+      self._send_json({'error': 'Not found.'}, 404)
+
+  def do_POST(self):  # pylint: disable=invalid-name
+    body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+    if self.path != '/v2/models/{}/infer'.format(self.model_config.name):
+      self._send_json({'error': 'Not found.'}, 404)
+      return
+    try:
+      request, binary = self._split_body(body)
+      batched, timestamps, frames = self._read_input(request, binary)
+    except (KeyError, ValueError, TypeError) as e:
+      self._send_json({'error': 'Bad request: {}'.format(e)}, 400)
+      return
+    try:
+      annotations = self.batcher.infer(timestamps, frames)
+    except Exception as e:  # pylint: disable=broad-except
+      self._send_json({'error': str(e)}, 500)
+      return
+
+    per_frame = [
+        to_outputs(frame_annotations, self.model_config.outputs)
+        for frame_annotations in annotations
+    ]
+    outputs = []
+    for tensor in self.model_config.outputs:
+      value = np.stack([values[tensor.name] for values in per_frame])
+      if not batched:
+        value = value[0]
+      outputs.append({
+          'name': tensor.name,
+          'datatype': DATA_TYPES[tensor.data_type][0],
+          'shape': list(value.shape),
+          'data': value.ravel().tolist(),
+      })
+    self._send_json({
+        'model_name': self.model_config.name,
+        'id': request.get('id', ''),
+        'outputs': outputs,
+    })
+
+  def _split_body(self, body):
+    """Splits the JSON request from binary tensor data, if any."""
+    header_length = self.headers.get('Inference-Header-Content-Length')
+    if header_length is None:
+      return json.loads(body), b''
+    header_length = int(header_length)
+    return json.loads(body[:header_length]), body[header_length:]
+
+  def _read_input(self, request, binary):
+    # type: (dict, bytes) -> Tuple[bool, List[int], List[np.ndarray]]
+    """Returns whether the input is batched, its timestamps and frames."""
+    tensor = self.model_config.inputs[0]
+    (request_input,) = request['inputs']
+    if request_input['name'] != tensor.name:
+      raise ValueError('Unknown input {}, expected {}.'.format(
+          request_input['name'], tensor.name))
+    shape = [int(dim) for dim in request_input['shape']]
+    dtype = _NUMPY_TYPES[request_input.get('datatype', 'UINT8')]
+    if 'binary_data_size' in request_input.get('parameters', {}):
+      data = np.frombuffer(
+          binary[:request_input['parameters']['binary_data_size']], dtype=dtype)
+    else:
+      data = np.asarray(request_input['data'], dtype=dtype)
+    if shape[-3:] != tensor.dims or len(shape) not in (3, 4):
+      raise ValueError('Input shape {} does not match {}.'.format(
+          shape, tensor.dims))
+    if data.size != np.prod(shape):
+      raise ValueError('Got {} values for input shape {}.'.format(
+          data.size, shape))
+    frames = data.reshape([-1] + tensor.dims)
+    if frames.dtype != np.uint8:
+      frames = np.clip(frames, 0, 255).astype(np.uint8)
+    timestamps = request.get('parameters', {}).get('timestamps',
+                                                   [0] * len(frames))
+    if len(timestamps) != len(frames):
+      raise ValueError('Got {} timestamps for {} frames.'.format(
+          len(timestamps), len(frames)))
+    return len(shape) == 4, [int(t) for t in timestamps], list(frames)
+
+  def _metadata(self):
+    def describe(tensor):
+      return {
+          'name': tensor.name,
+          'datatype': DATA_TYPES[tensor.data_type][0],
+          'shape': ([-1] if self.model_config.max_batch_size else []) +
+                   tensor.dims,
+      }
+
+    return {
+        'name': self.model_config.name,
+        'platform': self.model_config.platform,
+        'inputs': [describe(tensor) for tensor in self.model_config.inputs],
+        'outputs': [describe(tensor) for tensor in self.model_config.outputs],
+    }
+
+  def _send_json(self, value, status=200):
+    body = json.dumps(value).encode('utf-8')
+    self.send_response(status)
+    self.send_header('Content-Type', 'application/json')
+    self.send_header('Content-Length', str(len(body)))
+    self.end_headers()
+    self.wfile.write(body)
+
+  def address_string(self):
+    # Unix socket clients have no address.
+    return self.client_address[0] if self.client_address else 'unix'
+
+  def log_message(self, *args):  # pylint: disable=arguments-differ
+    pass  # Requests are too frequent to log.
+
+
+class _UnixHTTPServer(socketserver.ThreadingMixIn,
+                      socketserver.UnixStreamServer):
+  daemon_threads = True
+
+
+def make_server(batcher, model_config, port=8000, host='127.0.0.1',
+                socket_path=None):
+  # pylint: disable=line-too-long
+  # type: (DynamicBatcher, ModelConfig, int, str, Optional[str]) -> socketserver.BaseServer
+  # pylint: enable=line-too-long
+  """Returns a server for the model, ready for serve_forever.
+
+  Args:
+    batcher: Runs the model's requests.
+    model_config: Describes the model's inputs and outputs.
+    port: TCP port to listen on, when socket_path is not set.
+    host: Address to listen on, when socket_path is not set.
+    socket_path: Unix socket to listen on instead, replacing any stale file.
+  """
+  handler = type('Handler', (InferenceHandler,), {
+      'batcher': batcher,
+      'model_config': model_config
+  })
+  if socket_path:
+    if os.path.exists(socket_path):
+      os.unlink(socket_path)
+    return _UnixHTTPServer(socket_path, handler)
+  return http.server.ThreadingHTTPServer((host, port), handler)
+
+
+class _UnixHTTPConnection(http.client.HTTPConnection):
+
+  def __init__(self, socket_path):
+    super().__init__('localhost')
+    self._socket_path = socket_path
+
+  def connect(self):
+    self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    self.sock.connect(self._socket_path)
+
+
+class InferenceClient:
+  """A blocking client, keeping its connection open between requests."""
+
+  def __init__(self, model_name, host='127.0.0.1', port=8000,
+               socket_path=None):
+    self.model_name = model_name
+    self._input_name = None
+    if socket_path:
+      self._connection = _UnixHTTPConnection(socket_path)
+    else:
+      self._connection = http.client.HTTPConnection(host, port)
+
+  def metadata(self):
+    # type: () -> dict
+    return self._request('GET', '/v2/models/' + self.model_name)
+
+  def infer(self, frames):
+    # type: (np.ndarray) -> Dict[str, np.ndarray]
+    """Runs a frame, or a batch of frames, sent as binary data.
+
+    Args:
+      frames: A uint8 HWC frame, or NHWC frames.
+
+    Returns:
+      Each output by name.
+    """
+    if self._input_name is None:
+      self._input_name = self.metadata()['inputs'][0]['name']
+    frames = np.ascontiguousarray(frames, dtype=np.uint8)
+    header = json.dumps({
+        'inputs': [{
+            'name': self._input_name,
+            'shape': list(frames.shape),
+            'datatype': 'UINT8',
+            'parameters': {
+                'binary_data_size': frames.nbytes
+            },
+        }]
+    }).encode('utf-8')
+    response = self._request(
+        'POST', '/v2/models/{}/infer'.format(self.model_name),
+        header + frames.tobytes(),
+        {'Inference-Header-Content-Length': str(len(header))})
+    return {
+        output['name']: np.array(output['data']).reshape(output['shape'])
+        for output in response['outputs']
+    }
+
+  def _request(self, method, path, body=None, headers=None):
+    self._connection.request(method, path, body, headers or {})
+    response = self._connection.getresponse()
+    value = json.loads(response.read())
+    if response.status != 200:
+      raise RuntimeError('{} {}: {}'.format(response.status, path,
+                                            value.get('error')))
+    return value
+
+  def close(self):
+    self._connection.close()
+
+
+def main():
+  parser = argparse.ArgumentParser()
+  parser.add_argument('--model', help='model path', required=True)
+  parser.add_argument('--labels', help='label map path', required=True)
+  parser.add_argument(
+      '--model_config',
+      default='deepstream/vot/config.pbtxt',
+      help='Triton config.pbtxt describing inputs and outputs')
+  parser.add_argument(
+      '--threshold', type=float, default=0.2, help='score threshold')
+  parser.add_argument('--device', default='', help='device to run the model on')
+  parser.add_argument(
+      '--max_batch_size',
+      type=int,
+      default=0,
+      help='most frames per batch. Defaults to the config max_batch_size, or '
+      '8 when the model takes no batch dimension, since batches of those run '
+      'one frame after the other')
+  parser.add_argument(
+      '--max_queue_delay_ms',
+      type=float,
+      default=-1,
+      help='longest wait for a batch to fill. Defaults to the config '
+      'dynamic_batching delay, or 2ms')
+  parser.add_argument('--host', default='127.0.0.1', help='address to serve on')
+  parser.add_argument('--port', type=int, default=8000, help='port to serve on')
+  parser.add_argument('--socket', help='Unix socket to serve on instead')
+  parser.add_argument(
+      '--metrics_port',
+      type=int,
+      default=0,
+      help='port to serve Prometheus metrics on, 0 to disable')
+  args = parser.parse_args()
+
+  model_config = load_model_config(args.model_config)
+  max_batch_size = args.max_batch_size or model_config.max_batch_size or 8
+  max_queue_delay_ms = args.max_queue_delay_ms
+  if max_queue_delay_ms < 0:
+    max_queue_delay_ms = (model_config.max_queue_delay_microseconds / 1000 or
+                          2.0)
+
+  engine = vot.load(
+      args.model, args.labels,
+      vot.ObjectTrackingConfig(
+          score_threshold=args.threshold, device=args.device))
+  input_size = engine.input_size()
+  height, width, _ = model_config.inputs[0].dims
+  if (width, height) != (input_size.width, input_size.height):
+    print('Warning: {} expects {}x{} inputs, but the model takes {}x{}.'.format(
+        args.model_config, width, height, input_size.width, input_size.height))
+
+  if args.metrics_port:
+    metrics.start_http_server(args.metrics_port)
+  batcher = DynamicBatcher(engine, max_batch_size, max_queue_delay_ms)
+  server = make_server(batcher, model_config, args.port, args.host, args.socket)
+  print('Serving {} on {}, batches of up to {} within {}ms'.format(
+      model_config.name, args.socket or '{}:{}'.format(args.host, args.port),
+      max_batch_size, max_queue_delay_ms))
+  try:
+    server.serve_forever()
+  except KeyboardInterrupt:
+    pass
+  finally:
+    server.server_close()
+    batcher.close()
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,233 @@
+# Lint as: python3
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+"""Tests for the batching inference server, using the fake engine."""
+
+import json
+import os
+import tempfile
+import threading
+import unittest
+
+import numpy as np
+from automl_video_ondevice import inference_server
+from automl_video_ondevice import metrics
+from automl_video_ondevice import object_tracking as vot
+from automl_video_ondevice.object_tracking.base_object_detection import BaseObjectDetectionInference
+
+_ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+_LABELS = os.path.join(_ROOT, 'data', 'traffic_label_map.pbtxt')
+_MODEL_CONFIG = os.path.join(_ROOT, 'deepstream', 'vot', 'config.pbtxt')
+
+
+class _StatefulEngine(BaseObjectDetectionInference):
+  """Counts the frames it ran as its state, and fails on white frames."""
+
+  def __init__(self):  # pylint: disable=super-init-not-called
+    self.state = 0
+    self.states_seen = []
+
+  def get_state(self):
+    return self.state
+
+  def set_state(self, state):
+    self.state = state
+
+  def run(self, timestamp, frame, annotations):
+    if frame[0, 0, 0] == 255:
+      raise ValueError('Bad frame.')
+    self.states_seen.append(self.state)
+    self.state += 1
+    return True
+
+
+class ModelConfigTest(unittest.TestCase):
+
+  def test_load_model_config(self):
+    config = inference_server.load_model_config(_MODEL_CONFIG)
+    self.assertEqual(config.name, 'vot')
+    self.assertEqual(config.max_batch_size, 0)
+    self.assertEqual(config.inputs[0].dims, [256, 256, 3])
+    self.assertEqual([t.name for t in config.outputs], [
+        'detection_boxes', 'detection_scores', 'detection_classes',
+        'num_detections'
+    ])
+    self.assertEqual(config.outputs[0].dims, [100, 4])
+
+  def test_missing_model_config(self):
+    with self.assertRaises(ValueError):
+      inference_server.load_model_config('/nonexistent/config.pbtxt')
+
+  def test_parse_text_proto(self):
+    message = inference_server.parse_text_proto(
+        'name: "a" # comment\n'
+        'dims: [1, 2] dims: 3\n'
+        'nested { flag: true value: 0.5 kind: KIND_GPU }')
+    self.assertEqual(message['name'], ['a'])
+    self.assertEqual(message['dims'], [1, 2, 3])
+    self.assertEqual(message['nested'], [{
+        'flag': [True],
+        'value': [0.5],
+        'kind': ['KIND_GPU']
+    }])
+
+
+class DynamicBatcherTest(unittest.TestCase):
+
+  def test_batches_concurrent_requests(self):
+    engine = vot.load(
+        'synthetic', _LABELS,
+        vot.ObjectTrackingConfig(score_threshold=0.1, fake_latency_ms=20))
+    batcher = inference_server.DynamicBatcher(
+        engine, max_batch_size=4, max_queue_delay_ms=50)
+    frame = np.zeros((256, 256, 3), np.uint8)
+    results = []
+
+    def request():
+      results.append(batcher.infer([0], [frame]))
+
+    threads = [threading.Thread(target=request) for _ in range(8)]
+    for thread in threads:
+      thread.start()
+    for thread in threads:
+      thread.join()
+    batcher.close()
+    self.assertEqual(len(results), 8)
+    self.assertTrue(all(len(result) == 1 for result in results))
+    # Eight requests, coalesced into fewer batches.
+    snapshot = batcher._batch_size.snapshot()  # pylint: disable=protected-access
+    self.assertLess(snapshot['count'], 8)
+
+  def test_batch_keeps_recurrent_state(self):
+    engine = _StatefulEngine()
+    batcher = inference_server.DynamicBatcher(engine, max_batch_size=4)
+    frames = [np.zeros((2, 2, 3), np.uint8)] * 3
+    batcher.infer([0, 1, 2], frames)
+    batcher.infer([3], frames[:1])
+    batcher.close()
+    # Every frame ran from the same state, as if it came from a new video.
+    self.assertEqual(engine.states_seen, [0, 0, 0, 0])
+
+  def test_error_only_fails_its_request(self):
+    engine = _StatefulEngine()
+    batcher = inference_server.DynamicBatcher(
+        engine, max_batch_size=8, max_queue_delay_ms=100)
+    good = np.zeros((2, 2, 3), np.uint8)
+    bad = np.full((2, 2, 3), 255, np.uint8)
+    results = {}
+
+    def request(name, frame):
+      try:
+        results[name] = batcher.infer([0], [frame])
+      except ValueError as e:
+        results[name] = e
+
+    threads = [
+        threading.Thread(target=request, args=(name, frame))
+        for name, frame in (('good', good), ('bad', bad), ('other', good))
+    ]
+    for thread in threads:
+      thread.start()
+    for thread in threads:
+      thread.join()
+    batcher.close()
+    self.assertIsInstance(results['bad'], ValueError)
+    self.assertEqual(results['good'], [[]])
+    self.assertEqual(results['other'], [[]])
+
+  def test_rejects_mismatched_timestamps(self):
+    batcher = inference_server.DynamicBatcher(_StatefulEngine())
+    with self.assertRaises(ValueError):
+      batcher.infer([0], [np.zeros((2, 2, 3), np.uint8)] * 2)
+    batcher.close()
+
+  def test_close_unregisters_metrics(self):
+    batcher = inference_server.DynamicBatcher(_StatefulEngine())
+    batcher.close()
+    names = {metric.name for metric in metrics.default_registry.metrics()}
+    self.assertFalse({
+        'automl_video_server_batch_size',
+        'automl_video_server_queue_delay_seconds',
+        'automl_video_server_queue_depth',
+    } & names)
+
+
+class InferenceServerTest(unittest.TestCase):
+
+  def setUp(self):
+    super().setUp()
+    engine = vot.load('synthetic', _LABELS,
+                      vot.ObjectTrackingConfig(score_threshold=0.1))
+    self.batcher = inference_server.DynamicBatcher(engine, 8, 1)
+    self.socket_path = os.path.join(tempfile.mkdtemp(), 'server.sock')
+    self.server = inference_server.make_server(
+        self.batcher,
+        inference_server.load_model_config(_MODEL_CONFIG),
+        socket_path=self.socket_path)
+    threading.Thread(target=self.server.serve_forever, daemon=True).start()
+    self.client = inference_server.InferenceClient(
+        'vot', socket_path=self.socket_path)
+
+  def tearDown(self):
+    self.client.close()
+    self.server.shutdown()
+    self.server.server_close()
+    self.batcher.close()
+    super().tearDown()
+
+  def test_infer(self):
+    outputs = self.client.infer(np.zeros((256, 256, 3), np.uint8))
+    self.assertEqual(outputs['detection_boxes'].shape, (100, 4))
+    self.assertEqual(outputs['num_detections'].shape, (1,))
+    self.assertGreater(outputs['num_detections'][0], 0)
+
+    outputs = self.client.infer(np.zeros((2, 256, 256, 3), np.uint8))
+    self.assertEqual(outputs['detection_scores'].shape, (2, 100))
+
+  def test_rejects_wrong_shape(self):
+    with self.assertRaisesRegex(RuntimeError, '400'):
+      self.client.infer(np.zeros((10, 10, 3), np.uint8))
+
+  def post_binary(self, shape, frames, timestamps):
+    header = json.dumps({
+        'inputs': [{
+            'name': 'image_tensor:0',
+            'shape': shape,
+            'datatype': 'UINT8',
+            'parameters': {
+                'binary_data_size': frames.nbytes
+            },
+        }],
+        'parameters': {
+            'timestamps': timestamps
+        },
+    }).encode('utf-8')
+    return self.client._request(  # pylint: disable=protected-access
+        'POST', '/v2/models/vot/infer', header + frames.tobytes(),
+        {'Inference-Header-Content-Length': str(len(header))})
+
+  def test_rejects_mismatched_timestamps(self):
+    frames = np.zeros((2, 256, 256, 3), np.uint8)
+    with self.assertRaisesRegex(RuntimeError, '400'):
+      self.post_binary(list(frames.shape), frames, [0])
+
+  def test_rejects_mismatched_data_size(self):
+    frames = np.zeros((2, 256, 256, 3), np.uint8)
+    with self.assertRaisesRegex(RuntimeError, '400'):
+      self.post_binary([1, 256, 256, 3], frames, [0, 0])
+
+
+if __name__ == '__main__':
+  unittest.main()
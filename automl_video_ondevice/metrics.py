@@ -0,0 +1,521 @@
+# Lint as: python3
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+"""Counters, gauges and histograms for monitoring running pipelines.
+
+Setting enable_metrics in an ObjectTrackingConfig or ShotClassificationConfig
+makes load() return an instrumented engine, which counts frames, times
+inference and every profiled stage (including trackers), and tracks how many
+tracks are active. Annotation sinks report their queue depth and dropped
+frames. Everything is registered in default_registry, which can be served in
+the Prometheus text format over HTTP, or written out as JSON snapshots.
+
+Counters and histograms are updated without locks: every thread increments its
+own cell, and cells are only summed when metrics are collected.
+
+Example:
+  metrics.start_http_server(9090)  # Serves http://127.0.0.1:9090/metrics
+  config = vot.ObjectTrackingConfig(enable_metrics=True)
+  engine = vot.load(model_path, label_map_path, config)
+"""
+
+import bisect
+import http.server
+import itertools
+import json
+import os
+import threading
+import time
+import weakref
+from typing import Callable, Dict, Optional, Sequence
+
+from automl_video_ondevice import profiling
+
+# Latency buckets, in seconds.
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25,
+                   0.5, 1.0, 2.5, 5.0)
+
+# Numbers the streams of engines instrumented without a stream name.
+_stream_numbers = itertools.count()
+
+
+class _ThreadCells:
+  """One list of values per thread, so that updates need no lock."""
+
+  def __init__(self, size):
+    self._size = size
+    self._local = threading.local()
+    self._cells = []
+    self._lock = threading.Lock()  # Only taken for a thread's first update.
+
+  def get(self):
+    """Returns the calling thread's cell, creating it if needed."""
+    cell = getattr(self._local, 'cell', None)
+    if cell is None:
+      cell = [0] * self._size
+      with self._lock:
+        self._cells.append(cell)
+      self._local.cell = cell
+    return cell
+
+  def sum(self):
+    """Returns the element-wise sum of every thread's cell."""
+    with self._lock:
+      cells = list(self._cells)
+    if not cells:
+      return [0] * self._size
+    return [sum(values) for values in zip(*cells)]
+
+
+class Metric:
+  """Base class of every metric, identified by its name and labels."""
+
+  type_name = ''
+
+  def __init__(self, name, help_text, labels=None):
+    # type: (str, str, Optional[Dict[str, str]]) -> None
+    self.name = name
+    self.help_text = help_text
+    self.labels = dict(labels or {})
+
+  def samples(self):
+    """Returns (name suffix, extra labels, value) of every sample."""
+    raise NotImplementedError()
+
+  def snapshot(self):
+    # type: () -> dict
+    raise NotImplementedError()
+
+
+class Counter(Metric):
+  """A value that only goes up, e.g. the number of frames processed."""
+
+  type_name = 'counter'
+
+  def __init__(self, name, help_text, labels=None):
+    super().__init__(name, help_text, labels)
+    self._cells = _ThreadCells(1)
+
+  def inc(self, amount=1):
+    # type: (float) -> None
+    self._cells.get()[0] += amount
+
+  @property
+  def value(self):
+    return self._cells.sum()[0]
+
+  def samples(self):
+    return [('', {}, self.value)]
+
+  def snapshot(self):
+    return {'value': self.value}
+
+
+class Gauge(Metric):
+  """A value that can go up and down, e.g. the number of active tracks.
+
+  Either set directly, or computed by a function whenever it is collected.
+  """
+
+  type_name = 'gauge'
+
+  def __init__(self, name, help_text, labels=None):
+    super().__init__(name, help_text, labels)
+    self._value = 0.0
+    self._function = None
+
+  def set(self, value):
+    # type: (float) -> None
+    self._value = value
+
+  def set_function(self, function):
+    # type: (Callable[[], float]) -> None
+    """Computes the value with function() every time it is collected."""
+    self._function = function
+
+  @property
+  def value(self):
+    return self._function() if self._function is not None else self._value
+
+  def samples(self):
+    return [('', {}, self.value)]
+
+  def snapshot(self):
+    return {'value': self.value}
+
+
+class Histogram(Metric):
+  """Counts observations into buckets, e.g. inference latencies."""
+
+  type_name = 'histogram'
+
+  def __init__(self, name, help_text, labels=None, buckets=DEFAULT_BUCKETS):
+    # type: (str, str, Optional[Dict[str, str]], Sequence[float]) -> None
+    super().__init__(name, help_text, labels)
+    self.buckets = tuple(sorted(buckets))
+    # One count per bucket, one for +Inf, then the sum.
+    self._cells = _ThreadCells(len(self.buckets) + 2)
+
+  def observe(self, value):
+    # type: (float) -> None
+    cell = self._cells.get()
+    cell[bisect.bisect_left(self.buckets, value)] += 1
+    cell[-1] += value
+
+  def _totals(self):
+    totals = self._cells.sum()
+    counts = totals[:-1]
+    cumulative = []
+    running = 0
+    for count in counts:
+      running += count
+      cumulative.append(running)
+    return cumulative, totals[-1]
+
+  def samples(self):
+    cumulative, total = self._totals()
+    samples = [('_bucket', {
+        'le': _format_value(bound)
+    }, count) for bound, count in zip(self.buckets, cumulative)]
+    samples.append(('_bucket', {'le': '+Inf'}, cumulative[-1]))
+    samples.append(('_sum', {}, total))
+    samples.append(('_count', {}, cumulative[-1]))
+    return samples
+
+  def snapshot(self):
+    cumulative, total = self._totals()
+    return {
+        'buckets': {
+            _format_value(bound): count
+            for bound, count in zip(self.buckets, cumulative)
+        },
+        'sum': total,
+        'count': cumulative[-1],
+    }
+
+
+class MetricsRegistry:
+  """Holds every metric, keyed by name and labels."""
+
+  def __init__(self):
+    self._metrics = {}
+    self._lock = threading.Lock()
+
+  def _get_or_create(self, metric_class, name, help_text, labels, **kwargs):
+    key = (name, tuple(sorted((labels or {}).items())))
+    with self._lock:
+      metric = self._metrics.get(key)
+      if metric is None:
+        metric = metric_class(name, help_text, labels, **kwargs)
+        self._metrics[key] = metric
+      elif not isinstance(metric, metric_class):
+        raise ValueError('Metric {} is already registered as a {}.'.format(
+            name, metric.type_name))
+      return metric
+
+  def counter(self, name, help_text, labels=None):
+    # type: (str, str, Optional[Dict[str, str]]) -> Counter
+    """Returns the counter with this name and labels, creating it if needed."""
+    return self._get_or_create(Counter, name, help_text, labels)
+
+  def gauge(self, name, help_text, labels=None):
+    # type: (str, str, Optional[Dict[str, str]]) -> Gauge
+    """Returns the gauge with this name and labels, creating it if needed."""
+    return self._get_or_create(Gauge, name, help_text, labels)
+
+  def histogram(self, name, help_text, labels=None, buckets=DEFAULT_BUCKETS):
+    # type: (str, str, Optional[Dict[str, str]], Sequence[float]) -> Histogram
+    """Returns the histogram with this name and labels, creating if needed."""
+    return self._get_or_create(
+        Histogram, name, help_text, labels, buckets=buckets)
+
+  def unregister(self, metric):
+    # type: (Metric) -> None
+    """Removes a metric, e.g. once the stream it describes is closed."""
+    key = (metric.name, tuple(sorted(metric.labels.items())))
+    with self._lock:
+      if self._metrics.get(key) is metric:
+        del self._metrics[key]
+
+  def metrics(self):
+    """Returns every registered metric, sorted by name."""
+    with self._lock:
+      return sorted(self._metrics.values(), key=lambda metric: metric.name)
+
+  def to_prometheus(self):
+    # type: () -> str
+    """Returns every metric in the Prometheus text exposition format."""
+    lines = []
+    last_name = None
+    for metric in self.metrics():
+      if metric.name != last_name:
+        lines.append('# HELP {} {}'.format(metric.name,
+                                           _escape_help(metric.help_text)))
+        lines.append('# TYPE {} {}'.format(metric.name, metric.type_name))
+        last_name = metric.name
+      for suffix, labels, value in metric.samples():
+        lines.append('{}{}{} {}'.format(
+            metric.name, suffix, _format_labels(dict(metric.labels, **labels)),
+            _format_value(value)))
+    return '\n'.join(lines) + '\n'
+
+  def snapshot(self):
+    # type: () -> dict
+    """Returns every metric as a JSON-serializable dictionary."""
+    return {
+        'timestamp': time.time(),
+        'metrics': [
+            dict(
+                name=metric.name,
+                type=metric.type_name,
+                labels=metric.labels,
+                **metric.snapshot()) for metric in self.metrics()
+        ],
+    }
+
+
+default_registry = MetricsRegistry()
+
+
+class _StageRecorder:
+  """Profiling recorder that feeds stage timings into histograms."""
+
+  def __init__(self, registry, labels, parent):
+    self._registry = registry
+    self._labels = labels
+    self._parent = parent
+    self._histograms = {}
+
+  def record(self, name, seconds):
+    histogram = self._histograms.get(name)
+    if histogram is None:
+      histogram = self._registry.histogram(
+          'automl_video_stage_seconds',
+          'Time spent in each stage inside engines and trackers.',
+          dict(self._labels, stage=name))
+      self._histograms[name] = histogram
+    histogram.observe(seconds)
+    # Keeps any profiler the caller activated working.
+    if self._parent is not None:
+      self._parent.record(name, seconds)
+
+
+class InstrumentedInference:
+  """Wraps an engine, recording metrics for every frame it runs.
+
+  Works for object tracking and shot classification engines alike, and
+  forwards everything else to the wrapped engine.
+  """
+
+  def __init__(self, engine, kind, engine_name, registry=None, stream=None):
+    """Constructor for InstrumentedInference.
+
+    Args:
+      engine: The engine to wrap, optionally already wrapped by a tracker.
+      kind: 'object_tracking' or 'shot_classification'.
+      engine_name: Name of the engine, e.g. 'tflite'.
+      registry: Where metrics are registered. Defaults to default_registry.
+      stream: Names the stream in per-stream metrics, such as active tracks.
+        Defaults to a number unique within the process, available as the
+        stream attribute.
+    """
+    self._engine = engine
+    self._registry = registry or default_registry
+    self.stream = stream or str(next(_stream_numbers))
+    self._labels = {'kind': kind, 'engine': engine_name}
+    self._frames = self._registry.counter(
+        'automl_video_frames_total', 'Frames passed to engines.', self._labels)
+    self._dropped = self._registry.counter(
+        'automl_video_frames_dropped_total',
+        'Frames for which engines output no result.', self._labels)
+    self._latency = self._registry.histogram(
+        'automl_video_inference_seconds',
+        'Time spent in engine run calls, including tracking.', self._labels)
+    self._active_tracks = self._registry.gauge(
+        'automl_video_active_tracks',
+        'Tracks output for the most recent frame.',
+        dict(self._labels, stream=self.stream))
+    # The gauge is this stream's alone, and goes away with it.
+    weakref.finalize(self, self._registry.unregister, self._active_tracks)
+
+  def __getattr__(self, name):
+    if name.startswith('__') or name in ('_engine', 'stream'):
+      raise AttributeError(name)
+    return getattr(self._engine, name)
+
+  def input_size(self):
+    return self._engine.input_size()
+
+  def input_dtype(self):
+    return self._engine.input_dtype()
+
+  def warmup(self, iterations=3):
+    return self._engine.warmup(iterations)
+
+  def get_state(self):
+    return self._engine.get_state()
+
+  def set_state(self, state):
+    self._engine.set_state(state)
+
+  def run(self, timestamp, frame, annotations):
+    self._frames.inc()
+    recorder = _StageRecorder(self._registry, self._labels,
+                              profiling.active_recorder())
+    start = time.perf_counter()
+    with profiling.recording(recorder):
+      success = self._engine.run(timestamp, frame, annotations)
+    self._latency.observe(time.perf_counter() - start)
+    if not success:
+      self._dropped.inc()
+    self._set_active_tracks(annotations)
+    return success
+
+  def run_batch(self, timestamps, frames, annotations):
+    """Runs a batch, observing its latency once, for the whole batch."""
+    self._frames.inc(len(frames))
+    recorder = _StageRecorder(self._registry, self._labels,
+                              profiling.active_recorder())
+    start = time.perf_counter()
+    with profiling.recording(recorder):
+      results = self._engine.run_batch(timestamps, frames, annotations)
+    self._latency.observe(time.perf_counter() - start)
+    self._dropped.inc(len(results) - sum(bool(result) for result in results))
+    if annotations:
+      self._set_active_tracks(annotations[-1])
+    return results
+
+  def _set_active_tracks(self, annotations):
+    self._active_tracks.set(
+        len({
+            annotation.track_id
+            for annotation in annotations
+            if getattr(annotation, 'track_id', -1) >= 0
+        }))
+
+
+def instrument(engine, kind, engine_name, registry=None, stream=None):
+  """Wraps an engine with InstrumentedInference."""
+  return InstrumentedInference(engine, kind, engine_name, registry, stream)
+
+
+class _MetricsHandler(http.server.BaseHTTPRequestHandler):
+  """Serves /metrics in the Prometheus text format, and /metrics.json."""
+
+  registry = default_registry
+
+  def do_GET(self):  # pylint: disable=invalid-name
+    if self.path == '/metrics':
+      body = self.registry.to_prometheus().encode('utf-8')
+      content_type = 'text/plain; version=0.0.4; charset=utf-8'
+    elif self.path == '/metrics.json':
+      body = json.dumps(self.registry.snapshot()).encode('utf-8')
+      content_type = 'application/json'
+    else:
+      self.send_error(404)
+      return
+    self.send_response(200)
+    self.send_header('Content-Type', content_type)
+    self.send_header('Content-Length', str(len(body)))
+    self.end_headers()
+    self.wfile.write(body)
+
+  def log_message(self, *args):  # pylint: disable=arguments-differ
+    pass  # Scrapes are too frequent to log.
+
+
+def start_http_server(port, host='127.0.0.1', registry=None):
+  # type: (int, str, Optional[MetricsRegistry]) -> http.server.ThreadingHTTPServer
+  """Serves metrics over HTTP on a background thread.
+
+  Args:
+    port: Port to listen on. 0 picks a free port.
+    host: Interface to listen on. Defaults to local connections only.
+    registry: The registry to serve. Defaults to default_registry.
+
+  Returns:
+    The server. Its server_address holds the bound port, and shutdown() stops
+    it.
+  """
+  handler = type('MetricsHandler', (_MetricsHandler,),
+                 {'registry': registry or default_registry})
+  server = http.server.ThreadingHTTPServer((host, port), handler)
+  thread = threading.Thread(target=server.serve_forever, daemon=True)
+  thread.start()
+  return server
+
+
+class JsonSnapshotWriter:
+  """Periodically writes a JSON snapshot of every metric to a file.
+
+  The file is replaced atomically, so readers never see a partial snapshot.
+  """
+
+  def __init__(self, path, interval=10.0, registry=None):
+    """Constructor for JsonSnapshotWriter.
+
+    Args:
+      path: File to write snapshots to.
+      interval: Seconds between snapshots.
+      registry: The registry to snapshot. Defaults to default_registry.
+    """
+    self.path = path
+    self._interval = interval
+    self._registry = registry or default_registry
+    self._stop = threading.Event()
+    self._thread = threading.Thread(target=self._write_loop, daemon=True)
+    self._thread.start()
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, exc_type, exc_value, traceback):
+    self.close()
+
+  def write(self):
+    """Writes a snapshot now."""
+    temp_path = '{}.{}.tmp'.format(self.path, os.getpid())
+    with open(temp_path, 'w') as f:
+      json.dump(self._registry.snapshot(), f)
+    os.replace(temp_path, self.path)
+
+  def close(self):
+    """Stops writing, after writing one final snapshot."""
+    self._stop.set()
+    self._thread.join()
+    self.write()
+
+  def _write_loop(self):
+    while not self._stop.wait(self._interval):
+      self.write()
+
+
+def _format_value(value):
+  if value == float('inf'):
+    return '+Inf'
+  return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _escape_help(text):
+  return text.replace('\\', '\\\\').replace('\n', '\\n')
+
+
+def _format_labels(labels):
+  if not labels:
+    return ''
+  return '{' + ','.join('{}="{}"'.format(
+      key,
+      str(value).replace('\\', '\\\\').replace('"', '\\"').replace(
+          '\n', '\\n')) for key, value in sorted(labels.items())) + '}'
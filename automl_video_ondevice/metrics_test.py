@@ -0,0 +1,80 @@
+# Lint as: python3
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+"""Tests for engine metrics."""
+
+import gc
+import os
+import unittest
+
+import numpy as np
+from automl_video_ondevice import metrics
+from automl_video_ondevice import object_tracking as vot
+
+_LABELS = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), '..', 'data',
+    'traffic_label_map.pbtxt')
+
+
+def _values(registry, name):
+  return {
+      tuple(sorted(metric.labels.items())): metric.snapshot()
+      for metric in registry.metrics()
+      if metric.name == name
+  }
+
+
+class InstrumentedInferenceTest(unittest.TestCase):
+
+  def setUp(self):
+    super().setUp()
+    self.registry = metrics.MetricsRegistry()
+    self.frame = np.zeros((256, 256, 3), np.uint8)
+
+  def instrument(self, stream=None):
+    engine = vot.load('synthetic', _LABELS, vot.ObjectTrackingConfig())
+    return metrics.instrument(engine, 'object_tracking', 'synthetic',
+                              self.registry, stream)
+
+  def test_batches_are_recorded(self):
+    engine = self.instrument()
+    annotations = [[], [], []]
+    self.assertEqual(
+        engine.run_batch([0, 1, 2], [self.frame] * 3, annotations),
+        [True] * 3)
+    labels = (('engine', 'synthetic'), ('kind', 'object_tracking'))
+    self.assertEqual(
+        _values(self.registry, 'automl_video_frames_total')[labels],
+        {'value': 3})
+    self.assertEqual(
+        _values(self.registry, 'automl_video_inference_seconds')[labels]
+        ['count'], 1)
+
+  def test_active_tracks_are_per_stream(self):
+    first = self.instrument('first')
+    second = self.instrument()
+    first.run(0, self.frame, [])
+    streams = [
+        dict(labels)['stream']
+        for labels in _values(self.registry, 'automl_video_active_tracks')
+    ]
+    self.assertCountEqual(streams, ['first', second.stream])
+    del first, second
+    gc.collect()
+    self.assertFalse(_values(self.registry, 'automl_video_active_tracks'))
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -16,19 +16,31 @@
 """Object tracking loader.
 
 Based on filename, the loader will instantiate an inference engine.
+
+Engines and trackers are only imported once they are used, so that importing
+this package does not pull in OpenCV, TensorFlow or TFLite.
 """
 
 from automl_video_ondevice.object_tracking.base_object_detection import BaseObjectDetectionInference
-from automl_video_ondevice.object_tracking.camshift_object_tracker import CamshiftObjectTracker
 from automl_video_ondevice.object_tracking.config import ObjectTrackingConfig
 from automl_video_ondevice.types import Format
 from automl_video_ondevice.types import NormalizedBoundingBox
 from automl_video_ondevice.types import ObjectTrackingAnnotation
 from automl_video_ondevice.types import Size
 from automl_video_ondevice.types import Tracker
+from automl_video_ondevice.types import WarmupReport
 from automl_video_ondevice.utils import format_from_filename
 
 
+def __getattr__(name):
+  # CamshiftObjectTracker requires OpenCV, so it is only imported on access.
+  if name == 'CamshiftObjectTracker':
+    from automl_video_ondevice.object_tracking.camshift_object_tracker import CamshiftObjectTracker  # pylint: disable=g-import-not-at-top,import-outside-toplevel
+    return CamshiftObjectTracker
+  raise AttributeError('module {!r} has no attribute {!r}'.format(
+      __name__, name))
+
+
 def load(frozen_graph_path,
          label_map_path,
          config,
@@ -39,7 +51,8 @@ def load(frozen_graph_path,
   """Instantiates an inference engine based on the file format.
 
   Args:
-    frozen_graph_path: Path to the model frozen graph to be used.
+    frozen_graph_path: Path to the model frozen graph to be used. For the fake
+      engine, a recorded .jsonl or .bin annotation file, or 'synthetic'.
     label_map_path: Path to the labelmap .pbtxt file.
     config: An ObjectTrackingConfig instance.
     file_format: Specifies which format the graph is in. If undefined, will make
@@ -66,15 +79,55 @@ def load(frozen_graph_path,
     from automl_video_ondevice.object_tracking.tf_object_detection import TFObjectDetectionInference
     engine = TFObjectDetectionInference(frozen_graph_path, label_map_path,
                                         config)
+  elif file_format == Format.FAKE:
+    from automl_video_ondevice.object_tracking.fake_object_detection import FakeObjectDetectionInference
+    engine = FakeObjectDetectionInference(frozen_graph_path, label_map_path,
+                                          config)
   else:
     engine = BaseObjectDetectionInference(None, None, None)
+  # pylint: enable=g-import-not-at-top,import-outside-toplevel
+
+  engine = attach_tracker(engine, config)
+  if config.warmup_iterations > 0:
+    report = engine.warmup(config.warmup_iterations)
+    print('Warmup: cold {:.1f}ms, warm {:.1f}ms'.format(
+        report.cold_latency_ms, report.warm_latency_ms))
+  if config.enable_metrics:
+    from automl_video_ondevice import metrics  # pylint: disable=g-import-not-at-top,import-outside-toplevel
+    engine = metrics.instrument(engine, 'object_tracking',
+                                file_format.name.lower())
+  return engine
+
+
+def attach_tracker(engine, config):
+  # pylint: disable=line-too-long
+  # type: (BaseObjectDetectionInference, ObjectTrackingConfig) -> BaseObjectDetectionInference
+  # pylint: enable=line-too-long
+  """Wraps an inference engine with the tracker specified by the config.
+
+  Trackers hold per-video state, so an already loaded engine can be re-used for
+  a new video by attaching a fresh tracker to it.
+
+  Args:
+    engine: An instantiated inference engine, without a tracker.
+    config: An ObjectTrackingConfig instance.
 
+  Returns:
+    The engine wrapped by a tracker, or the engine itself if no tracker is set.
+    Without a tracker, motion gating wraps the engine with
+    MotionGatedInference; trackers gate detection themselves.
+  """
+  # pylint: disable=g-import-not-at-top,import-outside-toplevel
   if config.tracker == Tracker.FAST_INACCURATE:
+    from automl_video_ondevice.object_tracking.camshift_object_tracker import CamshiftObjectTracker
     return CamshiftObjectTracker(engine, config)
   elif config.tracker == Tracker.BASIC:
-    from automl_video_ondevice.object_tracking.mediapipe_object_tracker import MediaPipeObjectTracker  # pylint: disable=g-import-not-at-top
+    from automl_video_ondevice.object_tracking.mediapipe_object_tracker import MediaPipeObjectTracker
     return MediaPipeObjectTracker(engine, config)
   elif not config.tracker or config.tracker == Tracker.NONE:
+    if config.motion_threshold > 0:
+      from automl_video_ondevice.object_tracking.motion_gate import MotionGatedInference
+      return MotionGatedInference(engine, config)
     return engine
   else:
     raise NotImplementedError('Invalid or unimplemented tracker type.')
@@ -15,17 +15,76 @@
 # ==============================================================================
 """Provides the base class for implementing video object tracking inference."""
 
+import numpy as np
 from automl_video_ondevice.types import Size
+import automl_video_ondevice.utils as vot_utils
+
+
+def check_batch(timestamps, frames, annotations):
+  """Raises a ValueError unless run_batch got as many of each argument."""
+  if not len(timestamps) == len(frames) == len(annotations):
+    raise ValueError(
+        'Got {} timestamps and {} annotation lists for {} frames.'.format(
+            len(timestamps), len(annotations), len(frames)))
 
 
 class BaseObjectDetectionInference:
   """Interface that must be implemented for support of different model types."""
 
+  # Milliseconds each step of loading took, by step name, as recorded by
+  # utils.StartupTimer, for engines that time their loading.
+  startup_timings = None
+
   def __init__(self, frozen_graph_path, label_map_path, config):
     raise NotImplementedError()
 
   def input_size(self):
     return Size(256, 256)
 
+  def input_dtype(self):
+    return np.uint8
+
   def run(self, timestamp, frame, annotations):
     raise NotImplementedError()
+
+  def run_batch(self, timestamps, frames, annotations):
+    """Runs inference on independent frames, such as from different clients.
+
+    Frames do not affect one another: engines with recurrent (LSTM) state run
+    every frame from the state the batch started with, and keep that state
+    afterwards. Engines that can run several frames in a single invocation
+    override this. By default, frames are run one after the other.
+
+    Args:
+      timestamps: The timestamp of each frame.
+      frames: The frames, each of input_size().
+      annotations: One list per frame, which its annotations are appended to.
+
+    Returns:
+      Whether each frame was run successfully.
+
+    Raises:
+      ValueError: If there are not as many timestamps and annotation lists as
+        frames.
+    """
+    check_batch(timestamps, frames, annotations)
+    state = self.get_state()
+    results = []
+    for timestamp, frame, frame_annotations in zip(timestamps, frames,
+                                                   annotations):
+      results.append(self.run(timestamp, frame, frame_annotations))
+      if state is not None:
+        self.set_state(state)
+    return results
+
+  def warmup(self, iterations=3):
+    """Runs inference on blank frames, returning a WarmupReport."""
+    return vot_utils.run_warmup(self, iterations, self.input_dtype())
+
+  def get_state(self):
+    """Returns a copy of any recurrent (LSTM) state, or None if stateless."""
+    return None
+
+  def set_state(self, state):
+    """Restores recurrent state previously returned by get_state."""
+    del state  # Stateless by default.
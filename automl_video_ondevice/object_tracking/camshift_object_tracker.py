@@ -17,8 +17,12 @@
 
 import cv2
 import numpy as np
+from automl_video_ondevice import profiling
+from automl_video_ondevice.object_tracking import motion_gate
 from automl_video_ondevice.object_tracking.base_object_detection import BaseObjectDetectionInference
 
+import automl_video_ondevice.utils as vot_utils
+
 
 class SingleTracker:
   """A single tracklet."""
@@ -85,11 +89,13 @@ class SingleTracker:
     self.roi_hist = roi_hist
 
   # Run this every frame
-  def run(self, frame):
+  def run(self, frame, degrade=True):
     """Processes a single frame.
 
     Args:
       frame: The np.array image frame.
+      degrade: Whether the frame counts against the track's health, which
+        only frames the detector could have corrected it on should.
     """
     hsv = cv2.cvtColor(frame, cv2.COLOR_BGR2HSV)
     dst = cv2.calcBackProject([hsv], [0, 1], self.roi_hist, [0, 180, 0, 255], 1)
@@ -105,7 +111,8 @@ class SingleTracker:
     self.annotation.bbox.bottom = y2
 
     self.age = self.age + 1
-    self.degrade()
+    if degrade:
+      self.degrade()
 
   def correct(self, new_box, frame):
     """Corrects current tracklet with new information.
@@ -150,19 +157,23 @@ class TrackerEngine:
     self.tracks = []
     self.current_track = 0
 
-  def predict(self, frame, predictions):
+  def predict(self, frame, predictions, degrade=True):
     """Creates new predictions for frames with missed detections.
 
     Args:
       frame: frame data to aid with prediction.
       predictions: output prediction array.
+      degrade: Whether tracks lose health, as they should on frames the
+        detector ran on. Frames inference was skipped on, between detections
+        or by the motion gate, leave it unchanged, so that tracks outlive any
+        detection interval.
     """
     new_tracks = []
     for track in self.tracks:
       if track.health <= 0:
         continue
 
-      track.run(frame)
+      track.run(frame, degrade)
       predictions.append(track.annotation)
       for other_track in self.tracks:
         if track is other_track:
@@ -264,20 +275,55 @@ class CamshiftObjectTracker(BaseObjectDetectionInference):
   """Camshift and Kalman Filter-based tracking."""
 
   def __init__(self, object_detection_engine, config):
-    del config  # Not used, yet.
     self._tracker_engine = TrackerEngine()
     self._object_detection_engine = object_detection_engine
+    self._detection_interval = max(1, config.detection_interval)
+    self._frames_until_detection = 0
+    self.motion_gate = motion_gate.from_config(config)
 
   def input_size(self):
     return self._object_detection_engine.input_size()
 
+  def input_dtype(self):
+    return self._object_detection_engine.input_dtype()
+
+  @property
+  def startup_timings(self):
+    return self._object_detection_engine.startup_timings
+
+  def warmup(self, iterations=3):
+    # Only warms up the detector, so that no tracks are created.
+    return self._object_detection_engine.warmup(iterations)
+
+  def get_state(self):
+    return self._object_detection_engine.get_state()
+
+  def set_state(self, state):
+    self._object_detection_engine.set_state(state)
+    if self.motion_gate is not None:
+      self.motion_gate.reset()
+
   def run(self, timestamp, frame, annotations):
-    np_frame = np.array(frame)
+    np_frame = vot_utils.as_frame(frame)
+    # Between detections, and while nothing moves, tracks are only moved along.
+    if self._frames_until_detection > 0 or (
+        self.motion_gate is not None and
+        not self.motion_gate.should_detect(np_frame)):
+      self._frames_until_detection = max(0, self._frames_until_detection - 1)
+      with profiling.stage('camshift.predict'):
+        # Tracks only age on frames the detector could have corrected them
+        # on.
+        self._tracker_engine.predict(np_frame, annotations, degrade=False)
+      return True
+
     detection_annotations = []
     if self._object_detection_engine.run(timestamp, np_frame,
                                          detection_annotations):
-      self._tracker_engine.predict(np_frame, annotations)
-      self._tracker_engine.correct(detection_annotations, np_frame)
+      with profiling.stage('camshift.predict'):
+        self._tracker_engine.predict(np_frame, annotations)
+      with profiling.stage('camshift.correct'):
+        self._tracker_engine.correct(detection_annotations, np_frame)
+      self._frames_until_detection = self._detection_interval - 1
       return True
     else:
       return False
@@ -0,0 +1,68 @@
+# Lint as: python3
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+"""Tests for the Camshift tracker, using the fake engine."""
+
+import os
+import unittest
+
+from automl_video_ondevice import object_tracking as vot
+from automl_video_ondevice.object_tracking import synthetic
+import automl_video_ondevice.utils as vot_utils
+
+_LABELS = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), '..', '..', 'data',
+    'traffic_label_map.pbtxt')
+_NUM_OBJECTS = 3
+
+
+class CamshiftObjectTrackerTest(unittest.TestCase):
+
+  def setUp(self):
+    super().setUp()
+    # The first frame of the scene the fake engine detects objects in.
+    _, label_list = vot_utils.load_label_map(_LABELS)
+    scenario = synthetic.Scenario(
+        synthetic.ScenarioConfig(
+            num_objects=_NUM_OBJECTS, num_classes=len(label_list)))
+    self.frame = next(scenario.frames()).image
+
+  def track_counts(self, num_frames, **config):
+    """Returns how many tracks are output on each frame of a static scene."""
+    engine = vot.load(
+        'synthetic', _LABELS,
+        vot.ObjectTrackingConfig(
+            tracker=vot.Tracker.FAST_INACCURATE,
+            fake_num_objects=_NUM_OBJECTS,
+            **config))
+    counts = []
+    for i in range(num_frames):
+      annotations = []
+      engine.run(i * 33333, self.frame, annotations)
+      counts.append(len(annotations))
+    return counts
+
+  def test_tracks_survive_gated_frames(self):
+    # Nothing moves, so only every 30th frame is detected on.
+    counts = self.track_counts(45, motion_threshold=0.01)
+    self.assertEqual(counts[1:], [_NUM_OBJECTS] * 44)
+
+  def test_tracks_survive_detection_intervals(self):
+    counts = self.track_counts(45, detection_interval=20)
+    self.assertEqual(counts[1:], [_NUM_OBJECTS] * 44)
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -16,6 +16,8 @@
 """Public configuration parameters for object tracking."""
 
 import dataclasses
+from typing import Optional
+
 from automl_video_ondevice.types import Tracker
 
 
@@ -25,3 +27,36 @@ class ObjectTrackingConfig:
   max_detections: int = 100
   device: str = ""
   tracker: Tracker = Tracker.NONE
+  # How TFLite models expect 8-bit RGB pixels to be normalized:
+  # (pixel - input_mean) / input_std, quantized if the input is. None means
+  # 127.5 for float and int8 inputs. Models taking uint8 input, such as
+  # EdgeTPU models, get the pixels unchanged unless both are set.
+  input_mean: Optional[float] = None
+  input_std: Optional[float] = None
+  # Runs the detector on every n-th frame only; trackers follow objects on the
+  # frames in between. Ignored without a tracker.
+  detection_interval: int = 1
+  # Skips inference on frames that barely changed since the last frame it ran
+  # on: when at most this fraction of pixels of a downscaled grayscale copy
+  # changed by more than motion_pixel_threshold levels. Skipped frames repeat
+  # the last detections, or only move tracks along with a tracker. 0 disables
+  # motion gating.
+  motion_threshold: float = 0.0
+  motion_pixel_threshold: int = 25
+  # Inference still runs after this many skipped frames in a row.
+  motion_max_skipped_frames: int = 30
+  # Runs inference this many times on blank frames when loading, so that the
+  # slow first inferences do not hit real frames. 0 disables warm-up.
+  warmup_iterations: int = 0
+
+  # Records frame counts and latencies in metrics.default_registry, which can
+  # be exported with metrics.start_http_server.
+  enable_metrics: bool = False
+
+  # Only used by the fake engine (Format.FAKE). Every run sleeps for a latency
+  # drawn from a normal distribution, imitating inference.
+  fake_latency_ms: float = 0.0
+  fake_latency_jitter_ms: float = 0.0
+  # Objects generated when the fake engine is loaded with the synthetic path.
+  fake_num_objects: int = 10
+  fake_seed: int = 0
@@ -0,0 +1,178 @@
+# Lint as: python3
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+"""Provides a fake object detection engine, which runs no model.
+
+Loaded for Format.FAKE, it either replays the detections recorded in a file
+written by sinks.JsonlSink or sinks.BinarySink, or generates detections of
+synthetic moving objects when loaded with utils.FAKE_SYNTHETIC_PATH. It needs
+neither TFLite nor TensorFlow, which makes it useful for testing and load
+testing trackers, pipelines and servers on any machine.
+
+Every run sleeps for a configurable, jittered latency to imitate inference,
+once per batch for run_batch. The output only depends on how many frames and
+batches have been run, not on their content.
+"""
+
+import collections
+import dataclasses
+import time
+
+import numpy as np
+from automl_video_ondevice import profiling
+from automl_video_ondevice import sinks
+from automl_video_ondevice.object_tracking import synthetic
+from automl_video_ondevice.object_tracking.base_object_detection import BaseObjectDetectionInference
+from automl_video_ondevice.object_tracking.base_object_detection import check_batch
+from automl_video_ondevice.types import ObjectTrackingAnnotation
+
+import automl_video_ondevice.utils as vot_utils
+
+# Synthetic frames can only be generated in order, from the first. Generators
+# are kept by the index of the frame they generate next, so that streams
+# sharing an engine each carry on from where they were, and the detections of
+# recent frames are kept, so that restoring an earlier state is cheap.
+_MAX_GENERATORS = 8
+_MAX_CACHED_FRAMES = 64
+
+
+class FakeObjectDetectionInference(BaseObjectDetectionInference):
+  """Implementation of the BaseObjectDetectionInference replaying detections."""
+
+  def __init__(self, detections_path, label_map_path, config):
+    self._config = config
+    self._latency_random = np.random.RandomState(config.fake_seed)
+    self._label_list = []
+    if label_map_path:
+      _, self._label_list = vot_utils.load_label_map(label_map_path)
+
+    self._recorded = None
+    self._scenario = None
+    if detections_path == vot_utils.FAKE_SYNTHETIC_PATH:
+      self._scenario = synthetic.Scenario(
+          synthetic.ScenarioConfig(
+              num_objects=config.fake_num_objects,
+              num_frames=0,
+              num_classes=len(self._label_list) or 1,
+              seed=config.fake_seed,
+              render=False))
+    else:
+      read = sinks.read_binary if detections_path.endswith(
+          ('.bin', '.bin.gz')) else sinks.read_jsonl
+      self._recorded = [
+          [a for a in annotations if isinstance(a, ObjectTrackingAnnotation)]
+          for _, annotations in read(detections_path)
+      ]
+      if not self._recorded:
+        raise ValueError(
+            'No recorded frames found in {}.'.format(detections_path))
+    self._frame_index = 0
+    self._generators = collections.OrderedDict()
+    self._cached_detections = collections.OrderedDict()
+
+  def get_state(self):
+    return self._frame_index
+
+  def set_state(self, state):
+    if state is None:
+      return
+    self._frame_index = state
+
+  def get_label(self, class_id, default):
+    if 0 <= class_id < len(self._label_list):
+      return self._label_list[class_id]
+    return default
+
+  def _next_detections(self):
+    if self._recorded is not None:
+      detections = self._recorded[self._frame_index % len(self._recorded)]
+    else:
+      detections = self._synthetic_detections(self._frame_index)
+    self._frame_index += 1
+    return detections
+
+  def _synthetic_detections(self, index):
+    detections = self._cached_detections.get(index)
+    if detections is not None:
+      self._cached_detections.move_to_end(index)
+      return detections
+
+    # Carries on with the generator closest before the frame.
+    start = max((i for i in self._generators if i <= index), default=None)
+    if start is None:
+      start, frames = 0, self._scenario.frames()
+    else:
+      frames = self._generators.pop(start)
+    for _ in range(index - start):
+      next(frames)
+    detections = next(frames).detections
+    self._generators[index + 1] = frames
+    if len(self._generators) > _MAX_GENERATORS:
+      self._generators.popitem(last=False)
+    self._cached_detections[index] = detections
+    if len(self._cached_detections) > _MAX_CACHED_FRAMES:
+      self._cached_detections.popitem(last=False)
+    return detections
+
+  def _simulate_latency(self):
+    latency_ms = self._config.fake_latency_ms
+    if self._config.fake_latency_jitter_ms > 0:
+      latency_ms += self._latency_random.normal(
+          0, self._config.fake_latency_jitter_ms)
+    if latency_ms > 0:
+      time.sleep(latency_ms / 1000)
+
+  def run(self, timestamp, frame, annotations):
+    del frame  # The output does not depend on the frame.
+    with profiling.stage('fake.latency'):
+      self._simulate_latency()
+
+    with profiling.stage('fake.postprocess'):
+      self._append_detections(timestamp, annotations)
+    return True
+
+  def run_batch(self, timestamps, frames, annotations):
+    check_batch(timestamps, frames, annotations)
+    del frames  # The output does not depend on the frames.
+    # Imitates a batched accelerator: one latency, whatever the batch size.
+    with profiling.stage('fake.latency'):
+      self._simulate_latency()
+
+    # Frames of a batch are independent: each gets the detections of the
+    # frame the batch started at, as each would run from the state the batch
+    # started with. The replay then moves on by a single frame.
+    start_index = self._frame_index
+    with profiling.stage('fake.postprocess'):
+      for timestamp, frame_annotations in zip(timestamps, annotations):
+        self._frame_index = start_index
+        self._append_detections(timestamp, frame_annotations)
+    self._frame_index = start_index + 1
+    return [True] * len(timestamps)
+
+  def _append_detections(self, timestamp, annotations):
+    for detection in self._next_detections():
+      if len(annotations) >= self._config.max_detections:
+        break
+      if detection.confidence_score <= self._config.score_threshold:
+        continue
+      annotations.append(
+          ObjectTrackingAnnotation(
+              timestamp=timestamp,
+              track_id=-1,
+              class_id=detection.class_id,
+              class_name=self.get_label(detection.class_id,
+                                        detection.class_name),
+              confidence_score=detection.confidence_score,
+              bbox=dataclasses.replace(detection.bbox)))
@@ -0,0 +1,74 @@
+# Lint as: python3
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+"""Tests for the fake object detection engine."""
+
+import os
+import unittest
+
+import numpy as np
+from automl_video_ondevice import object_tracking as vot
+
+_LABELS = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), '..', '..', 'data',
+    'traffic_label_map.pbtxt')
+
+
+def _boxes(annotations):
+  return [(a.class_id, a.bbox.left, a.bbox.top) for a in annotations]
+
+
+class FakeObjectDetectionInferenceTest(unittest.TestCase):
+
+  def setUp(self):
+    super().setUp()
+    self.engine = vot.load('synthetic', _LABELS, vot.ObjectTrackingConfig())
+    self.frame = np.zeros((256, 256, 3), np.uint8)
+
+  def run_frames(self, engine, count):
+    outputs = []
+    for i in range(count):
+      annotations = []
+      engine.run(i, self.frame, annotations)
+      outputs.append(_boxes(annotations))
+    return outputs
+
+  def test_restoring_state_replays_frames(self):
+    reference = self.run_frames(
+        vot.load('synthetic', _LABELS, vot.ObjectTrackingConfig()), 40)
+    for index in (30, 2, 39, 0):
+      self.engine.set_state(index)
+      self.assertEqual(self.run_frames(self.engine, 1), [reference[index]])
+    self.assertEqual(self.engine.get_state(), 1)
+
+  def test_batch_frames_run_from_the_same_state(self):
+    reference = self.run_frames(
+        vot.load('synthetic', _LABELS, vot.ObjectTrackingConfig()), 3)
+    self.engine.run(0, self.frame, [])
+    annotations = [[], [], []]
+    self.assertEqual(
+        self.engine.run_batch([1, 2, 3], [self.frame] * 3, annotations),
+        [True] * 3)
+    self.assertEqual([_boxes(a) for a in annotations], [reference[1]] * 3)
+    self.assertEqual(self.engine.get_state(), 2)
+    self.assertEqual(self.run_frames(self.engine, 1), [reference[2]])
+
+  def test_batch_checks_lengths(self):
+    with self.assertRaises(ValueError):
+      self.engine.run_batch([0], [self.frame] * 2, [[], []])
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -15,11 +15,13 @@
 # ==============================================================================
 """Provides an implementation of object tracking using TF and TF-TRT."""
 
-import numpy as np
+from automl_video_ondevice.object_tracking import motion_gate
 from automl_video_ondevice.object_tracking.base_object_detection import BaseObjectDetectionInference
 from automl_video_ondevice.types import NormalizedBoundingBox
 from automl_video_ondevice.types import ObjectTrackingAnnotation
 
+import automl_video_ondevice.utils as vot_utils
+
 try:
   import platform
   if platform.machine().lower() == 'aarch64':
@@ -212,20 +214,52 @@ class MediaPipeObjectTracker(BaseObjectDetectionInference):
   """MediaPipe-based tracking."""
 
   def __init__(self, object_detection_engine, config):
-    del config  # Not used, yet.
     self._mediapipe_tracker = mediapipe_tracker.MediaPipeTracker(
         mediapipe_graph)
     self._object_detection_engine = object_detection_engine
+    self._detection_interval = max(1, config.detection_interval)
+    self._frames_until_detection = 0
+    self.motion_gate = motion_gate.from_config(config)
 
   def input_size(self):
     return self._object_detection_engine.input_size()
 
+  def input_dtype(self):
+    return self._object_detection_engine.input_dtype()
+
+  @property
+  def startup_timings(self):
+    return self._object_detection_engine.startup_timings
+
+  def warmup(self, iterations=3):
+    # Only warms up the detector, so that no tracks are created.
+    return self._object_detection_engine.warmup(iterations)
+
+  def get_state(self):
+    return self._object_detection_engine.get_state()
+
+  def set_state(self, state):
+    self._object_detection_engine.set_state(state)
+    if self.motion_gate is not None:
+      self.motion_gate.reset()
+
   def run(self, timestamp, frame, annotations):
-    np_frame = np.array(frame)
+    np_frame = vot_utils.as_frame(frame)
 
+    # Between detections, and while nothing moves, the tracker runs on its own.
     detection_annotations = []
-    if self._object_detection_engine.run(timestamp, np_frame,
-                                         detection_annotations):
+    if self._frames_until_detection > 0 or (
+        self.motion_gate is not None and
+        not self.motion_gate.should_detect(np_frame)):
+      self._frames_until_detection = max(0, self._frames_until_detection - 1)
+      detected = True
+    else:
+      detected = self._object_detection_engine.run(timestamp, np_frame,
+                                                   detection_annotations)
+      if detected:
+        self._frames_until_detection = self._detection_interval - 1
+
+    if detected:
       converted_detections = []
       # Converts to MediaPipe Detection proto.
       for idx, annotation in enumerate(detection_annotations):
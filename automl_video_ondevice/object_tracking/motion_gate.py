@@ -0,0 +1,188 @@
+# Lint as: python3
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+"""Skips inference on frames where nothing moved.
+
+A MotionGate compares a small grayscale copy of each frame with the one of the
+last frame inference ran on, and only lets inference run once enough of its
+pixels changed. Comparing against the last inferred frame, rather than the
+previous frame, also catches slow movements. Inference still runs every
+motion_max_skipped_frames frames, so that gating never hides a scene for long.
+
+Trackers consult the gate before running the detector, and follow their
+tracks on skipped frames. Without a tracker, MotionGatedInference repeats the
+last detections on skipped frames.
+"""
+
+import dataclasses
+import itertools
+import weakref
+
+import numpy as np
+from automl_video_ondevice import metrics
+from automl_video_ondevice import profiling
+from automl_video_ondevice.object_tracking.base_object_detection import BaseObjectDetectionInference
+import automl_video_ondevice.utils as vot_utils
+
+# Frames are downscaled by averaging blocks of pixels, to about this width.
+_GATE_WIDTH = 64
+
+# Numbers the streams of gates created without a stream name.
+_stream_numbers = itertools.count()
+
+
+class MotionGate:
+  """Decides, frame by frame, whether a frame is worth running inference on."""
+
+  def __init__(self, config, stream=None):
+    """Constructor for MotionGate.
+
+    Args:
+      config: An ObjectTrackingConfig, with motion gating enabled.
+      stream: Names the stream in the gate's metrics. Defaults to a number
+        unique within the process, available as the stream attribute.
+    """
+    self.stream = stream or str(next(_stream_numbers))
+    self._threshold = config.motion_threshold
+    self._pixel_threshold = config.motion_pixel_threshold
+    self._max_skipped = config.motion_max_skipped_frames
+    self._reference = None
+    self._skipped_in_a_row = 0
+    self.detected = 0
+    self.skipped = 0
+    # Fraction of pixels that changed in the last gated frame.
+    self.last_motion = 0.0
+
+    self._frames_counter = {
+        decision: metrics.default_registry.counter(
+            'automl_video_motion_gate_frames_total',
+            'Frames seen by motion gates, by whether inference ran on them.',
+            {
+                'stream': self.stream,
+                'decision': decision
+            }) for decision in ('detected', 'skipped')
+    }
+    self._motion_gauge = metrics.default_registry.gauge(
+        'automl_video_motion_gate_motion',
+        'Fraction of pixels changed since the last inferred frame, as last '
+        'measured by a motion gate.', {'stream': self.stream})
+    # Gates have no close, so their metrics go away with them.
+    weakref.finalize(self, _unregister,
+                     list(self._frames_counter.values()) + [self._motion_gauge])
+
+  def should_detect(self, frame):
+    # type: (np.ndarray) -> bool
+    """Returns whether inference should run on the frame.
+
+    Once this returns True, the frame becomes the reference later frames are
+    compared with, so only call it when inference then runs.
+
+    Args:
+      frame: An (height, width, 3) frame.
+    """
+    with profiling.stage('motion_gate.difference'):
+      small = _downscale(frame)
+      if self._reference is None or self._reference.shape != small.shape:
+        detect = True
+      else:
+        changed = np.abs(small - self._reference) > self._pixel_threshold
+        self.last_motion = float(np.count_nonzero(changed)) / changed.size
+        self._motion_gauge.set(self.last_motion)
+        detect = (self.last_motion > self._threshold or
+                  self._skipped_in_a_row >= self._max_skipped)
+
+    if detect:
+      self._reference = small
+      self._skipped_in_a_row = 0
+      self.detected += 1
+      self._frames_counter['detected'].inc()
+    else:
+      self._skipped_in_a_row += 1
+      self.skipped += 1
+      self._frames_counter['skipped'].inc()
+    return detect
+
+  def reset(self):
+    """Makes the next frame run inference, such as after seeking."""
+    self._reference = None
+    self._skipped_in_a_row = 0
+
+
+def from_config(config, stream=None):
+  """Returns a MotionGate if the config enables gating, otherwise None."""
+  if config.motion_threshold <= 0:
+    return None
+  return MotionGate(config, stream)
+
+
+def _unregister(gate_metrics):
+  for metric in gate_metrics:
+    metrics.default_registry.unregister(metric)
+
+
+def _downscale(frame):
+  """Returns a small grayscale copy of the frame, as int16."""
+  height, width, _ = frame.shape
+  step = max(1, width // _GATE_WIDTH)
+  blocks = frame[:height - height % step, :width - width % step]
+  blocks = blocks.reshape(height // step, step, width // step, step, 3)
+  return blocks.mean(axis=(1, 3, 4), dtype=np.float32).astype(np.int16)
+
+
+class MotionGatedInference(BaseObjectDetectionInference):
+  """Repeats the last detections on frames where nothing moved."""
+
+  def __init__(self, object_detection_engine, config):
+    self._object_detection_engine = object_detection_engine
+    self.motion_gate = MotionGate(config)
+    self._last_annotations = []
+
+  def input_size(self):
+    return self._object_detection_engine.input_size()
+
+  def input_dtype(self):
+    return self._object_detection_engine.input_dtype()
+
+  @property
+  def startup_timings(self):
+    return self._object_detection_engine.startup_timings
+
+  def warmup(self, iterations=3):
+    return self._object_detection_engine.warmup(iterations)
+
+  def get_state(self):
+    return self._object_detection_engine.get_state()
+
+  def set_state(self, state):
+    self._object_detection_engine.set_state(state)
+    self.motion_gate.reset()
+
+  def run(self, timestamp, frame, annotations):
+    np_frame = vot_utils.as_frame(frame)
+    if not self.motion_gate.should_detect(np_frame):
+      annotations.extend(
+          dataclasses.replace(annotation, timestamp=timestamp)
+          for annotation in self._last_annotations)
+      return True
+
+    detection_annotations = []
+    if not self._object_detection_engine.run(timestamp, np_frame,
+                                             detection_annotations):
+      # Runs inference again on the next frame.
+      self.motion_gate.reset()
+      return False
+    self._last_annotations = detection_annotations
+    annotations.extend(detection_annotations)
+    return True
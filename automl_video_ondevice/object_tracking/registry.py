@@ -0,0 +1,224 @@
+# Lint as: python3
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+"""Shares loaded models between streams within a single process.
+
+Loading the same model twice with object_tracking.load creates two
+interpreters or sessions, each with its own copy of the weights. The registry
+instead loads each model once, and hands every stream a lightweight view of it.
+Views keep their own score threshold, tracker and LSTM state, and take turns
+running the shared model.
+
+Example:
+  streams = [
+      registry.load_shared('data/traffic_model.tflite',
+                           'data/traffic_label_map.pbtxt', config)
+      for _ in range(8)
+  ]
+  ...
+  for stream in streams:
+    registry.release(stream)
+"""
+
+import dataclasses
+import hashlib
+import os
+import threading
+
+from automl_video_ondevice.object_tracking.base_object_detection import BaseObjectDetectionInference
+from automl_video_ondevice.object_tracking.config import ObjectTrackingConfig
+from automl_video_ondevice.types import Format
+from automl_video_ondevice.types import Tracker
+import automl_video_ondevice.utils as vot_utils
+
+# Model file hashes, keyed by (path, mtime, size), so that files are only
+# hashed again when they change.
+_hash_cache = {}
+
+
+def model_hash(model_path):
+  # type: (str) -> str
+  """Returns the SHA-256 of a model file."""
+  if model_path == vot_utils.FAKE_SYNTHETIC_PATH:
+    return hashlib.sha256(model_path.encode('utf-8')).hexdigest()
+  stat = os.stat(model_path)
+  key = (os.path.realpath(model_path), stat.st_mtime_ns, stat.st_size)
+  if key not in _hash_cache:
+    with vot_utils.map_model_file(model_path) as model_buffer:
+      _hash_cache[key] = hashlib.sha256(model_buffer).hexdigest()
+  return _hash_cache[key]
+
+
+def _shared_config(config):
+  # type: (ObjectTrackingConfig) -> ObjectTrackingConfig
+  """Returns the config of a shared engine, without per-stream options."""
+  defaults = ObjectTrackingConfig()
+  return dataclasses.replace(
+      config,
+      score_threshold=0.0,
+      tracker=Tracker.NONE,
+      detection_interval=defaults.detection_interval,
+      motion_threshold=0.0,
+      motion_pixel_threshold=defaults.motion_pixel_threshold,
+      motion_max_skipped_frames=defaults.motion_max_skipped_frames)
+
+
+class _SharedModel:
+  """A loaded engine, and how many streams are using it."""
+
+  def __init__(self, key, engine):
+    self.key = key
+    self.engine = engine
+    self.initial_state = engine.get_state()
+    self.references = 0
+    # Interpreters and sessions are not safe to run from several threads, and
+    # each run swaps in the stream's own state.
+    self.lock = threading.Lock()
+
+
+class SharedObjectDetectionInference(BaseObjectDetectionInference):
+  """A single stream's view of a shared engine.
+
+  The shared engine outputs every detection, and each view filters them with
+  its own score threshold. LSTM state is swapped in and out around each run.
+  """
+
+  def __init__(self, shared_model, config):
+    # pylint: disable=super-init-not-called
+    self._shared_model = shared_model
+    self._config = config
+    self._state = shared_model.initial_state
+
+  def input_size(self):
+    return self._shared_model.engine.input_size()
+
+  def input_dtype(self):
+    return self._shared_model.engine.input_dtype()
+
+  def get_state(self):
+    return self._state
+
+  def set_state(self, state):
+    self._state = state
+
+  def run(self, timestamp, frame, annotations):
+    engine = self._shared_model.engine
+    detections = []
+    with self._shared_model.lock:
+      engine.set_state(self._state)
+      success = engine.run(timestamp, frame, detections)
+      self._state = engine.get_state()
+
+    for detection in detections:
+      if detection.confidence_score > self._config.score_threshold:
+        annotations.append(detection)
+    return success
+
+
+class EngineRegistry:
+  """Loads each distinct model once, and reference counts its streams."""
+
+  def __init__(self):
+    self._models = {}
+    self._stream_keys = {}
+    self._lock = threading.Lock()
+
+  def __len__(self):
+    """Returns how many distinct models are currently loaded."""
+    return len(self._models)
+
+  def load(self,
+           model_path,
+           label_map_path,
+           config,
+           file_format=Format.UNDEFINED):
+    # pylint: disable=line-too-long
+    # type: (str, str, ObjectTrackingConfig, Format) -> BaseObjectDetectionInference
+    # pylint: enable=line-too-long
+    """Returns a new stream using a shared instance of the model.
+
+    Models are shared when their file contents, label map and config match,
+    other than the score threshold, tracker, detection interval and motion
+    gating, which are per stream. Warm-up only happens when the model is first
+    loaded.
+
+    Args:
+      model_path: Path to the model frozen graph to be used.
+      label_map_path: Path to the labelmap .pbtxt file.
+      config: An ObjectTrackingConfig instance.
+      file_format: Specifies which format the graph is in. If undefined, will
+        make assumptions based on filename.
+
+    Returns:
+      An inference engine for a single stream. Pass it to release once done.
+    """
+    from automl_video_ondevice import object_tracking  # pylint: disable=g-import-not-at-top,import-outside-toplevel
+
+    shared_config = _shared_config(config)
+    # Warm-up does not change the engine's output.
+    key = (model_hash(model_path), os.path.realpath(label_map_path),
+           dataclasses.astuple(
+               dataclasses.replace(shared_config, warmup_iterations=0)),
+           file_format)
+    with self._lock:
+      shared_model = self._models.get(key)
+      if shared_model is None:
+        engine = object_tracking.load(model_path, label_map_path,
+                                      shared_config, file_format)
+        shared_model = _SharedModel(key, engine)
+        self._models[key] = shared_model
+      shared_model.references += 1
+
+    stream = object_tracking.attach_tracker(
+        SharedObjectDetectionInference(shared_model, config), config)
+    with self._lock:
+      self._stream_keys[id(stream)] = key
+    return stream
+
+  def release(self, stream):
+    # type: (BaseObjectDetectionInference) -> None
+    """Releases a stream, unloading its model once no stream uses it.
+
+    Args:
+      stream: An engine returned by load.
+    """
+    with self._lock:
+      key = self._stream_keys.pop(id(stream), None)
+      if key is None:
+        raise ValueError('Stream was not loaded by this registry.')
+      shared_model = self._models[key]
+      shared_model.references -= 1
+      if shared_model.references == 0:
+        del self._models[key]
+
+
+default_registry = EngineRegistry()
+
+
+def load_shared(model_path,
+                label_map_path,
+                config,
+                file_format=Format.UNDEFINED):
+  # pylint: disable=line-too-long
+  # type: (str, str, ObjectTrackingConfig, Format) -> BaseObjectDetectionInference
+  # pylint: enable=line-too-long
+  """Loads a stream sharing its model through the default registry."""
+  return default_registry.load(model_path, label_map_path, config, file_format)
+
+
+def release(stream):
+  # type: (BaseObjectDetectionInference) -> None
+  """Releases a stream loaded by load_shared."""
+  default_registry.release(stream)
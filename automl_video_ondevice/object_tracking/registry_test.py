@@ -0,0 +1,85 @@
+# Lint as: python3
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+"""Tests for the model registry, using the fake engine."""
+
+import os
+import unittest
+
+import numpy as np
+from automl_video_ondevice.object_tracking import registry
+from automl_video_ondevice.object_tracking.config import ObjectTrackingConfig
+
+_LABELS = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), '..', '..', 'data',
+    'traffic_label_map.pbtxt')
+
+
+class EngineRegistryTest(unittest.TestCase):
+
+  def setUp(self):
+    super().setUp()
+    self.registry = registry.EngineRegistry()
+
+  def test_shares_model_between_per_stream_options(self):
+    first = self.registry.load('synthetic', _LABELS, ObjectTrackingConfig())
+    second = self.registry.load(
+        'synthetic', _LABELS,
+        ObjectTrackingConfig(
+            score_threshold=0.5, detection_interval=3, motion_threshold=0.1,
+            warmup_iterations=2))
+    self.assertEqual(len(self.registry), 1)
+    self.registry.release(first)
+    self.assertEqual(len(self.registry), 1)
+    self.registry.release(second)
+    self.assertEqual(len(self.registry), 0)
+
+  def test_does_not_share_models_with_different_output(self):
+    streams = [
+        self.registry.load('synthetic', _LABELS, config) for config in (
+            ObjectTrackingConfig(),
+            ObjectTrackingConfig(max_detections=5),
+            ObjectTrackingConfig(fake_seed=1),
+            ObjectTrackingConfig(input_mean=0.0, input_std=255.0),
+        )
+    ]
+    self.assertEqual(len(self.registry), 4)
+    for stream in streams:
+      self.registry.release(stream)
+
+  def test_streams_keep_their_own_state_and_threshold(self):
+    low = self.registry.load('synthetic', _LABELS, ObjectTrackingConfig())
+    high = self.registry.load('synthetic', _LABELS,
+                              ObjectTrackingConfig(score_threshold=0.5))
+    frame = np.zeros((256, 256, 3), np.uint8)
+    for i in range(3):
+      low_annotations = []
+      low.run(i, frame, low_annotations)
+    high_annotations = []
+    high.run(0, frame, high_annotations)
+    self.assertEqual(low.get_state(), 3)
+    self.assertEqual(high.get_state(), 1)
+    self.assertTrue(
+        all(a.confidence_score > 0.5 for a in high_annotations))
+    self.registry.release(low)
+    self.registry.release(high)
+
+  def test_release_unknown_stream(self):
+    with self.assertRaises(ValueError):
+      self.registry.release(object())
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,330 @@
+# Lint as: python3
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+"""Runs object tracking over a single long video, split across processes.
+
+The video is split into time segments, and each segment is handled by a
+separate worker process with its own inference engine. Each worker seeks to a
+little before the start of its segment, so that LSTM state and trackers are
+warmed up by the time the segment actually begins. Track ids are then stitched
+across segment boundaries by matching boxes in that overlap region.
+
+Example:
+  annotations = segment_runner.run_segments(
+      'data/traffic_model.tflite', 'data/traffic_label_map.pbtxt',
+      vot.ObjectTrackingConfig(score_threshold=0.2), 'data/traffic_frames.mp4')
+"""
+
+import bisect
+import concurrent.futures
+import copy
+import dataclasses
+import os
+from typing import Dict, List, Optional
+
+from automl_video_ondevice.object_tracking.config import ObjectTrackingConfig
+from automl_video_ondevice.object_tracking.mediapipe_track_validator import calculate_iou
+from automl_video_ondevice.types import Format
+from automl_video_ondevice.types import ObjectTrackingAnnotation
+
+
+@dataclasses.dataclass
+class Segment:
+  """A time range of the video, processed by a single worker."""
+  index: int
+  start_ms: float  # First timestamp whose output is kept.
+  end_ms: float  # Timestamps at or past this belong to the next segment.
+  seek_ms: float  # Where the worker starts decoding, for warm-up.
+
+
+@dataclasses.dataclass
+class SegmentResult:
+  """Output of a single segment."""
+  index: int
+  # Annotations for timestamps within [start_ms, end_ms).
+  annotations: List[ObjectTrackingAnnotation]
+  # Annotations for timestamps within [seek_ms, start_ms), only used to stitch
+  # track ids to the previous segment.
+  overlap_annotations: List[ObjectTrackingAnnotation]
+  frames: int
+
+
+def video_duration_ms(video_path):
+  # type: (str) -> float
+  """Returns the duration of a video file, in milliseconds."""
+  import cv2  # pylint: disable=g-import-not-at-top,import-outside-toplevel
+  cap = cv2.VideoCapture(video_path)
+  if not cap.isOpened():
+    raise ValueError('Could not open video: {}'.format(video_path))
+  fps = cap.get(cv2.CAP_PROP_FPS)
+  frame_count = cap.get(cv2.CAP_PROP_FRAME_COUNT)
+  cap.release()
+  if fps <= 0 or frame_count <= 0:
+    raise ValueError('Could not determine the duration of: {}'.format(
+        video_path))
+  return frame_count / fps * 1000
+
+
+def split_segments(duration_ms, num_segments, overlap_ms):
+  # type: (float, int, float) -> List[Segment]
+  """Splits a duration into equally sized segments.
+
+  Args:
+    duration_ms: Total duration of the video, in milliseconds.
+    num_segments: How many segments to split the video into.
+    overlap_ms: How far before its start each segment begins decoding.
+
+  Returns:
+    List of segments, in order.
+  """
+  if num_segments <= 0:
+    raise ValueError('num_segments must be positive.')
+  segment_ms = duration_ms / num_segments
+  segments = []
+  for i in range(num_segments):
+    start_ms = i * segment_ms
+    # The last segment reads until the end of the file, in case the reported
+    # duration is slightly off.
+    end_ms = (i + 1) * segment_ms if i < num_segments - 1 else float('inf')
+    segments.append(
+        Segment(
+            index=i,
+            start_ms=start_ms,
+            end_ms=end_ms,
+            seek_ms=max(0.0, start_ms - overlap_ms)))
+  return segments
+
+
+def _process_segment(model_path, label_map_path, config, file_format,
+                     video_path, segment):
+  # pylint: disable=line-too-long
+  # type: (str, str, ObjectTrackingConfig, Format, str, Segment) -> SegmentResult
+  # pylint: enable=line-too-long
+  """Runs a fresh inference engine over a single segment.
+
+  This runs inside of a worker process, so heavy modules are imported here.
+  """
+  # pylint: disable=g-import-not-at-top,import-outside-toplevel
+  import cv2
+  from automl_video_ondevice import object_tracking as vot
+  # pylint: enable=g-import-not-at-top,import-outside-toplevel
+
+  engine = vot.load(model_path, label_map_path, config, file_format)
+  input_size = engine.input_size()
+
+  cap = cv2.VideoCapture(video_path)
+  if segment.seek_ms > 0:
+    cap.set(cv2.CAP_PROP_POS_MSEC, segment.seek_ms)
+
+  result = SegmentResult(
+      index=segment.index, annotations=[], overlap_annotations=[], frames=0)
+  while cap.isOpened():
+    ret, frame = cap.read()
+    if not ret:
+      break
+
+    position_ms = cap.get(cv2.CAP_PROP_POS_MSEC)
+    if position_ms >= segment.end_ms:
+      break
+    # Timestamps are in microseconds, like the other demos.
+    timestamp = int(position_ms * 1000)
+
+    resized_frame = cv2.resize(frame, (input_size.width, input_size.height))
+    rgb_frame = cv2.cvtColor(resized_frame, cv2.COLOR_BGR2RGB)
+
+    annotations = []
+    if not engine.run(timestamp, rgb_frame, annotations):
+      continue
+    result.frames += 1
+
+    # Trackers keep updating the annotations they output, so each frame's
+    # output is snapshotted and stamped with the frame it was produced on.
+    annotations = copy.deepcopy(annotations)
+    for annotation in annotations:
+      annotation.timestamp = timestamp
+
+    if position_ms < segment.start_ms:
+      result.overlap_annotations.extend(annotations)
+    else:
+      result.annotations.extend(annotations)
+  cap.release()
+  return result
+
+
+def _group_by_timestamp(annotations):
+  # pylint: disable=line-too-long
+  # type: (List[ObjectTrackingAnnotation]) -> Dict[int, List[ObjectTrackingAnnotation]]
+  # pylint: enable=line-too-long
+  groups = {}
+  for annotation in annotations:
+    groups.setdefault(annotation.timestamp, []).append(annotation)
+  return groups
+
+
+def _nearest_timestamp(timestamps, timestamp):
+  # type: (List[int], int) -> Optional[int]
+  """Returns the timestamp of a sorted list closest to timestamp."""
+  index = bisect.bisect_left(timestamps, timestamp)
+  candidates = timestamps[max(0, index - 1):index + 1]
+  if not candidates:
+    return None
+  return min(candidates, key=lambda candidate: abs(candidate - timestamp))
+
+
+def _half_frame_period(timestamps):
+  # type: (List[int]) -> float
+  """Returns half the median interval between sorted frame timestamps."""
+  intervals = sorted(b - a for a, b in zip(timestamps, timestamps[1:]))
+  if not intervals:
+    return 0.0
+  return intervals[len(intervals) // 2] / 2
+
+
+def match_tracks(previous_annotations,
+                 overlap_annotations,
+                 min_iou=0.5,
+                 max_offset_us=None):
+  # pylint: disable=line-too-long
+  # type: (List[ObjectTrackingAnnotation], List[ObjectTrackingAnnotation], float, Optional[float]) -> Dict[int, int]
+  # pylint: enable=line-too-long
+  """Matches track ids of two segments, using their shared overlap region.
+
+  Each frame of the overlap is compared with the previous segment's frame
+  nearest in time, since workers decoding from different seek points do not
+  always report the same timestamps for a frame. Boxes of the two frames are
+  compared by IOU, and each pair of track ids accumulates the IOU of every
+  frame they matched on. Pairs are then assigned greedily, best first.
+
+  Args:
+    previous_annotations: Annotations of the previous segment, with global
+      track ids.
+    overlap_annotations: Annotations of the next segment over the same frames,
+      with track ids local to that segment.
+    min_iou: How much two boxes must overlap to count as the same object.
+    max_offset_us: How far apart, in microseconds, the timestamps of frames
+      compared can be. Defaults to half the previous segment's frame period.
+
+  Returns:
+    Dictionary mapping local track ids to global track ids.
+  """
+  previous_by_timestamp = _group_by_timestamp(previous_annotations)
+  previous_timestamps = sorted(previous_by_timestamp)
+  if max_offset_us is None:
+    max_offset_us = _half_frame_period(previous_timestamps)
+  scores = {}
+  for timestamp, annotations in _group_by_timestamp(
+      overlap_annotations).items():
+    previous_timestamp = _nearest_timestamp(previous_timestamps, timestamp)
+    if (previous_timestamp is None or
+        abs(previous_timestamp - timestamp) > max_offset_us):
+      continue
+    for annotation in annotations:
+      if annotation.track_id < 0:
+        continue
+      for previous in previous_by_timestamp[previous_timestamp]:
+        if previous.track_id < 0 or previous.class_id != annotation.class_id:
+          continue
+        iou = calculate_iou(annotation.bbox, previous.bbox)
+        if iou > min_iou:
+          key = (annotation.track_id, previous.track_id)
+          scores[key] = scores.get(key, 0.0) + iou
+
+  track_map = {}
+  assigned_global_ids = set()
+  for (local_id, global_id), _ in sorted(
+      scores.items(), key=lambda item: item[1], reverse=True):
+    if local_id in track_map or global_id in assigned_global_ids:
+      continue
+    track_map[local_id] = global_id
+    assigned_global_ids.add(global_id)
+  return track_map
+
+
+def stitch_segments(results, min_iou=0.5):
+  # type: (List[SegmentResult], float) -> List[ObjectTrackingAnnotation]
+  """Joins segment results, making track ids consistent across segments.
+
+  Args:
+    results: Segment results, ordered by segment index.
+    min_iou: How much two boxes must overlap to count as the same object.
+
+  Returns:
+    All annotations of the video, in timestamp order.
+  """
+  output = []
+  next_track_id = 0
+  for result in results:
+    track_map = {}
+    if output:
+      track_map = match_tracks(output, result.overlap_annotations, min_iou)
+
+    for annotation in result.annotations:
+      if annotation.track_id < 0:
+        output.append(annotation)
+        continue
+      if annotation.track_id not in track_map:
+        track_map[annotation.track_id] = next_track_id
+        next_track_id += 1
+      annotation.track_id = track_map[annotation.track_id]
+      output.append(annotation)
+
+  output.sort(key=lambda annotation: annotation.timestamp)
+  return output
+
+
+def run_segments(model_path,
+                 label_map_path,
+                 config,
+                 video_path,
+                 num_workers=None,
+                 num_segments=None,
+                 overlap_ms=2000.0,
+                 min_iou=0.5,
+                 file_format=Format.UNDEFINED):
+  # pylint: disable=line-too-long
+  # type: (str, str, ObjectTrackingConfig, str, Optional[int], Optional[int], float, float, Format) -> List[ObjectTrackingAnnotation]
+  # pylint: enable=line-too-long
+  """Runs object tracking over a video file, using several processes.
+
+  Args:
+    model_path: Path to the model to be used.
+    label_map_path: Path to the labelmap .pbtxt file.
+    config: An ObjectTrackingConfig instance.
+    video_path: Path to the video file to process.
+    num_workers: How many worker processes to use. Defaults to the CPU count.
+    num_segments: How many segments to split the video into. Defaults to the
+      number of workers.
+    overlap_ms: How long each segment warms up before its start. This warms up
+      LSTM state and trackers, and is used to stitch track ids together.
+    min_iou: How much two boxes must overlap to be stitched together.
+    file_format: Specifies which format the graph is in. If undefined, will make
+      assumptions based on filename.
+
+  Returns:
+    All annotations of the video, in timestamp order.
+  """
+  num_workers = num_workers or os.cpu_count() or 1
+  num_segments = num_segments or num_workers
+  segments = split_segments(
+      video_duration_ms(video_path), num_segments, overlap_ms)
+
+  with concurrent.futures.ProcessPoolExecutor(max_workers=num_workers) as pool:
+    futures = [
+        pool.submit(_process_segment, model_path, label_map_path, config,
+                    file_format, video_path, segment) for segment in segments
+    ]
+    results = [future.result() for future in futures]
+
+  return stitch_segments(results, min_iou)
@@ -0,0 +1,294 @@
+# Lint as: python3
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+"""Deterministic synthetic scenes of moving boxes, for exercising trackers.
+
+A scenario moves a number of solid colored boxes around a noisy background,
+bouncing off the frame edges. Every frame comes with the ground truth boxes,
+and with detections as a model would output them: jittered by noise, and
+missing for boxes that are occluded. The same seed always produces the same
+frames, so tracker cost and quality can be compared without a model.
+
+Example:
+  scenario = synthetic.Scenario(synthetic.ScenarioConfig(num_objects=100))
+  for frame in scenario.frames():
+    tracker.correct(frame.detections, frame.image)
+"""
+
+import dataclasses
+import itertools
+from typing import Iterator, List, Optional, Tuple
+
+import numpy as np
+from automl_video_ondevice.types import NormalizedBoundingBox
+from automl_video_ondevice.types import ObjectTrackingAnnotation
+
+
+@dataclasses.dataclass
+class ScenarioConfig:
+  num_objects: int = 10
+  num_frames: int = 100  # 0 generates frames forever.
+  width: int = 256
+  height: int = 256
+  frame_rate: float = 30.0
+  num_classes: int = 3
+  # Range of box widths and heights, relative to the frame size.
+  min_box_size: float = 0.04
+  max_box_size: float = 0.12
+  # Largest distance a box moves per frame, relative to the frame size.
+  speed: float = 0.01
+  # Chance per frame that a visible box becomes occluded.
+  occlusion_probability: float = 0.0
+  # How many frames an occlusion lasts.
+  occlusion_frames: int = 5
+  # Standard deviation of the detection box edges, relative to the frame size.
+  detection_noise: float = 0.005
+  # Detection confidence scores are drawn uniformly from this range.
+  min_score: float = 0.5
+  max_score: float = 1.0
+  seed: int = 0
+  # Whether to render images. Consumers that only need the boxes, such as the
+  # fake detection engine, skip it.
+  render: bool = True
+
+
+@dataclasses.dataclass
+class SyntheticFrame:
+  index: int
+  timestamp: int  # Microseconds.
+  image: Optional[np.ndarray]  # uint8 (height, width, 3), None if not rendered.
+  # Every object, occluded or not, with track_id set to the object id.
+  ground_truth: List[ObjectTrackingAnnotation]
+  # Which ground truth objects are occluded in this frame.
+  occluded: List[bool]
+  # What a detector would output: noisy boxes of visible objects only.
+  detections: List[ObjectTrackingAnnotation]
+
+
+class Scenario:
+  """Generates the frames of a single synthetic scene."""
+
+  def __init__(self, config):
+    # type: (ScenarioConfig) -> None
+    self.config = config
+    random = np.random.RandomState(config.seed)
+    n = config.num_objects
+    self._sizes = random.uniform(config.min_box_size, config.max_box_size,
+                                 (n, 2))
+    self._positions = random.uniform(0, 1, (n, 2)) * (1 - self._sizes)
+    self._velocities = random.uniform(-config.speed, config.speed, (n, 2))
+    self._class_ids = random.randint(0, config.num_classes, n)
+    # Fully saturated hues, so that color-based trackers can tell boxes apart.
+    hues = random.uniform(0, 1, n)
+    self._colors = np.array([_hue_to_bgr(hue) for hue in hues],
+                            dtype=np.uint8).reshape(n, 3)
+    self._background = random.randint(
+        0, 48, (config.height, config.width, 3)).astype(np.uint8)
+    self._seed = config.seed
+
+  def frames(self):
+    # type: () -> Iterator[SyntheticFrame]
+    """Yields every frame of the scenario, always the same for a seed."""
+    config = self.config
+    # Separate streams, so that changing the noise does not change motion.
+    occlusion_random = np.random.RandomState(self._seed + 1)
+    detection_random = np.random.RandomState(self._seed + 2)
+    positions = self._positions.copy()
+    velocities = self._velocities.copy()
+    occluded_for = np.zeros(config.num_objects, dtype=np.int64)
+
+    if config.num_frames > 0:
+      indices = range(config.num_frames)
+    else:
+      indices = itertools.count()
+    for index in indices:
+      occluded_for = np.maximum(occluded_for - 1, 0)
+      starts = occlusion_random.uniform(0, 1, config.num_objects)
+      occluded_for[(occluded_for == 0) &
+                   (starts < config.occlusion_probability)] = (
+                       config.occlusion_frames)
+      occluded = occluded_for > 0
+
+      timestamp = int(index / config.frame_rate * 1000 * 1000)
+      boxes = np.concatenate([positions, positions + self._sizes], axis=1)
+      image = self._render(boxes, occluded) if config.render else None
+
+      noisy_boxes = np.clip(
+          boxes + detection_random.normal(0, config.detection_noise,
+                                          boxes.shape), 0, 1)
+      scores = detection_random.uniform(config.min_score, config.max_score,
+                                        config.num_objects)
+      ground_truth = [
+          _annotation(timestamp, i, self._class_ids[i], 1.0, boxes[i])
+          for i in range(config.num_objects)
+      ]
+      detections = [
+          _annotation(timestamp, -1, self._class_ids[i], scores[i],
+                      noisy_boxes[i])
+          for i in range(config.num_objects)
+          if not occluded[i]
+      ]
+      yield SyntheticFrame(
+          index=index,
+          timestamp=timestamp,
+          image=image,
+          ground_truth=ground_truth,
+          occluded=occluded.tolist(),
+          detections=detections)
+
+      positions += velocities
+      # Bounces off the frame edges.
+      out_of_bounds = (positions < 0) | (positions + self._sizes > 1)
+      velocities[out_of_bounds] *= -1
+      positions = np.clip(positions, 0, 1 - self._sizes)
+
+  def _render(self, boxes, occluded):
+    image = self._background.copy()
+    height, width = image.shape[:2]
+    pixels = np.round(boxes * [width, height, width, height]).astype(np.int64)
+    for i in np.flatnonzero(~occluded):
+      left, top, right, bottom = pixels[i]
+      image[top:bottom, left:right] = self._colors[i]
+    return image
+
+
+def _annotation(timestamp, track_id, class_id, score, box):
+  return ObjectTrackingAnnotation(
+      timestamp=timestamp,
+      track_id=int(track_id),
+      class_id=int(class_id),
+      class_name='class_{}'.format(class_id),
+      confidence_score=float(score),
+      bbox=NormalizedBoundingBox(
+          left=float(box[0]),
+          top=float(box[1]),
+          right=float(box[2]),
+          bottom=float(box[3])))
+
+
+def _hue_to_bgr(hue):
+  """Converts a hue in [0, 1) to a fully saturated, bright BGR color."""
+  red, green, blue = np.clip(
+      np.abs((hue * 6 + np.array([0, 4, 2])) % 6 - 3) - 1, 0, 1)
+  return (np.array([blue, green, red]) * 255).astype(np.uint8)
+
+
+def boxes_to_array(annotations):
+  # type: (List[ObjectTrackingAnnotation]) -> np.ndarray
+  """Returns the boxes of annotations as an (n, 4) array of l, t, r, b."""
+  return np.array([(a.bbox.left, a.bbox.top, a.bbox.right, a.bbox.bottom)
+                   for a in annotations],
+                  dtype=np.float64).reshape(-1, 4)
+
+
+def match_boxes(boxes1, boxes2, min_iou=0.5):
+  # type: (np.ndarray, np.ndarray, float) -> List[Tuple[int, int]]
+  """Greedily matches two sets of boxes by highest IoU first.
+
+  Vectorized, so that scenes with thousands of boxes can be evaluated.
+
+  Args:
+    boxes1: Array of shape (n, 4), as returned by boxes_to_array.
+    boxes2: Array of shape (m, 4).
+    min_iou: Pairs with a lower IoU are never matched.
+
+  Returns:
+    (index into boxes1, index into boxes2) of every matched pair.
+  """
+  if not len(boxes1) or not len(boxes2):
+    return []
+  a = boxes1[:, None, :]
+  b = boxes2[None, :, :]
+  overlap_x = np.clip(
+      np.minimum(a[..., 2], b[..., 2]) - np.maximum(a[..., 0], b[..., 0]), 0,
+      None)
+  overlap_y = np.clip(
+      np.minimum(a[..., 3], b[..., 3]) - np.maximum(a[..., 1], b[..., 1]), 0,
+      None)
+  intersection = overlap_x * overlap_y
+  area1 = (a[..., 2] - a[..., 0]) * (a[..., 3] - a[..., 1])
+  area2 = (b[..., 2] - b[..., 0]) * (b[..., 3] - b[..., 1])
+  union = area1 + area2 - intersection
+  iou = np.divide(
+      intersection, union, out=np.zeros_like(intersection), where=union > 0)
+
+  rows, columns = np.nonzero(iou >= min_iou)
+  order = np.argsort(-iou[rows, columns], kind='stable')
+  matched1 = set()
+  matched2 = set()
+  matches = []
+  for k in order:
+    i, j = int(rows[k]), int(columns[k])
+    if i in matched1 or j in matched2:
+      continue
+    matched1.add(i)
+    matched2.add(j)
+    matches.append((i, j))
+  return matches
+
+
+class TrackScorer:
+  """Counts ID switches and misses of tracker output against ground truth.
+
+  An ID switch is counted whenever a ground truth object is matched to a
+  different track id than the last time it was matched.
+  """
+
+  def __init__(self, min_iou=0.5, match_classes=False):
+    """Constructor for TrackScorer.
+
+    Args:
+      min_iou: How much a track must overlap a ground truth box to match it.
+      match_classes: Whether tracks only match ground truth of their class.
+    """
+    self._min_iou = min_iou
+    self._match_classes = match_classes
+    self._last_track_ids = {}
+    self.id_switches = 0
+    self.matches = 0
+    self.misses = 0  # Visible ground truth objects without a matching track.
+
+  def update(self, ground_truth, occluded, tracks):
+    # pylint: disable=line-too-long
+    # type: (List[ObjectTrackingAnnotation], List[bool], List[ObjectTrackingAnnotation]) -> None
+    # pylint: enable=line-too-long
+    """Scores the tracks output for a single frame."""
+    visible = [gt for gt, hidden in zip(ground_truth, occluded) if not hidden]
+    if self._match_classes:
+      matches = []
+      for class_id in set(gt.class_id for gt in visible):
+        class_visible = [
+            i for i, gt in enumerate(visible) if gt.class_id == class_id
+        ]
+        class_tracks = [
+            j for j, track in enumerate(tracks) if track.class_id == class_id
+        ]
+        matches.extend(
+            (class_visible[i], class_tracks[j]) for i, j in match_boxes(
+                boxes_to_array([visible[i] for i in class_visible]),
+                boxes_to_array([tracks[j] for j in class_tracks]),
+                self._min_iou))
+    else:
+      matches = match_boxes(
+          boxes_to_array(visible), boxes_to_array(tracks), self._min_iou)
+    self.matches += len(matches)
+    self.misses += len(visible) - len(matches)
+    for i, j in matches:
+      object_id = visible[i].track_id
+      track_id = tracks[j].track_id
+      last_track_id = self._last_track_ids.get(object_id)
+      if last_track_id is not None and last_track_id != track_id:
+        self.id_switches += 1
+      self._last_track_ids[object_id] = track_id
@@ -15,15 +15,17 @@
 # ==============================================================================
 """Provides an implementation of object tracking using TF and TF-TRT."""
 
+import concurrent.futures
 import numpy as np
 import tensorflow.compat.v1 as tf
+from automl_video_ondevice import profiling
 from automl_video_ondevice.object_tracking.base_object_detection import BaseObjectDetectionInference
+from automl_video_ondevice.object_tracking.base_object_detection import check_batch
 from automl_video_ondevice.types import NormalizedBoundingBox
 from automl_video_ondevice.types import ObjectTrackingAnnotation
 from automl_video_ondevice.types import Size
 
 import automl_video_ondevice.utils as vot_utils
-import tensorflow.contrib.tensorrt as trt  # pylint: disable=g-explicit-tensorflow-version-import,unused-import
 
 
 class TFObjectDetectionInference(BaseObjectDetectionInference):
@@ -38,33 +40,47 @@ class TFObjectDetectionInference(BaseObjectDetectionInference):
 
   def __init__(self, frozen_graph_path, label_map_path, config):
     self.config = config
+    self._startup_timer = vot_utils.StartupTimer()
 
-    self._load_label_map(label_map_path)
-    self._load_frozen_graph(frozen_graph_path)
+    # The label map is parsed while the graph is being loaded.
+    with concurrent.futures.ThreadPoolExecutor(max_workers=1) as executor:
+      label_map_future = executor.submit(self._load_label_map, label_map_path)
+      self._load_frozen_graph(frozen_graph_path)
+      label_map_future.result()
+
+    self.startup_timings = self._startup_timer.finish()
 
   def _load_label_map(self, label_map_path):
-    with open(label_map_path, 'r') as f:
-      self.label_map, _ = vot_utils.parse_label_map(f.read())
+    with self._startup_timer.measure('label_map'):
+      self.label_map, _ = vot_utils.load_label_map(label_map_path)
 
   def _load_frozen_graph(self, frozen_graph_path):
     trt_graph = tf.GraphDef()
-    with open(frozen_graph_path, 'rb') as f:
-      trt_graph.ParseFromString(f.read())
+    with self._startup_timer.measure('parse_graph'):
+      with vot_utils.map_model_file(frozen_graph_path) as model_buffer:
+        trt_graph.ParseFromString(model_buffer)
+
+    if self._check_trt(trt_graph):
+      # Registers the TensorRT ops. Only needed, and only imported, for TF-TRT
+      # graphs since it is slow to import.
+      import tensorflow.contrib.tensorrt as trt  # pylint: disable=g-explicit-tensorflow-version-import,unused-import,g-import-not-at-top,import-outside-toplevel
 
     self._is_lstm = self._check_lstm(trt_graph)
     if self._is_lstm:
       print('Loading an LSTM model.')
 
     self.graph = tf.Graph()
-    with self.graph.as_default():
-      self.output_node = tf.import_graph_def(
-          trt_graph,
-          return_elements=[
-              'detection_boxes:0', 'detection_classes:0', 'detection_scores:0',
-              'num_detections:0'
-          ] + (['raw_outputs/lstm_c:0', 'raw_outputs/lstm_h:0']
-               if self._is_lstm else []))
-    self.session = tf.InteractiveSession(graph=self.graph)
+    with self._startup_timer.measure('import_graph'):
+      with self.graph.as_default():
+        self.output_node = tf.import_graph_def(
+            trt_graph,
+            return_elements=[
+                'detection_boxes:0', 'detection_classes:0',
+                'detection_scores:0', 'num_detections:0'
+            ] + (['raw_outputs/lstm_c:0', 'raw_outputs/lstm_h:0']
+                 if self._is_lstm else []))
+    with self._startup_timer.measure('session'):
+      self.session = tf.InteractiveSession(graph=self.graph)
 
     tf_scores = self.graph.get_tensor_by_name('import/detection_scores:0')
     tf_boxes = self.graph.get_tensor_by_name('import/detection_boxes:0')
@@ -81,6 +97,9 @@ class TFObjectDetectionInference(BaseObjectDetectionInference):
       self.lstm_c = np.ones((1, 8, 8, 320))
       self.lstm_h = np.ones((1, 8, 8, 320))
 
+  def _check_trt(self, graph_def):
+    return vot_utils.has_trt_ops(graph_def)
+
   def _check_lstm(self, graph_def):
     for node in graph_def.node:
       if node.name == 'raw_outputs/lstm_c' or node.name == 'raw_outputs/lstm_h':
@@ -90,19 +109,34 @@ class TFObjectDetectionInference(BaseObjectDetectionInference):
   def input_size(self):
     return Size(256, 256)
 
+  def get_state(self):
+    if not self._is_lstm:
+      return None
+    return (np.copy(self.lstm_c), np.copy(self.lstm_h))
+
+  def set_state(self, state):
+    if not self._is_lstm or state is None:
+      return
+    self.lstm_c = np.copy(state[0])
+    self.lstm_h = np.copy(state[1])
+
   def run(self, timestamp, frame, annotations):
     with self.graph.as_default():
       # Tensors to feed in.
-      feed_dict = {
-          'import/image_tensor:0': np.array(frame)[None, ...],
-      }
-      if self._is_lstm:
-        feed_dict.update({
-            'import/raw_inputs/init_lstm_c:0': self.lstm_c,
-            'import/raw_inputs/init_lstm_h:0': self.lstm_h
-        })
-
-      session_return = self.session.run(self._output_nodes, feed_dict=feed_dict)
+      with profiling.stage('tf.fill_inputs'):
+        feed_dict = {
+            'import/image_tensor:0':
+                vot_utils.as_frame(frame, self.input_dtype())[None, ...],
+        }
+        if self._is_lstm:
+          feed_dict.update({
+              'import/raw_inputs/init_lstm_c:0': self.lstm_c,
+              'import/raw_inputs/init_lstm_h:0': self.lstm_h
+          })
+
+      with profiling.stage('tf.session_run'):
+        session_return = self.session.run(
+            self._output_nodes, feed_dict=feed_dict)
 
       # Unpacks tensor output.
       if self._is_lstm:
@@ -112,11 +146,47 @@ class TFObjectDetectionInference(BaseObjectDetectionInference):
         (detection_scores, detection_boxes, detection_classes,
          num_detections) = session_return
 
-    boxes = detection_boxes[0]  # index by 0 to remove batch dimension
-    scores = detection_scores[0]
-    classes = detection_classes[0]
+    with profiling.stage('tf.postprocess'):
+      # Indexes by 0 to remove the batch dimension.
+      self._append_annotations(timestamp, detection_boxes[0],
+                               detection_scores[0], detection_classes[0],
+                               int(num_detections), annotations)
+
+    return True
 
-    for i in range(int(num_detections)):
+  def run_batch(self, timestamps, frames, annotations):
+    if self._is_lstm:
+      # The recurrent state belongs to a single video, so frames are run one
+      # at a time, each from the state the batch started with.
+      return super().run_batch(timestamps, frames, annotations)
+    check_batch(timestamps, frames, annotations)
+
+    with self.graph.as_default():
+      with profiling.stage('tf.fill_inputs'):
+        feed_dict = {
+            'import/image_tensor:0':
+                np.stack([
+                    vot_utils.as_frame(frame, self.input_dtype())
+                    for frame in frames
+                ]),
+        }
+
+      with profiling.stage('tf.session_run'):
+        (detection_scores, detection_boxes, detection_classes,
+         num_detections) = self.session.run(
+             self._output_nodes, feed_dict=feed_dict)
+
+    with profiling.stage('tf.postprocess'):
+      for i, timestamp in enumerate(timestamps):
+        self._append_annotations(timestamp, detection_boxes[i],
+                                 detection_scores[i], detection_classes[i],
+                                 int(num_detections[i]), annotations[i])
+
+    return [True] * len(timestamps)
+
+  def _append_annotations(self, timestamp, boxes, scores, classes,
+                          num_detections, annotations):
+    for i in range(num_detections):
       box = boxes[i]
 
       if scores[i] > self.config.score_threshold:
@@ -133,5 +203,3 @@ class TFObjectDetectionInference(BaseObjectDetectionInference):
             bbox=bbox)
 
         annotations.append(annotation)
-
-    return True
@@ -15,6 +15,7 @@
 # ==============================================================================
 """Provides an implementation of object tracking using EdgeTPU TFLite."""
 
+import concurrent.futures
 from os import path
 import numpy as np
 try:
@@ -25,6 +26,7 @@ except:
 	except:
 		print("Can't find the TFLite runtime. Follow directions here: https://www.tensorflow.org/lite/guide/python")
 import platform
+from automl_video_ondevice import profiling
 from automl_video_ondevice.object_tracking.base_object_detection import BaseObjectDetectionInference
 from automl_video_ondevice.types import NormalizedBoundingBox
 from automl_video_ondevice.types import ObjectTrackingAnnotation
@@ -38,6 +40,10 @@ EDGETPU_SHARED_LIB = {
   'Windows': 'edgetpu.dll'
 }[platform.system()]  # pylint: disable=line-too-long
 
+# Normalization of float and int8 inputs, when the config leaves it unset.
+_DEFAULT_INPUT_MEAN = 127.5
+_DEFAULT_INPUT_STD = 127.5
+
 
 class TFLiteObjectDetectionInference(BaseObjectDetectionInference):
   """Implementation of the BaseObjectDetectionInference using EdgeTPU / TFLite.
@@ -50,15 +56,60 @@ class TFLiteObjectDetectionInference(BaseObjectDetectionInference):
 
   def __init__(self, tflite_path, label_map_path, config):
     self._config = config
+    self._startup_timer = vot_utils.StartupTimer()
+
+    # The label map is parsed while the interpreter is being created.
+    with concurrent.futures.ThreadPoolExecutor(max_workers=1) as executor:
+      label_map_future = executor.submit(self._load_label_map, label_map_path)
+      self._load_tflite(tflite_path)
+      label_map_future.result()
 
-    self._load_label_map(label_map_path)
-    self._load_tflite(tflite_path)
+    self.startup_timings = self._startup_timer.finish()
 
   def _load_label_map(self, label_map_path):
-    with open(label_map_path, 'r') as f:
-      _, self.label_list = vot_utils.parse_label_map(f.read())
+    with self._startup_timer.measure('label_map'):
+      _, self.label_list = vot_utils.load_label_map(label_map_path)
 
   def _load_tflite(self, tflite_path):
+    with self._startup_timer.measure('delegates'):
+      experimental_delegates = self._load_delegates()
+
+    # The TFLite runtime memory-maps model_path natively, without copying the
+    # model into Python bytes. A preloaded model is used in place, without
+    # copying it either.
+    model_content = vot_utils.preloaded_model(tflite_path)
+    if model_content is not None:
+      model_source = {'model_content': model_content}
+    else:
+      model_source = {'model_path': tflite_path}
+    with self._startup_timer.measure('interpreter'):
+      try:
+        self._interpreter = tflite.Interpreter(
+            experimental_delegates=experimental_delegates, **model_source)
+      except TypeError as e:
+        if ('got an unexpected keyword argument \'experimental_delegates\''
+            in str(e)):
+          self._interpreter = tflite.Interpreter(**model_source)
+    with self._startup_timer.measure('allocate_tensors'):
+      try:
+        self._interpreter.allocate_tensors()
+      except RuntimeError as e:
+        if ('edgetpu-custom-op' in str(e) or
+            'EdgeTpuDelegateForCustomOp' in str(e)):
+          raise RuntimeError(
+              'Loaded an EdgeTPU model without the EdgeTPU library loaded. If '
+              'you have a Coral device make sure you set it up: '
+              'https://coral.ai/docs/setup/.')
+        else:
+          raise e
+    self._cache_tensor_details()
+    self._is_lstm = self._check_lstm()
+    if self._is_lstm:
+      print('Loading an LSTM model.')
+      self._lstm_c = np.copy(self.input_tensor(1))
+      self._lstm_h = np.copy(self.input_tensor(2))
+
+  def _load_delegates(self):
     experimental_delegates = []
     try:
       experimental_delegates.append(
@@ -67,39 +118,30 @@ class TFLiteObjectDetectionInference(BaseObjectDetectionInference):
               {'device': self._config.device} if self._config.device else {}))
     except AttributeError as e:
       if '\'Delegate\' object has no attribute \'_library\'' in str(e):
-        print(
-            'Warning: EdgeTPU library not found. You can still run CPU models, '
-            'but if you have a Coral device make sure you set it up: '
-            'https://coral.ai/docs/setup/.')
+        _warn_edgetpu_not_found()
     except ValueError as e:
       if 'Failed to load delegate from ' in str(e):
-        print(
-            'Warning: EdgeTPU library not found. You can still run CPU models, '
-            'but if you have a Coral device make sure you set it up: '
-            'https://coral.ai/docs/setup/.')
+        _warn_edgetpu_not_found()
+    except OSError:
+      # Raised by ctypes when the library itself cannot be loaded.
+      _warn_edgetpu_not_found()
+    return experimental_delegates
 
-    try:
-      self._interpreter = tflite.Interpreter(
-          model_path=tflite_path, experimental_delegates=experimental_delegates)
-    except TypeError as e:
-      if 'got an unexpected keyword argument \'experimental_delegates\'' in str(
-          e):
-        self._interpreter = tflite.Interpreter(model_path=tflite_path)
-    try:
-      self._interpreter.allocate_tensors()
-    except RuntimeError as e:
-      if 'edgetpu-custom-op' in str(e) or 'EdgeTpuDelegateForCustomOp' in str(
-          e):
-        raise RuntimeError('Loaded an EdgeTPU model without the EdgeTPU '
-                           'library loaded. If you have a Coral device make '
-                           'sure you set it up: https://coral.ai/docs/setup/.')
-      else:
-        raise e
-    self._is_lstm = self._check_lstm()
-    if self._is_lstm:
-      print('Loading an LSTM model.')
-      self._lstm_c = np.copy(self.input_tensor(1))
-      self._lstm_h = np.copy(self.input_tensor(2))
+  def _cache_tensor_details(self):
+    # Looking tensors up by index on every frame copies all their details.
+    input_details = self._interpreter.get_input_details()
+    output_details = self._interpreter.get_output_details()
+    self._input_indices = [details['index'] for details in input_details]
+    self._output_indices = [details['index'] for details in output_details]
+    self._output_quantization = [
+        _quantization(details) for details in output_details
+    ]
+    self._input_table = _input_lookup_table(input_details[0],
+                                            self._config.input_mean,
+                                            self._config.input_std)
+    # np.take converts uint8 indices to intp, which is done into this buffer
+    # rather than into a new temporary on every frame.
+    self._lookup_indices = None
 
   def _check_lstm(self):
     return len(self._interpreter.get_input_details()) > 1 and len(
@@ -109,65 +151,165 @@ class TFLiteObjectDetectionInference(BaseObjectDetectionInference):
     _, height, width, _ = self._interpreter.get_input_details()[0]['shape']
     return Size(width, height)
 
+  def input_dtype(self):
+    # Frames are 8-bit RGB whatever the model's input type: fill_inputs
+    # normalizes or quantizes them as the model expects.
+    return np.uint8
+
   def input_tensor(self, index):
-    tensor_index = self._interpreter.get_input_details()[index]['index']
-    return self._interpreter.tensor(tensor_index)()[0]
+    return self._interpreter.tensor(self._input_indices[index])()[0]
 
   def output_tensor(self, index):
-    tensor_index = self._interpreter.get_output_details()[index]['index']
-    tensor = self._interpreter.tensor(tensor_index)()
+    tensor = self._interpreter.tensor(self._output_indices[index])()
     return np.squeeze(tensor)
 
+  def dequantize(self, index, values):
+    """Converts values of an output tensor to float, if it is quantized."""
+    quantization = self._output_quantization[index]
+    if quantization is None:
+      return values
+    scale, zero_point = quantization
+    return (values.astype(np.float32) - zero_point) * scale
+
   def fill_inputs(self, frame):
+    frame = vot_utils.as_frame(frame, self.input_dtype())
     input_image = self.input_tensor(0)
     if self._is_lstm:
       input_lstm_c = self.input_tensor(1)
       input_lstm_h = self.input_tensor(2)
 
-    np.copyto(input_image, frame)
+    if self._input_table is not None and frame.dtype == np.uint8:
+      # Normalizes or quantizes every pixel with a single lookup, writing
+      # straight into the input tensor.
+      if (self._lookup_indices is None or
+          self._lookup_indices.shape != frame.shape):
+        self._lookup_indices = np.empty(frame.shape, dtype=np.intp)
+      np.copyto(self._lookup_indices, frame)
+      np.take(
+          self._input_table,
+          self._lookup_indices,
+          out=input_image,
+          mode='clip')
+    else:
+      np.copyto(input_image, frame)
     if self._is_lstm:
       np.copyto(input_lstm_c, self._lstm_c)
       np.copyto(input_lstm_h, self._lstm_h)
 
+  def get_state(self):
+    if not self._is_lstm:
+      return None
+    return (np.copy(self._lstm_c), np.copy(self._lstm_h))
+
+  def set_state(self, state):
+    if not self._is_lstm or state is None:
+      return
+    np.copyto(self._lstm_c, state[0])
+    np.copyto(self._lstm_h, state[1])
+
   def get_label(self, class_id):
     if class_id >= 0 and class_id < len(self.label_list):
       return self.label_list[class_id]
     else:
       return 'n/a'
 
+  def _score_threshold(self):
+    """Returns the score threshold in the score tensor's own scale."""
+    quantization = self._output_quantization[2]
+    if quantization is None:
+      return self._config.score_threshold
+    scale, zero_point = quantization
+    return self._config.score_threshold / scale + zero_point
+
   def run(self, timestamp, frame, annotations):
     # Interpreter hates it when native tensors are retained.
     # fill_inputs will release input tensors after filling with data.
-    self.fill_inputs(frame)
-    self._interpreter.invoke()
+    with profiling.stage('tflite.fill_inputs'):
+      self.fill_inputs(frame)
+    with profiling.stage('tflite.invoke'):
+      self._interpreter.invoke()
 
-    boxes = self.output_tensor(0)
-    classes = self.output_tensor(1)
-    scores = self.output_tensor(2)
-    num_detections = self.output_tensor(3)
-    if self._is_lstm:
-      output_lstm_c = self.output_tensor(4)
-      output_lstm_h = self.output_tensor(5)
-
-      np.copyto(self._lstm_c, output_lstm_c)
-      np.copyto(self._lstm_h, output_lstm_h)
+    with profiling.stage('tflite.extract_outputs'):
+      boxes = self.output_tensor(0)
+      classes = self.output_tensor(1)
+      scores = self.output_tensor(2)
+      num_detections = int(self.dequantize(3, self.output_tensor(3)))
+      if self._is_lstm:
+        output_lstm_c = self.output_tensor(4)
+        output_lstm_h = self.output_tensor(5)
 
-    for i in range(int(num_detections)):
-      box = boxes[i]
-
-      if scores[i] > self._config.score_threshold:
+        np.copyto(self._lstm_c, output_lstm_c)
+        np.copyto(self._lstm_h, output_lstm_h)
 
+    with profiling.stage('tflite.postprocess'):
+      # Scores are compared while still quantized, so that only the rows of
+      # the detections that are kept get dequantized.
+      kept = np.flatnonzero(scores[:num_detections] > self._score_threshold())
+      kept_boxes = self.dequantize(0, boxes[kept])
+      kept_classes = self.dequantize(1, classes[kept])
+      kept_scores = self.dequantize(2, scores[kept])
+      for box, class_id, score in zip(kept_boxes, kept_classes, kept_scores):
         bbox = NormalizedBoundingBox(
             left=box[1], top=box[0], right=box[3], bottom=box[2])
 
         annotation = ObjectTrackingAnnotation(
             timestamp=timestamp,
             track_id=-1,
-            class_id=int(classes[i]),
-            class_name=self.get_label(int(classes[i])),
-            confidence_score=scores[i],
+            class_id=int(class_id),
+            class_name=self.get_label(int(class_id)),
+            confidence_score=score,
             bbox=bbox)
 
         annotations.append(annotation)
 
     return True
+
+
+def _warn_edgetpu_not_found():
+  print('Warning: EdgeTPU library not found. You can still run CPU models, '
+        'but if you have a Coral device make sure you set it up: '
+        'https://coral.ai/docs/setup/.')
+
+
+def _quantization(details):
+  """Returns (scale, zero_point) of a tensor, or None if it is not quantized."""
+  scale, zero_point = details['quantization']
+  if scale == 0:
+    return None
+  return scale, zero_point
+
+
+def _input_lookup_table(details, mean, std):
+  """Maps every 8-bit pixel value to what the model's input tensor expects.
+
+  Args:
+    details: The tensor details of the input image.
+    mean: Subtracted from pixels when normalizing them, or None for the
+      default.
+    std: Pixels are divided by this when normalizing them, or None for the
+      default.
+
+  Returns:
+    An array of 256 values of the input's dtype, or None where pixels are
+    taken unchanged: uint8 inputs, unless they are quantized and both mean
+    and std are set, and uint8 inputs the table maps to themselves.
+  """
+  dtype = details['dtype']
+  quantization = _quantization(details)
+  if dtype == np.uint8 and (quantization is None or mean is None or
+                            std is None):
+    return None
+  if mean is None:
+    mean = _DEFAULT_INPUT_MEAN
+  if std is None:
+    std = _DEFAULT_INPUT_STD
+  pixels = np.arange(256, dtype=np.float64)
+  values = (pixels - mean) / std
+  if quantization is not None:
+    scale, zero_point = quantization
+    limits = np.iinfo(dtype)
+    values = np.clip(
+        np.round(values / scale + zero_point), limits.min, limits.max)
+  if dtype == np.uint8 and np.array_equal(values, pixels):
+    return None
+  return values.astype(dtype)
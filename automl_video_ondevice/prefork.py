@@ -0,0 +1,225 @@
+# Lint as: python3
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+"""Launches worker processes that share a model loaded by their parent.
+
+The parent reads the model file and parses the label map once, then forks the
+workers. Each worker creates its own interpreter or session from the parent's
+copy, which stays shared copy-on-write, rather than every worker reading and
+parsing the same files. Per-worker memory usage is reported, split into
+resident, shared and private memory.
+
+Inference state that each engine allocates for itself, such as tensor arenas,
+TF sessions and repacked CPU weights, is still private to each worker.
+
+Only available where processes can be forked, i.e. not on Windows.
+
+Example:
+  def work(worker_index, engine):
+    ...  # Run the engine over this worker's share of the input.
+    return frames_processed
+
+  results = prefork.run_workers('data/traffic_model.tflite',
+                                'data/traffic_label_map.pbtxt', config, work,
+                                num_workers=4)
+  for result in results:
+    print(result.index, result.memory_after_load, result.value)
+"""
+
+import dataclasses
+import multiprocessing
+import os
+import queue
+import traceback
+from typing import Any, Callable, List, Optional
+
+from automl_video_ondevice.object_tracking.base_object_detection import BaseObjectDetectionInference
+from automl_video_ondevice.object_tracking.config import ObjectTrackingConfig
+from automl_video_ondevice.types import Format
+import automl_video_ondevice.utils as vot_utils
+
+# How often, in seconds, the parent checks that workers are still alive while
+# waiting for their results.
+_POLL_INTERVAL = 1.0
+
+
+@dataclasses.dataclass
+class MemoryUsage:
+  """Memory usage of a process, in kilobytes."""
+  rss_kb: int  # Resident memory, shared or not.
+  pss_kb: int  # Resident memory, with shared pages split between processes.
+  shared_kb: int  # Resident memory also mapped by other processes.
+  private_kb: int  # Resident memory only this process uses.
+
+
+@dataclasses.dataclass
+class WorkerResult:
+  """The outcome of a single worker."""
+  index: int
+  pid: int
+  memory_after_load: Optional[MemoryUsage]
+  memory_after_work: Optional[MemoryUsage]
+  value: Any  # Return value of the worker function.
+  error: Optional[str] = None  # Traceback, if the worker raised.
+
+
+def memory_usage(pid='self'):
+  # type: (Any) -> Optional[MemoryUsage]
+  """Reads the memory usage of a process from /proc.
+
+  Args:
+    pid: The process id, or 'self' for the current process.
+
+  Returns:
+    The MemoryUsage, or None where /proc/<pid>/smaps_rollup is not available.
+  """
+  values = {}
+  try:
+    with open('/proc/{}/smaps_rollup'.format(pid), 'r') as f:
+      for line in f:
+        parts = line.split()
+        if len(parts) == 3 and parts[2] == 'kB':
+          values[parts[0].rstrip(':')] = int(parts[1])
+  except OSError:
+    return None
+  return MemoryUsage(
+      rss_kb=values.get('Rss', 0),
+      pss_kb=values.get('Pss', 0),
+      shared_kb=values.get('Shared_Clean', 0) + values.get('Shared_Dirty', 0),
+      private_kb=values.get('Private_Clean', 0) +
+      values.get('Private_Dirty', 0))
+
+
+def preload(model_path, label_map_path):
+  # type: (str, str) -> None
+  """Reads the model and parses the label map, for forked workers to share."""
+  vot_utils.preload_model(model_path)
+  vot_utils.load_label_map(label_map_path)
+
+
+def release(model_path):
+  # type: (str) -> None
+  """Frees the parent's copy of a model read by preload."""
+  vot_utils.release_preloaded_model(model_path)
+
+
+def _worker_main(index, model_path, label_map_path, config, file_format,
+                 worker_fn, results):
+  """Entry point of a forked worker."""
+  # pylint: disable=g-import-not-at-top,import-outside-toplevel
+  from automl_video_ondevice import object_tracking as vot
+  # pylint: enable=g-import-not-at-top,import-outside-toplevel
+
+  result = WorkerResult(
+      index=index,
+      pid=os.getpid(),
+      memory_after_load=None,
+      memory_after_work=None,
+      value=None)
+  try:
+    engine = vot.load(model_path, label_map_path, config, file_format)
+    result.memory_after_load = memory_usage()
+    result.value = worker_fn(index, engine)
+    result.memory_after_work = memory_usage()
+  except Exception:  # pylint: disable=broad-except
+    result.error = traceback.format_exc()
+  results.put(result)
+
+
+def run_workers(model_path,
+                label_map_path,
+                config,
+                worker_fn,
+                num_workers=None,
+                file_format=Format.UNDEFINED):
+  # pylint: disable=line-too-long
+  # type: (str, str, ObjectTrackingConfig, Callable[[int, BaseObjectDetectionInference], Any], Optional[int], Format) -> List[WorkerResult]
+  # pylint: enable=line-too-long
+  """Preloads a model, then forks workers that each run worker_fn.
+
+  Args:
+    model_path: Path to the model to be used.
+    label_map_path: Path to the labelmap .pbtxt file.
+    config: An ObjectTrackingConfig instance.
+    worker_fn: Called in every worker as worker_fn(worker_index, engine). Its
+      return value must be picklable.
+    num_workers: How many workers to fork. Defaults to the CPU count.
+    file_format: Specifies which format the graph is in. If undefined, will make
+      assumptions based on filename.
+
+  Returns:
+    One WorkerResult per worker, ordered by worker index.
+
+  Raises:
+    RuntimeError: If a worker died without returning its result, such as when
+      it was killed for running out of memory. The other workers are then
+      terminated.
+  """
+  if 'fork' not in multiprocessing.get_all_start_methods():
+    raise RuntimeError('Prefork workers need the fork start method, which is '
+                       'not available on this platform.')
+  context = multiprocessing.get_context('fork')
+  num_workers = num_workers or os.cpu_count() or 1
+
+  preload(model_path, label_map_path)
+
+  results = context.Queue()
+  processes = [
+      context.Process(
+          target=_worker_main,
+          args=(i, model_path, label_map_path, config, file_format, worker_fn,
+                results)) for i in range(num_workers)
+  ]
+  for process in processes:
+    process.start()
+  try:
+    # Results are collected before joining, since a worker cannot exit until
+    # its result has been read from the queue.
+    worker_results = _collect_results(processes, results)
+  except BaseException:  # Also stops the workers on KeyboardInterrupt.
+    for process in processes:
+      if process.is_alive():
+        process.terminate()
+    raise
+  finally:
+    for process in processes:
+      process.join()
+    release(model_path)
+  return sorted(worker_results.values(), key=lambda result: result.index)
+
+
+def _collect_results(processes, results):
+  """Waits for every worker's result, raising if a worker died without one."""
+  worker_results = {}
+  # Workers found dead without a result at the previous poll. A result may
+  # still be on its way for a moment after its worker exited.
+  missing = set()
+  while len(worker_results) < len(processes):
+    try:
+      result = results.get(timeout=_POLL_INTERVAL)
+    except queue.Empty:
+      dead = {
+          index for index, process in enumerate(processes)
+          if index not in worker_results and process.exitcode is not None
+      }
+      lost = sorted(dead & missing)
+      if lost:
+        raise RuntimeError(
+            'Worker {} exited with code {} without returning a result.'.format(
+                lost[0], processes[lost[0]].exitcode))
+      missing = dead
+      continue
+    worker_results[result.index] = result
+  return worker_results
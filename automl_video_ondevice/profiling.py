@@ -0,0 +1,182 @@
+# Lint as: python3
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+"""Opt-in timing of the individual stages inside engines and trackers.
+
+Engines wrap each stage of run() (filling inputs, invoking the model,
+extracting outputs, post-processing, tracking) in stage(). While no recorder
+is active, stage() returns a shared no-op context manager, so instrumentation
+costs a single context variable lookup per stage.
+
+The active recorder is stored in a context variable, so it only applies to the
+thread or asyncio task that activated it.
+
+Example:
+  with profiling.Profiler() as profiler:
+    for timestamp, frame in frames:
+      engine.run(timestamp, frame, [])
+  print(profiler.summary())
+"""
+
+import collections
+import contextlib
+import contextvars
+import dataclasses
+import threading
+import time
+from typing import Callable, Dict, Optional
+
+import numpy as np
+
+_active_recorder = contextvars.ContextVar('automl_video_ondevice_recorder',
+                                          default=None)
+
+_NO_OP_STAGE = contextlib.nullcontext()
+
+
+@dataclasses.dataclass
+class StageStats:
+  """Timing statistics of a single stage, in milliseconds."""
+  count: int
+  total_ms: float
+  mean_ms: float
+  p50_ms: float
+  p99_ms: float
+  max_ms: float
+
+
+class _Stage:
+  """Times a single stage, reporting it to a recorder on exit."""
+
+  __slots__ = ('_recorder', '_name', '_start')
+
+  def __init__(self, recorder, name):
+    self._recorder = recorder
+    self._name = name
+    self._start = 0.0
+
+  def __enter__(self):
+    self._start = time.perf_counter()
+
+  def __exit__(self, exc_type, exc_value, traceback):
+    self._recorder.record(self._name, time.perf_counter() - self._start)
+
+
+def stage(name):
+  """Returns a context manager timing a stage, if a recorder is active.
+
+  Args:
+    name: Name of the stage, prefixed by the engine, e.g. 'tflite.invoke'.
+
+  Returns:
+    A context manager to wrap the stage in.
+  """
+  recorder = _active_recorder.get()
+  if recorder is None:
+    return _NO_OP_STAGE
+  return _Stage(recorder, name)
+
+
+def active_recorder():
+  """Returns the recorder active in the current context, or None."""
+  return _active_recorder.get()
+
+
+@contextlib.contextmanager
+def recording(recorder):
+  """Makes a recorder active in the current context, within the context.
+
+  Args:
+    recorder: Any object with a record(name, seconds) method.
+
+  Yields:
+    The recorder.
+  """
+  token = _active_recorder.set(recorder)
+  try:
+    yield recorder
+  finally:
+    _active_recorder.reset(token)
+
+
+class Profiler:
+  """Records the duration of every stage run while it is active.
+
+  Any object with a record(name, seconds) method can be used as a recorder;
+  Profiler additionally keeps every duration to compute statistics, and can
+  forward each one to a callback.
+  """
+
+  def __init__(self, callback=None):
+    # type: (Optional[Callable[[str, float], None]]) -> None
+    """Constructor for Profiler.
+
+    Args:
+      callback: Optionally called as callback(name, seconds) for every stage.
+    """
+    self._callback = callback
+    self._durations = collections.defaultdict(list)
+    self._lock = threading.Lock()
+    self._tokens = []
+
+  def __enter__(self):
+    self._tokens.append(_active_recorder.set(self))
+    return self
+
+  def __exit__(self, exc_type, exc_value, traceback):
+    _active_recorder.reset(self._tokens.pop())
+
+  def record(self, name, seconds):
+    # type: (str, float) -> None
+    """Records a single duration of a stage."""
+    with self._lock:
+      self._durations[name].append(seconds)
+    if self._callback is not None:
+      self._callback(name, seconds)
+
+  def reset(self):
+    """Discards every recorded duration."""
+    with self._lock:
+      self._durations.clear()
+
+  def stats(self):
+    # type: () -> Dict[str, StageStats]
+    """Returns statistics of every recorded stage, by stage name."""
+    with self._lock:
+      durations = {name: list(values) for name, values in
+                   self._durations.items()}
+    stats = {}
+    for name, values in sorted(durations.items()):
+      values_ms = np.array(values) * 1000
+      p50, p99 = np.percentile(values_ms, [50, 99])
+      stats[name] = StageStats(
+          count=len(values_ms),
+          total_ms=float(np.sum(values_ms)),
+          mean_ms=float(np.mean(values_ms)),
+          p50_ms=float(p50),
+          p99_ms=float(p99),
+          max_ms=float(np.max(values_ms)))
+    return stats
+
+  def summary(self):
+    # type: () -> str
+    """Returns a human readable table of every recorded stage."""
+    lines = ['{:<28} {:>7} {:>10} {:>9} {:>9}'.format('stage', 'count',
+                                                       'total ms', 'mean ms',
+                                                       'p99 ms')]
+    for name, stats in self.stats().items():
+      lines.append('{:<28} {:>7} {:>10.1f} {:>9.2f} {:>9.2f}'.format(
+          name, stats.count, stats.total_ms, stats.mean_ms, stats.p99_ms))
+    return '\n'.join(lines)
@@ -0,0 +1,297 @@
+# Lint as: python3
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+"""Columnar on-disk store for object tracking results.
+
+A store is a directory holding one raw little-endian file per column, so that
+every column can be opened with np.memmap without parsing anything:
+
+  timestamp.f8    float64 timestamp of each detection, non-decreasing.
+  track_id.i4     int32 track id.
+  class_id.i4     int32 class id.
+  score.f4        float32 confidence score.
+  box.f4          float32 (left, top, right, bottom), 4 values per detection.
+  index.f8        Sparse index: timestamp of every index_interval-th row.
+  classes.json    Class id to class name.
+
+Because timestamps are sorted, a time range query is a bisect over the small
+sparse index, a binary search within a single index block, and then a slice.
+
+Example:
+  with result_store.ResultStoreWriter('/tmp/store') as writer:
+    while ...:
+      annotations = []
+      engine.run(timestamp, frame, annotations)
+      writer.append(annotations, timestamp)
+
+  store = result_store.ResultStore('/tmp/store')
+  cars = store.query(t0, t1, class_id=0)
+"""
+
+import bisect
+import dataclasses
+import json
+import os
+from typing import List, Optional, Tuple
+
+import numpy as np
+from automl_video_ondevice.types import ObjectTrackingAnnotation
+
+# Column name to (file name, dtype, values per row).
+COLUMNS = {
+    'timestamp': ('timestamp.f8', np.dtype('<f8'), 1),
+    'track_id': ('track_id.i4', np.dtype('<i4'), 1),
+    'class_id': ('class_id.i4', np.dtype('<i4'), 1),
+    'score': ('score.f4', np.dtype('<f4'), 1),
+    'box': ('box.f4', np.dtype('<f4'), 4),
+}
+_INDEX_FILE = 'index.f8'
+_CLASSES_FILE = 'classes.json'
+_META_FILE = 'meta.json'
+
+
+@dataclasses.dataclass
+class ResultColumns:
+  """A set of detections, one array per column."""
+  timestamp: np.ndarray
+  track_id: np.ndarray
+  class_id: np.ndarray
+  score: np.ndarray
+  box: np.ndarray  # Shape (n, 4): left, top, right, bottom.
+
+  def __len__(self):
+    return len(self.timestamp)
+
+
+class ResultStoreWriter:
+  """Appends object tracking annotations to a result store, in chunks."""
+
+  def __init__(self, path, chunk_size=4096, index_interval=1024):
+    """Constructor for ResultStoreWriter.
+
+    Appending to an existing store continues where it left off.
+
+    Args:
+      path: Directory of the store. Created if it does not exist.
+      chunk_size: How many detections are buffered before being written.
+      index_interval: How many rows apart sparse index entries are.
+    """
+    os.makedirs(path, exist_ok=True)
+    self.path = path
+    self._chunk_size = chunk_size
+    meta = _read_json(os.path.join(path, _META_FILE))
+    self._index_interval = meta.get('index_interval', index_interval)
+    self._class_names = {
+        int(k): v
+        for k, v in _read_json(os.path.join(path, _CLASSES_FILE)).items()
+    }
+    self._rows = _stored_rows(path)
+    _truncate(path, self._rows, self._index_interval)
+    self._last_timestamp = -np.inf
+    if self._rows:
+      self._last_timestamp = np.fromfile(
+          os.path.join(path, COLUMNS['timestamp'][0]),
+          dtype=COLUMNS['timestamp'][1],
+          count=1,
+          offset=(self._rows - 1) * 8)[0]
+    self._buffer = []
+
+    self._files = {
+        name: open(os.path.join(path, file_name), 'ab')
+        for name, (file_name, _, _) in COLUMNS.items()
+    }
+    self._index_file = open(os.path.join(path, _INDEX_FILE), 'ab')
+    with open(os.path.join(path, _META_FILE), 'w') as f:
+      json.dump({'index_interval': self._index_interval}, f)
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, exc_type, exc_value, traceback):
+    self.close()
+
+  def append(self, annotations, timestamp=None):
+    # type: (List[ObjectTrackingAnnotation], Optional[float]) -> None
+    """Appends the annotations of a single frame.
+
+    Args:
+      annotations: Annotations output by an object tracking engine.
+      timestamp: The timestamp of the frame. Trackers output annotations that
+        keep the timestamp of their original detection, so passing the frame
+        timestamp here is recommended. Defaults to each annotation's timestamp.
+    """
+    for annotation in annotations:
+      row_timestamp = annotation.timestamp if timestamp is None else timestamp
+      if row_timestamp < self._last_timestamp:
+        raise ValueError(
+            'Timestamps must be appended in order: {} after {}.'.format(
+                row_timestamp, self._last_timestamp))
+      self._last_timestamp = row_timestamp
+      class_id = int(annotation.class_id)
+      if class_id not in self._class_names:
+        self._class_names[class_id] = annotation.class_name
+      bbox = annotation.bbox
+      self._buffer.append(
+          (row_timestamp, annotation.track_id, class_id,
+           annotation.confidence_score, bbox.left, bbox.top, bbox.right,
+           bbox.bottom))
+    if len(self._buffer) >= self._chunk_size:
+      self.flush()
+
+  def flush(self):
+    """Writes all buffered detections to disk."""
+    if not self._buffer:
+      return
+    rows = np.array(self._buffer, dtype=np.float64)
+    self._buffer = []
+
+    timestamps = rows[:, 0].astype(COLUMNS['timestamp'][1])
+    timestamps.tofile(self._files['timestamp'])
+    rows[:, 1].astype(COLUMNS['track_id'][1]).tofile(self._files['track_id'])
+    rows[:, 2].astype(COLUMNS['class_id'][1]).tofile(self._files['class_id'])
+    rows[:, 3].astype(COLUMNS['score'][1]).tofile(self._files['score'])
+    rows[:, 4:8].astype(COLUMNS['box'][1]).tofile(self._files['box'])
+
+    # Indexes every row whose position is a multiple of the index interval.
+    first_indexed = -self._rows % self._index_interval
+    timestamps[first_indexed::self._index_interval].tofile(self._index_file)
+    self._rows += len(rows)
+
+    for f in list(self._files.values()) + [self._index_file]:
+      f.flush()
+    with open(os.path.join(self.path, _CLASSES_FILE), 'w') as f:
+      json.dump(self._class_names, f)
+
+  def close(self):
+    """Flushes, then closes the store's files."""
+    self.flush()
+    for f in list(self._files.values()) + [self._index_file]:
+      f.close()
+
+
+class ResultStore:
+  """Read-only, memory-mapped view of a result store."""
+
+  def __init__(self, path):
+    """Constructor for ResultStore.
+
+    Args:
+      path: Directory of the store.
+    """
+    self.path = path
+    meta = _read_json(os.path.join(path, _META_FILE))
+    self._index_interval = meta.get('index_interval', 1024)
+    self.class_names = {
+        int(k): v
+        for k, v in _read_json(os.path.join(path, _CLASSES_FILE)).items()
+    }
+    self._rows = _stored_rows(path)
+    self._columns = {}
+    for name, (file_name, dtype, width) in COLUMNS.items():
+      shape = (self._rows, width) if width > 1 else (self._rows,)
+      if self._rows:
+        self._columns[name] = np.memmap(
+            os.path.join(path, file_name), dtype=dtype, mode='r', shape=shape)
+      else:
+        self._columns[name] = np.empty(shape, dtype=dtype)
+    index_path = os.path.join(path, _INDEX_FILE)
+    self._index = np.fromfile(
+        index_path, dtype='<f8') if os.path.exists(index_path) else np.empty(
+            0, dtype='<f8')
+    # Entries for rows past a partially written chunk are ignored.
+    self._index = self._index[:_index_entries(self._rows,
+                                              self._index_interval)].tolist()
+
+  def __len__(self):
+    return self._rows
+
+  def _lower_bound(self, timestamp):
+    """Returns the first row with a timestamp >= the given timestamp."""
+    # The answer lies in the block after the last index entry < timestamp.
+    block = max(bisect.bisect_left(self._index, timestamp) - 1, 0)
+    start = block * self._index_interval
+    end = min(start + self._index_interval + 1, self._rows)
+    timestamps = self._columns['timestamp']
+    return start + int(np.searchsorted(timestamps[start:end], timestamp,
+                                       'left'))
+
+  def row_range(self, start_timestamp, end_timestamp):
+    # type: (float, float) -> Tuple[int, int]
+    """Returns the rows [start, end) with start <= timestamp < end."""
+    return (self._lower_bound(start_timestamp),
+            self._lower_bound(end_timestamp))
+
+  def columns(self, start_row=0, end_row=None):
+    # type: (int, Optional[int]) -> ResultColumns
+    """Returns memory-mapped views of a range of rows, without copying."""
+    rows = slice(start_row, self._rows if end_row is None else end_row)
+    return ResultColumns(**{
+        name: column[rows] for name, column in self._columns.items()
+    })
+
+  def query(self, start_timestamp, end_timestamp, class_id=None):
+    # type: (float, float, Optional[int]) -> ResultColumns
+    """Returns detections within a time range, optionally of a single class.
+
+    Args:
+      start_timestamp: Inclusive start of the time range.
+      end_timestamp: Exclusive end of the time range.
+      class_id: If set, only detections of this class are returned.
+
+    Returns:
+      The matching detections. Without a class filter these are views into the
+      memory map, otherwise only the matching rows are copied.
+    """
+    result = self.columns(*self.row_range(start_timestamp, end_timestamp))
+    if class_id is None:
+      return result
+    mask = result.class_id == class_id
+    return ResultColumns(
+        **{
+            field.name: getattr(result, field.name)[mask]
+            for field in dataclasses.fields(ResultColumns)
+        })
+
+
+def _read_json(path):
+  if not os.path.exists(path):
+    return {}
+  with open(path, 'r') as f:
+    return json.load(f)
+
+
+def _stored_rows(path):
+  """Returns how many complete rows every column has on disk."""
+  rows = []
+  for file_name, dtype, width in COLUMNS.values():
+    file_path = os.path.join(path, file_name)
+    size = os.path.getsize(file_path) if os.path.exists(file_path) else 0
+    rows.append(size // (dtype.itemsize * width))
+  return min(rows)
+
+
+def _index_entries(rows, index_interval):
+  return (rows + index_interval - 1) // index_interval
+
+
+def _truncate(path, rows, index_interval):
+  """Drops any partially written chunk, so all columns line up again."""
+  for file_name, dtype, width in COLUMNS.values():
+    file_path = os.path.join(path, file_name)
+    if os.path.exists(file_path):
+      os.truncate(file_path, rows * dtype.itemsize * width)
+  index_path = os.path.join(path, _INDEX_FILE)
+  if os.path.exists(index_path):
+    os.truncate(index_path, _index_entries(rows, index_interval) * 8)
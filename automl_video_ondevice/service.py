@@ -0,0 +1,549 @@
+# Lint as: python3
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+r"""Serves many video streams from one process, over a Unix socket.
+
+The service hosts one or more models, and every client connection is a stream
+session on one of them. Object tracking streams share a single loaded model
+through an EngineRegistry, with their own score threshold, tracker and state.
+Shot classification streams each load their own engine, since the sliding
+window is per stream.
+
+Inference runs on an executor, with at most max_concurrency frames in flight,
+so that streams share an accelerator in a controlled way. Streams take turns
+round-robin, one frame at a time, so a fast camera cannot starve a slow one.
+Each stream queues at most max_pending frames, dropping the oldest when it
+falls behind, and frames still queued past the stream's deadline are dropped
+rather than run late.
+
+Messages in both directions are a little endian uint32 JSON header length and
+uint32 payload length, followed by the JSON header and the payload:
+
+  -> {"type": "open", "model": NAME, "score_threshold": 0.4,
+      "tracker": "none", "deadline_ms": 200}
+  <- {"type": "opened", "session": ID, "input_size": [WIDTH, HEIGHT]}
+  -> {"type": "frame", "timestamp": T, "shape": [HEIGHT, WIDTH, 3]} + RGB bytes
+  <- {"type": "result", "timestamp": T, "annotations": [...],
+      "latency_ms": MS}
+  <- {"type": "dropped", "timestamp": T, "reason": "deadline" or "overflow"}
+  <- {"type": "error", "message": M}, with the "timestamp" of the frame when
+     a frame could not be run. The stream stays open.
+
+Annotations use the same dictionaries as sinks.JsonlSink. ServiceClient is a
+blocking client.
+
+python3 -m automl_video_ondevice.service \
+  --socket /tmp/automl_video.sock \
+  --model traffic=data/traffic_model.tflite,data/traffic_label_map.pbtxt \
+  --max_concurrency 1
+"""
+
+import argparse
+import asyncio
+import collections
+import concurrent.futures
+import dataclasses
+import json
+import os
+import socket
+import struct
+import time
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from automl_video_ondevice import metrics
+from automl_video_ondevice import sinks
+from automl_video_ondevice.object_tracking import registry
+from automl_video_ondevice.object_tracking.config import ObjectTrackingConfig
+from automl_video_ondevice.shot_classification.config import ShotClassificationConfig
+from automl_video_ondevice.types import Tracker
+
+KINDS = ('object_tracking', 'shot_classification')
+
+# JSON header length, payload length.
+_MESSAGE_HEADER = struct.Struct('<II')
+
+
+@dataclasses.dataclass
+class ModelSpec:
+  name: str  # What clients open streams on.
+  model_path: str
+  label_map_path: str
+  kind: str = 'object_tracking'
+
+
+def encode_message(header, payload=b''):
+  # type: (dict, bytes) -> bytes
+  """Encodes a message, as sent in both directions."""
+  encoded = json.dumps(header).encode('utf-8')
+  return _MESSAGE_HEADER.pack(len(encoded), len(payload)) + encoded + payload
+
+
+async def read_message(reader):
+  # type: (asyncio.StreamReader) -> Optional[Tuple[dict, bytes]]
+  """Reads a message, returning None once the connection is closed."""
+  try:
+    header_length, payload_length = _MESSAGE_HEADER.unpack(
+        await reader.readexactly(_MESSAGE_HEADER.size))
+    header = json.loads(await reader.readexactly(header_length))
+    payload = await reader.readexactly(payload_length)
+  except asyncio.IncompleteReadError:
+    return None
+  if not isinstance(header, dict):
+    raise ValueError('Message headers must be JSON objects.')
+  return header, payload
+
+
+@dataclasses.dataclass
+class _PendingFrame:
+  timestamp: int
+  image: np.ndarray
+  deadline: float  # time.monotonic(), or infinity.
+
+
+class _Session:
+  """A single client's stream."""
+
+  def __init__(self, session_id, spec, engine, writer, deadline_ms):
+    self.id = session_id
+    self.spec = spec
+    self.engine = engine
+    self.deadline_ms = deadline_ms
+    self.pending = collections.deque()
+    self.in_flight = False
+    self.closed = False
+    self._writer = writer
+    self._write_lock = asyncio.Lock()
+
+  async def send(self, header, payload=b''):
+    if self.closed:
+      return
+    async with self._write_lock:
+      try:
+        self._writer.write(encode_message(header, payload))
+        await self._writer.drain()
+      except ConnectionError:
+        self.closed = True
+
+  def run(self, frame):
+    # type: (_PendingFrame) -> Tuple[list, float]
+    """Runs the engine on a frame, on an executor thread."""
+    start = time.monotonic()
+    annotations = []
+    self.engine.run(frame.timestamp, frame.image, annotations)
+    return annotations, (time.monotonic() - start) * 1000
+
+
+def _parse_frame(header, payload):
+  # type: (dict, bytes) -> Tuple[int, np.ndarray]
+  """Returns the timestamp and image of a frame message.
+
+  Raises:
+    ValueError: If the header or payload is not a valid frame.
+  """
+  try:
+    timestamp = int(header['timestamp'])
+    shape = [int(dim) for dim in header['shape']]
+  except (KeyError, TypeError, ValueError):
+    raise ValueError('Frames need a timestamp, and a [height, width, 3] shape.')
+  if len(shape) != 3 or shape[2] != 3 or min(shape) <= 0:
+    raise ValueError('Frame shape {} is not [height, width, 3].'.format(shape))
+  if len(payload) != np.prod(shape):
+    raise ValueError('Frame of shape {} has {} bytes instead of {}.'.format(
+        shape, len(payload), np.prod(shape)))
+  return timestamp, np.frombuffer(payload, dtype=np.uint8).reshape(shape)
+
+
+class InferenceService:
+  """Hosts models, and schedules the frames of every stream on them."""
+
+  def __init__(self,
+               models,
+               max_concurrency=1,
+               max_pending=2,
+               default_deadline_ms=0,
+               config=None,
+               engine_registry=None):
+    # pylint: disable=line-too-long
+    # type: (List[ModelSpec], int, int, float, Optional[ObjectTrackingConfig], Optional[registry.EngineRegistry]) -> None
+    # pylint: enable=line-too-long
+    """Constructor for InferenceService.
+
+    Args:
+      models: The models streams can be opened on.
+      max_concurrency: Most frames run at once, over all streams.
+      max_pending: Most frames a stream queues. Older frames are dropped.
+      default_deadline_ms: How long a frame may wait to be run, for streams
+        that do not set their own. 0 never drops late frames.
+      config: Object tracking options not set per stream, such as the device.
+      engine_registry: Shares object tracking models. Defaults to a new one.
+    """
+    for spec in models:
+      if spec.kind not in KINDS:
+        raise ValueError('Unknown model kind {!r}, expected one of {}.'.format(
+            spec.kind, ', '.join(KINDS)))
+    self._models = {
+        spec.name: spec for spec in models
+    }  # type: Dict[str, ModelSpec]
+    self._max_concurrency = max_concurrency
+    self._max_pending = max(1, max_pending)
+    self._default_deadline_ms = default_deadline_ms
+    self._config = config or ObjectTrackingConfig()
+    self._registry = engine_registry or registry.EngineRegistry()
+    self._executor = concurrent.futures.ThreadPoolExecutor(
+        max_workers=max_concurrency)
+    self._sessions = {}
+    self._next_session_id = 0
+    # Sessions with a pending frame and none in flight, in turn order.
+    self._ready = collections.deque()
+    self._wakeup = None
+    self._slots = None
+    self._server = None
+    self._scheduler = None
+
+    self._frames_counter = {
+        outcome: metrics.default_registry.counter(
+            'automl_video_service_frames_total',
+            'Frames received by the inference service, by outcome.',
+            {'outcome': outcome})
+        for outcome in ('processed', 'deadline', 'overflow', 'error')
+    }
+    self._sessions_gauge = metrics.default_registry.gauge(
+        'automl_video_service_sessions',
+        'Streams open on the inference service.')
+    self._sessions_gauge.set_function(lambda: len(self._sessions))
+
+  async def start(self, path):
+    # type: (str) -> None
+    """Starts listening on a Unix socket, replacing any stale socket file."""
+    if os.path.exists(path):
+      os.unlink(path)
+    self._wakeup = asyncio.Event()
+    self._slots = asyncio.Semaphore(self._max_concurrency)
+    self._scheduler = asyncio.ensure_future(self._schedule())
+    self._server = await asyncio.start_unix_server(self._handle_connection,
+                                                   path)
+
+  async def serve_forever(self, path):
+    # type: (str) -> None
+    await self.start(path)
+    async with self._server:
+      await self._server.serve_forever()
+
+  async def close(self):
+    """Stops listening and scheduling, releasing every stream."""
+    if self._server is not None:
+      self._server.close()
+      await self._server.wait_closed()
+    if self._scheduler is not None:
+      self._scheduler.cancel()
+    for session in list(self._sessions.values()):
+      self._close_session(session)
+    self._executor.shutdown(wait=True)
+    metrics.default_registry.unregister(self._sessions_gauge)
+
+  async def _handle_connection(self, reader, writer):
+    session = None
+    try:
+      try:
+        message = await read_message(reader)
+        if message is None:
+          return
+        session = await self._open_session(message[0], writer)
+      except (KeyError, ValueError, OSError) as e:
+        writer.write(encode_message({'type': 'error', 'message': str(e)}))
+        await writer.drain()
+        return
+      input_size = session.engine.input_size()
+      await session.send({
+          'type': 'opened',
+          'session': session.id,
+          'input_size': [int(input_size.width),
+                         int(input_size.height)],
+      })
+
+      while True:
+        try:
+          message = await read_message(reader)
+          if message is None or message[0].get('type') == 'close':
+            return
+          header, payload = message
+          if header.get('type') != 'frame':
+            raise ValueError('Unexpected message {!r}.'.format(
+                header.get('type')))
+          timestamp, image = _parse_frame(header, payload)
+        except ValueError as e:
+          await session.send({'type': 'error', 'message': str(e)})
+          continue
+        self._queue_frame(session, timestamp, image)
+    finally:
+      if session is not None:
+        self._close_session(session)
+      writer.close()
+
+  async def _open_session(self, header, writer):
+    if header.get('type') != 'open':
+      raise ValueError('The first message must open a stream.')
+    spec = self._models.get(header.get('model'))
+    if spec is None:
+      raise ValueError('Unknown model {!r}, expected one of {}.'.format(
+          header.get('model'), ', '.join(self._models)))
+    loop = asyncio.get_event_loop()
+    # Loading may take seconds, which would stall every other stream.
+    engine = await loop.run_in_executor(None, self._load_engine, spec, header)
+    session = _Session(self._next_session_id, spec, engine, writer,
+                       header.get('deadline_ms', self._default_deadline_ms))
+    self._next_session_id += 1
+    self._sessions[session.id] = session
+    return session
+
+  def _load_engine(self, spec, header):
+    if spec.kind == 'shot_classification':
+      from automl_video_ondevice import shot_classification  # pylint: disable=g-import-not-at-top,import-outside-toplevel
+      return shot_classification.load(
+          spec.model_path, spec.label_map_path,
+          ShotClassificationConfig(
+              device=self._config.device,
+              score_threshold=header.get('score_threshold', 0.0),
+              top_k=header.get('top_k', 5)))
+    config = dataclasses.replace(
+        self._config,
+        score_threshold=header.get('score_threshold',
+                                   self._config.score_threshold),
+        tracker=Tracker[header.get('tracker', 'none').upper()])
+    return self._registry.load(spec.model_path, spec.label_map_path, config)
+
+  def _close_session(self, session):
+    if session.id not in self._sessions:
+      return
+    del self._sessions[session.id]
+    session.closed = True
+    session.pending.clear()
+    if session.spec.kind == 'object_tracking':
+      if session.in_flight:
+        # Released once its frame is done.
+        return
+      self._registry.release(session.engine)
+
+  def _queue_frame(self, session, timestamp, image):
+    deadline = float('inf')
+    if session.deadline_ms:
+      deadline = time.monotonic() + session.deadline_ms / 1000
+    if len(session.pending) >= self._max_pending:
+      dropped = session.pending.popleft()
+      self._drop(session, dropped, 'overflow')
+    session.pending.append(_PendingFrame(timestamp, image, deadline))
+    if not session.in_flight and session not in self._ready:
+      self._ready.append(session)
+      self._wakeup.set()
+
+  def _drop(self, session, frame, reason):
+    self._frames_counter[reason].inc()
+    asyncio.ensure_future(
+        session.send({
+            'type': 'dropped',
+            'timestamp': frame.timestamp,
+            'reason': reason
+        }))
+
+  async def _next_frame(self):
+    """Waits for the next stream's turn, skipping frames past deadline."""
+    while True:
+      while not self._ready:
+        self._wakeup.clear()
+        await self._wakeup.wait()
+      session = self._ready.popleft()
+      if session.closed or not session.pending:
+        continue
+      frame = session.pending.popleft()
+      if time.monotonic() > frame.deadline:
+        self._drop(session, frame, 'deadline')
+        if session.pending:
+          self._ready.append(session)
+        continue
+      return session, frame
+
+  async def _schedule(self):
+    while True:
+      await self._slots.acquire()
+      session, frame = await self._next_frame()
+      session.in_flight = True
+      asyncio.ensure_future(self._run(session, frame))
+
+  async def _run(self, session, frame):
+    loop = asyncio.get_event_loop()
+    try:
+      try:
+        annotations, latency_ms = await loop.run_in_executor(
+            self._executor, session.run, frame)
+      except Exception as e:  # pylint: disable=broad-except
+        self._frames_counter['error'].inc()
+        await session.send({
+            'type': 'error',
+            'timestamp': frame.timestamp,
+            'message': '{}: {}'.format(type(e).__name__, e)
+        })
+        return
+      self._frames_counter['processed'].inc()
+      await session.send({
+          'type': 'result',
+          'timestamp': frame.timestamp,
+          'annotations': [
+              sinks.annotation_to_dict(a) for a in annotations if a is not None
+          ],
+          'latency_ms': latency_ms,
+      })
+    finally:
+      session.in_flight = False
+      self._slots.release()
+      if session.closed:
+        if session.spec.kind == 'object_tracking':
+          self._registry.release(session.engine)
+      elif session.pending:
+        # Back of the line, behind every other waiting stream.
+        self._ready.append(session)
+        self._wakeup.set()
+
+
+class ServiceClient:
+  """A blocking client of a single stream."""
+
+  def __init__(self, path, model, **options):
+    """Connects to the service and opens a stream.
+
+    Args:
+      path: The service's Unix socket.
+      model: Name of the model to open the stream on.
+      **options: score_threshold, tracker, deadline_ms and, for shot
+        classification, top_k.
+    """
+    self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    self._socket.connect(path)
+    self._file = self._socket.makefile('rb')
+    header = dict(options, type='open', model=model)
+    self._socket.sendall(encode_message(header))
+    opened, _ = self.receive()
+    if opened['type'] != 'opened':
+      raise ValueError(opened.get('message', 'Could not open a stream.'))
+    self.session = opened['session']
+    self.input_width, self.input_height = opened['input_size']
+
+  def send_frame(self, timestamp, frame):
+    # type: (int, np.ndarray) -> None
+    """Sends an RGB frame at the model's input size."""
+    frame = np.ascontiguousarray(frame, dtype=np.uint8)
+    self._socket.sendall(
+        encode_message({
+            'type': 'frame',
+            'timestamp': timestamp,
+            'shape': list(frame.shape)
+        }, frame.tobytes()))
+
+  def receive(self):
+    # type: () -> Tuple[dict, bytes]
+    """Waits for the next message from the service."""
+    header_length, payload_length = _MESSAGE_HEADER.unpack(
+        self._read(_MESSAGE_HEADER.size))
+    header = json.loads(self._read(header_length))
+    return header, self._read(payload_length)
+
+  def _read(self, size):
+    data = self._file.read(size)
+    if len(data) < size:
+      raise ConnectionError('The service closed the connection.')
+    return data
+
+  def close(self):
+    try:
+      self._socket.sendall(encode_message({'type': 'close'}))
+    except OSError:
+      pass
+    self._file.close()
+    self._socket.close()
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, exc_type, exc_value, traceback):
+    self.close()
+
+
+def parse_model(value, kind='object_tracking'):
+  # type: (str, str) -> ModelSpec
+  """Parses a NAME=MODEL_PATH,LABEL_MAP_PATH command line model."""
+  name, paths = value.split('=', 1)
+  model_path, label_map_path = paths.split(',', 1)
+  return ModelSpec(name, model_path, label_map_path, kind)
+
+
+def main():
+  parser = argparse.ArgumentParser()
+  parser.add_argument(
+      '--socket',
+      default='/tmp/automl_video.sock',
+      help='Unix socket to listen on')
+  parser.add_argument(
+      '--model',
+      action='append',
+      default=[],
+      help='object tracking model, as NAME=MODEL_PATH,LABEL_MAP_PATH')
+  parser.add_argument(
+      '--shot_model',
+      action='append',
+      default=[],
+      help='shot classification model, as NAME=MODEL_PATH,LABEL_MAP_PATH')
+  parser.add_argument(
+      '--max_concurrency',
+      type=int,
+      default=1,
+      help='most frames run at once, over all streams')
+  parser.add_argument(
+      '--max_pending',
+      type=int,
+      default=2,
+      help='most frames queued per stream before the oldest is dropped')
+  parser.add_argument(
+      '--deadline_ms',
+      type=float,
+      default=0,
+      help='default longest wait before a frame is dropped, 0 for none')
+  parser.add_argument('--device', default='', help='device to run models on')
+  parser.add_argument(
+      '--metrics_port',
+      type=int,
+      default=0,
+      help='port to serve Prometheus metrics on, 0 to disable')
+  args = parser.parse_args()
+
+  models = ([parse_model(value) for value in args.model] +
+            [parse_model(value, 'shot_classification')
+             for value in args.shot_model])
+  if not models:
+    parser.error('At least one --model or --shot_model is needed.')
+  if args.metrics_port:
+    metrics.start_http_server(args.metrics_port)
+  service = InferenceService(
+      models,
+      max_concurrency=args.max_concurrency,
+      max_pending=args.max_pending,
+      default_deadline_ms=args.deadline_ms,
+      config=ObjectTrackingConfig(device=args.device))
+  print('Serving {} on {}'.format(', '.join(spec.name for spec in models),
+                                  args.socket))
+  asyncio.run(service.serve_forever(args.socket))
+
+
+if __name__ == '__main__':
+  main()
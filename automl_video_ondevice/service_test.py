@@ -0,0 +1,199 @@
+# Lint as: python3
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+"""Tests for the multi-stream inference service, using the fake engine."""
+
+import asyncio
+import os
+import tempfile
+import threading
+import time
+import unittest
+
+import numpy as np
+from automl_video_ondevice import service
+from automl_video_ondevice.object_tracking.base_object_detection import BaseObjectDetectionInference
+from automl_video_ondevice.object_tracking.config import ObjectTrackingConfig
+from automl_video_ondevice.types import Size
+
+_LABELS = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), '..', 'data',
+    'traffic_label_map.pbtxt')
+
+
+class _FailingEngine(BaseObjectDetectionInference):
+  """Fails on frames that are not of its input size."""
+
+  def __init__(self):  # pylint: disable=super-init-not-called
+    pass
+
+  def input_size(self):
+    return Size(4, 4)
+
+  def run(self, timestamp, frame, annotations):
+    if frame.shape != (4, 4, 3):
+      raise ValueError('Wrong frame shape {}.'.format(frame.shape))
+    return True
+
+
+class _FailingRegistry:
+
+  def load(self, model_path, label_map_path, config):
+    del model_path, label_map_path, config
+    return _FailingEngine()
+
+  def release(self, stream):
+    del stream
+
+
+class InferenceServiceTest(unittest.TestCase):
+
+  def start(self, engine_registry=None, **kwargs):
+    """Starts a service with the fake engine on a background event loop."""
+    self.path = os.path.join(tempfile.mkdtemp(), 'service.sock')
+    self.service = service.InferenceService(
+        [service.ModelSpec('fake', 'synthetic', _LABELS)],
+        config=ObjectTrackingConfig(fake_latency_ms=20),
+        engine_registry=engine_registry,
+        **kwargs)
+    self.loop = asyncio.new_event_loop()
+    started = threading.Event()
+
+    def serve():
+      asyncio.set_event_loop(self.loop)
+      self.loop.run_until_complete(self.service.start(self.path))
+      started.set()
+      self.loop.run_forever()
+
+    self.thread = threading.Thread(target=serve, daemon=True)
+    self.thread.start()
+    started.wait()
+
+  def tearDown(self):
+    asyncio.run_coroutine_threadsafe(self.service.close(), self.loop).result()
+    self.loop.call_soon_threadsafe(self.loop.stop)
+    self.thread.join()
+    super().tearDown()
+
+  def frame(self, client):
+    return np.zeros((client.input_height, client.input_width, 3), np.uint8)
+
+  def receive_all(self, client, count):
+    """Returns the type of the next messages, by frame timestamp."""
+    messages = {}
+    for _ in range(count):
+      header, _ = client.receive()
+      messages[header['timestamp']] = header
+    return messages
+
+  def test_result(self):
+    self.start()
+    with service.ServiceClient(self.path, 'fake', score_threshold=0.1) as c:
+      self.assertEqual((c.input_width, c.input_height), (256, 256))
+      c.send_frame(7, self.frame(c))
+      header, _ = c.receive()
+    self.assertEqual(header['type'], 'result')
+    self.assertEqual(header['timestamp'], 7)
+    self.assertTrue(header['annotations'])
+    self.assertIn('bbox', header['annotations'][0])
+
+  def test_streams_take_turns(self):
+    self.start(max_pending=30)
+    flooding = service.ServiceClient(self.path, 'fake')
+    for i in range(30):
+      flooding.send_frame(i, self.frame(flooding))
+    # With first come first served, each frame would wait for the whole
+    # backlog of the other stream, 600ms.
+    round_trips = []
+    with service.ServiceClient(self.path, 'fake') as c:
+      for i in range(5):
+        start = time.monotonic()
+        c.send_frame(i, self.frame(c))
+        header, _ = c.receive()
+        self.assertEqual(header['type'], 'result')
+        round_trips.append(time.monotonic() - start)
+    self.assertLess(max(round_trips), 0.2)
+    messages = self.receive_all(flooding, 30)
+    flooding.close()
+    self.assertTrue(all(m['type'] == 'result' for m in messages.values()))
+
+  def test_overflow_drops_oldest_frames(self):
+    self.start(max_pending=2)
+    with service.ServiceClient(self.path, 'fake') as c:
+      for i in range(20):
+        c.send_frame(i, self.frame(c))
+      messages = self.receive_all(c, 20)
+    dropped = [t for t, m in messages.items() if m['type'] == 'dropped']
+    self.assertTrue(dropped)
+    self.assertTrue(
+        all(messages[t]['reason'] == 'overflow' for t in dropped))
+    # The newest frame is never the one dropped.
+    self.assertEqual(messages[19]['type'], 'result')
+
+  def test_deadline_drops_late_frames(self):
+    self.start(max_pending=10)
+    with service.ServiceClient(self.path, 'fake', deadline_ms=5) as c:
+      for i in range(5):
+        c.send_frame(i, self.frame(c))
+      messages = self.receive_all(c, 5)
+    reasons = [m.get('reason') for m in messages.values()]
+    self.assertEqual(messages[0]['type'], 'result')
+    self.assertIn('deadline', reasons)
+    self.assertNotIn('overflow', reasons)
+
+  def test_unknown_model(self):
+    self.start()
+    with self.assertRaisesRegex(ValueError, 'Unknown model'):
+      service.ServiceClient(self.path, 'missing')
+
+  def test_invalid_frames_are_reported(self):
+    self.start()
+    with service.ServiceClient(self.path, 'fake') as c:
+      c._socket.sendall(  # pylint: disable=protected-access
+          service.encode_message({
+              'type': 'frame',
+              'timestamp': 0,
+              'shape': [256, 256, 3]
+          }, b'short'))
+      header, _ = c.receive()
+      self.assertEqual(header['type'], 'error')
+      self.assertIn('bytes', header['message'])
+
+      c._socket.sendall(  # pylint: disable=protected-access
+          service.encode_message({'type': 'frame'}))
+      header, _ = c.receive()
+      self.assertEqual(header['type'], 'error')
+
+      # The stream still works.
+      c.send_frame(1, self.frame(c))
+      header, _ = c.receive()
+      self.assertEqual(header['type'], 'result')
+
+  def test_engine_errors_are_reported(self):
+    self.start(engine_registry=_FailingRegistry())
+    with service.ServiceClient(self.path, 'fake') as c:
+      c.send_frame(3, np.zeros((10, 10, 3), np.uint8))
+      header, _ = c.receive()
+      self.assertEqual(header['type'], 'error')
+      self.assertEqual(header['timestamp'], 3)
+      self.assertIn('ValueError', header['message'])
+
+      c.send_frame(4, np.zeros((4, 4, 3), np.uint8))
+      header, _ = c.receive()
+      self.assertEqual(header['type'], 'result')
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -23,6 +23,7 @@ from automl_video_ondevice.shot_classification.config import ShotClassificationC
 from automl_video_ondevice.types import Format
 from automl_video_ondevice.types import ShotClassificationAnnotation
 from automl_video_ondevice.types import Size
+from automl_video_ondevice.types import WarmupReport
 from automl_video_ondevice.utils import format_from_filename
 
 
@@ -65,4 +66,12 @@ def load(frozen_graph_path,
     engine = BaseShotClassificationInference(frozen_graph_path, label_map_path,
                                              config)
 
+  if config.warmup_iterations > 0:
+    report = engine.warmup(config.warmup_iterations)
+    print('Warmup: cold {:.1f}ms, warm {:.1f}ms'.format(
+        report.cold_latency_ms, report.warm_latency_ms))
+  if config.enable_metrics:
+    from automl_video_ondevice import metrics  # pylint: disable=g-import-not-at-top,import-outside-toplevel
+    engine = metrics.instrument(engine, 'shot_classification',
+                                file_format.name.lower())
   return engine
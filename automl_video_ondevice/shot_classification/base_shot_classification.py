@@ -15,6 +15,7 @@
 # ==============================================================================
 """Provides the base class for implementing video object tracking inference."""
 
+from typing import Any
 from typing import List
 from typing import Union
 import numpy as np
@@ -22,6 +23,8 @@ import numpy as np
 from automl_video_ondevice.shot_classification.config import ShotClassificationConfig
 from automl_video_ondevice.types import ShotClassificationAnnotation
 from automl_video_ondevice.types import Size
+from automl_video_ondevice.types import WarmupReport
+import automl_video_ondevice.utils as vot_utils
 
 
 class BaseShotClassificationInference:
@@ -71,3 +74,35 @@ class BaseShotClassificationInference:
       A boolean, True if successful and False if unsuccessful.
     """
     raise NotImplementedError('Shot classification has not been implemented.')
+
+  def get_state(self) -> Any:
+    """Returns a copy of the engine's state between frames.
+
+    This includes any LSTM state and sliding window, so that the engine can be
+    rewound or reset.
+
+    Returns:
+      An opaque state object to pass to set_state, or None if stateless.
+    """
+    return None
+
+  def set_state(self, state: Any):
+    """Restores state previously returned by get_state.
+
+    Args:
+      state: An object returned by get_state.
+    """
+    del state  # Stateless by default.
+
+  def warmup(self, iterations: int = 3) -> WarmupReport:
+    """Runs inference on blank frames, so one-time costs are paid up front.
+
+    The engine's state is left as it was before warming up.
+
+    Args:
+      iterations: How many times to run inference.
+
+    Returns:
+      A WarmupReport with the cold and warm latencies.
+    """
+    return vot_utils.run_warmup(self, iterations)
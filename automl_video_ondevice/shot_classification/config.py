@@ -42,3 +42,11 @@ class ShotClassificationConfig:
   # Sliding window size.
   # This is ignored by the LSTM model.
   sliding_window_size: int = 64
+
+  # Runs inference this many times on blank frames when loading, so that the
+  # slow first inferences do not hit real frames. 0 disables warm-up.
+  warmup_iterations: int = 0
+
+  # Records frame counts and latencies in metrics.default_registry, which can
+  # be exported with metrics.start_http_server.
+  enable_metrics: bool = False
@@ -15,18 +15,20 @@
 # ==============================================================================
 """Provides an implementation of object tracking using TF and TF-TRT."""
 
+import concurrent.futures
 import copy
+from typing import Any
 from typing import List
 from typing import Union
 import numpy as np
 import tensorflow.compat.v1 as tf
+from automl_video_ondevice import profiling
 from automl_video_ondevice.shot_classification.base_shot_classification import BaseShotClassificationInference
 from automl_video_ondevice.shot_classification.config import ShotClassificationConfig
 from automl_video_ondevice.types import ShotClassificationAnnotation
 from automl_video_ondevice.types import Size
 
 import automl_video_ondevice.utils as vot_utils
-import tensorflow.contrib.tensorrt as trt  # pylint: disable=g-explicit-tensorflow-version-import,unused-import
 
 
 class TFShotClassificationInference(BaseShotClassificationInference):
@@ -54,8 +56,15 @@ class TFShotClassificationInference(BaseShotClassificationInference):
       raise ValueError(
           'Top k cannot be zero, or else no results will be returned.')
 
-    self._load_label_map(label_map_path)
-    self._load_frozen_graph(frozen_graph_path)
+    self._startup_timer = vot_utils.StartupTimer()
+
+    # The label map is parsed while the graph is being loaded.
+    with concurrent.futures.ThreadPoolExecutor(max_workers=1) as executor:
+      label_map_future = executor.submit(self._load_label_map, label_map_path)
+      self._load_frozen_graph(frozen_graph_path)
+      label_map_future.result()
+
+    self.startup_timings = self._startup_timer.finish()
 
   def __del__(self):
     """Destructor for TFShotClassificationInference."""
@@ -71,8 +80,8 @@ class TFShotClassificationInference(BaseShotClassificationInference):
     Args:
       label_map_path: String value for the file path of the label map.
     """
-    with open(label_map_path, 'r') as f:
-      self.label_map, _ = vot_utils.parse_label_map(f.read())
+    with self._startup_timer.measure('label_map'):
+      self.label_map, _ = vot_utils.load_label_map(label_map_path)
 
   def _load_frozen_graph(self, frozen_graph_path: str):
     """Opens and loads a frozen graph into memory.
@@ -81,22 +90,30 @@ class TFShotClassificationInference(BaseShotClassificationInference):
       frozen_graph_path: String value for the file path of frozen graph.
     """
     frozen_graph = tf.GraphDef()
-    with open(frozen_graph_path, 'rb') as f:
-      frozen_graph.ParseFromString(f.read())
+    with self._startup_timer.measure('parse_graph'):
+      with vot_utils.map_model_file(frozen_graph_path) as model_buffer:
+        frozen_graph.ParseFromString(model_buffer)
+
+    if self._check_trt(frozen_graph):
+      # Registers the TensorRT ops. Only needed, and only imported, for TF-TRT
+      # graphs since it is slow to import.
+      import tensorflow.contrib.tensorrt as trt  # pylint: disable=g-explicit-tensorflow-version-import,unused-import,g-import-not-at-top,import-outside-toplevel
 
     self._is_lstm = self._check_lstm(frozen_graph)
     if self._is_lstm:
       print('Loading an LSTM model.')
 
     self.graph = tf.Graph()
-    with self.graph.as_default():
-      self.output_node = tf.import_graph_def(
-          frozen_graph,
-          return_elements=[
-              'probabilities:0',
-          ] + (['raw_outputs/lstm_c:0', 'raw_outputs/lstm_h:0']
-               if self._is_lstm else []))
-    self.session = tf.InteractiveSession(graph=self.graph)
+    with self._startup_timer.measure('import_graph'):
+      with self.graph.as_default():
+        self.output_node = tf.import_graph_def(
+            frozen_graph,
+            return_elements=[
+                'probabilities:0',
+            ] + (['raw_outputs/lstm_c:0', 'raw_outputs/lstm_h:0']
+                 if self._is_lstm else []))
+    with self._startup_timer.measure('session'):
+      self.session = tf.InteractiveSession(graph=self.graph)
 
     tf_probabilities = self.graph.get_tensor_by_name('import/probabilities:0')
     if self._is_lstm:
@@ -114,6 +131,16 @@ class TFShotClassificationInference(BaseShotClassificationInference):
     self.frames_since_last_inference = self.config.inference_rate
     self.last_annotations = []
 
+  def _check_trt(self, graph_def: tf.GraphDef) -> bool:
+    """Checks to see if the input frozen graph has been converted by TF-TRT.
+
+    Args:
+      graph_def: Loaded frozen graph.
+    Returns:
+      If the frozen graph contains TensorRT engine ops.
+    """
+    return vot_utils.has_trt_ops(graph_def)
+
   def _check_lstm(self, graph_def: tf.GraphDef) -> bool:
     """Checks to see if the input frozen graph is an LSTM graph.
 
@@ -145,6 +172,37 @@ class TFShotClassificationInference(BaseShotClassificationInference):
     """
     return Size(256, 256)
 
+  def get_state(self) -> Any:
+    """Returns a copy of the sliding window, LSTM state and last output.
+
+    Returns:
+      An opaque state object to pass to set_state.
+    """
+    sliding_window = None
+    if self.sliding_window is not None:
+      sliding_window = np.copy(self.sliding_window)
+    lstm_state = None
+    if self._is_lstm:
+      lstm_state = (np.copy(self.lstm_c), np.copy(self.lstm_h))
+    return (sliding_window, self.frames_since_last_inference,
+            copy.deepcopy(self.last_annotations), lstm_state)
+
+  def set_state(self, state: Any):
+    """Restores state previously returned by get_state.
+
+    Args:
+      state: An object returned by get_state.
+    """
+    (sliding_window, self.frames_since_last_inference, last_annotations,
+     lstm_state) = state
+    self.sliding_window = None
+    if sliding_window is not None:
+      self.sliding_window = np.copy(sliding_window)
+    self.last_annotations = copy.deepcopy(last_annotations)
+    if lstm_state is not None:
+      self.lstm_c = np.copy(lstm_state[0])
+      self.lstm_h = np.copy(lstm_state[1])
+
   def run(self, timestamp: Union[int, float], frame: np.ndarray,
           annotations: List[ShotClassificationAnnotation]) -> bool:
     """Run inferencing for a single frame, to calculate annotations.
@@ -161,7 +219,7 @@ class TFShotClassificationInference(BaseShotClassificationInference):
     Returns:
       A boolean, True if successful and False if unsuccessful.
     """
-    np_frame = np.array(frame)
+    np_frame = vot_utils.as_frame(frame)
 
     # User has to handle frame resizing by themselves.
     if np.shape(np_frame)[0] != 256:
@@ -169,23 +227,24 @@ class TFShotClassificationInference(BaseShotClassificationInference):
           'Shot classification input must be a height of 256 pixels. '
           'There is no width limit. Aspect ratio must be retained.')
 
-    if self.config.sliding_window_size == 1 or self._is_lstm:
-      # A sliding window size 1 is just the current frame. It still needs to be
-      # expanded for the input batch size.
-      #
-      # LSTM is forced to have a sliding window size 1.
-      self.sliding_window = np.expand_dims(np_frame, axis=0)
-    else:
-      # Initiate sliding window if not created yet.
-      if self.sliding_window is None:
-        self.sliding_window = np.zeros(
-            (self.config.sliding_window_size, np.shape(np_frame)[0],
-             np.shape(np_frame)[1], 3))
+    with profiling.stage('tf_shot.sliding_window'):
+      if self.config.sliding_window_size == 1 or self._is_lstm:
+        # A sliding window size 1 is just the current frame. It still needs to
+        # be expanded for the input batch size.
+        #
+        # LSTM is forced to have a sliding window size 1.
+        self.sliding_window = np.expand_dims(np_frame, axis=0)
+      else:
+        # Initiate sliding window if not created yet.
+        if self.sliding_window is None:
+          self.sliding_window = np.zeros(
+              (self.config.sliding_window_size, np.shape(np_frame)[0],
+               np.shape(np_frame)[1], 3))
 
-      # Moves sliding window and adds new frame to the back
-      # No need to move the sliding window if window size is only 1.
-      self.sliding_window = np.roll(self.sliding_window, -1)
-      self.sliding_window[self.config.sliding_window_size - 1] = np_frame
+        # Moves sliding window and adds new frame to the back
+        # No need to move the sliding window if window size is only 1.
+        self.sliding_window = np.roll(self.sliding_window, -1)
+        self.sliding_window[self.config.sliding_window_size - 1] = np_frame
 
     self.frames_since_last_inference += 1
     if self.frames_since_last_inference >= self.config.inference_rate or self._is_lstm:
@@ -201,8 +260,9 @@ class TFShotClassificationInference(BaseShotClassificationInference):
               'import/raw_inputs/init_lstm_h:0': self.lstm_h
           })
 
-        session_return = self.session.run(
-            self._output_nodes, feed_dict=feed_dict)
+        with profiling.stage('tf_shot.session_run'):
+          session_return = self.session.run(
+              self._output_nodes, feed_dict=feed_dict)
         if self._is_lstm:
           (probabilities, self.lstm_c, self.lstm_h) = session_return
           score = probabilities
@@ -210,26 +270,27 @@ class TFShotClassificationInference(BaseShotClassificationInference):
           (probabilities) = session_return
           score = probabilities[0]
 
-        assert len(self.label_map) == len(score)
+        with profiling.stage('tf_shot.postprocess'):
+          assert len(self.label_map) == len(score)
 
-        for i in range(len(score)):
-          if score[i] < self.config.score_threshold:
-            continue
+          for i in range(len(score)):
+            if score[i] < self.config.score_threshold:
+              continue
 
-          annotation = ShotClassificationAnnotation(
-              timestamp=timestamp,
-              class_name=self.label_map[i],
-              confidence_score=score[i],
-          )
-          annotations.append(annotation)
-        annotations.sort(key=lambda v: v.confidence_score, reverse=True)
+            annotation = ShotClassificationAnnotation(
+                timestamp=timestamp,
+                class_name=self.label_map[i],
+                confidence_score=score[i],
+            )
+            annotations.append(annotation)
+          annotations.sort(key=lambda v: v.confidence_score, reverse=True)
 
-        # Removes everything not in the top k.
-        if self.config.top_k > 0:
-          del annotations[self.config.top_k:]
+          # Removes everything not in the top k.
+          if self.config.top_k > 0:
+            del annotations[self.config.top_k:]
 
-        if self.config.duplicate_results:
-          self.last_annotations = copy.deepcopy(annotations)
+          if self.config.duplicate_results:
+            self.last_annotations = copy.deepcopy(annotations)
     else:
       if self.config.duplicate_results:
         annotations.extend(copy.deepcopy(self.last_annotations))
@@ -0,0 +1,442 @@
+# Lint as: python3
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+"""Buffered, streaming writers for annotation output.
+
+Sinks persist the annotations of every frame without slowing down the
+inference loop. write() only snapshots the annotations and puts them on a
+queue; encoding, compression and file I/O all happen in bulk on a background
+thread. If the queue is full the frame is dropped and counted, rather than
+blocking the caller.
+
+Files written by JsonlSink and BinarySink can be read back with read_jsonl and
+read_binary.
+
+Example:
+  with sinks.JsonlSink('/tmp/results.jsonl', compress=True) as sink:
+    while ...:
+      annotations = []
+      engine.run(timestamp, frame, annotations)
+      sink.write(timestamp, annotations)
+"""
+
+import csv
+import gzip
+import io
+import json
+import math
+import os
+import queue
+import struct
+import threading
+import time
+from typing import Iterator, List, Tuple, Union
+
+from automl_video_ondevice import metrics
+from automl_video_ondevice.types import NormalizedBoundingBox
+from automl_video_ondevice.types import ObjectTrackingAnnotation
+from automl_video_ondevice.types import ShotClassificationAnnotation
+
+Annotation = Union[ObjectTrackingAnnotation, ShotClassificationAnnotation]
+
+# A snapshot of a single annotation, using builtin types only:
+# (track_id, class_id, class_name, confidence_score, left, top, right, bottom)
+# Shot classification annotations have no track, class id or box, and use -1
+# and NaN in their place.
+Record = Tuple[int, int, str, float, float, float, float, float]
+
+CSV_COLUMNS = ('timestamp', 'track_id', 'class_id', 'class_name',
+               'confidence_score', 'left', 'top', 'right', 'bottom')
+
+# Binary frame layout, little endian. Every frame is prefixed by its length so
+# a reader can skip frames without decoding them:
+#   uint32 length of the rest of the frame
+#   float64 timestamp, uint32 number of annotations
+#   per annotation: int32 track_id, int32 class_id, float32 score,
+#     float32 left, top, right, bottom, uint8 name length, utf-8 class name
+_FRAME_LENGTH = struct.Struct('<I')
+_FRAME_HEADER = struct.Struct('<dI')
+_BINARY_RECORD = struct.Struct('<iifffffB')
+
+_NAN = float('nan')
+_STOP = object()
+
+
+def snapshot(annotation):
+  # type: (Annotation) -> Record
+  """Copies an annotation into builtin types.
+
+  Trackers keep mutating the annotations they output, and NumPy scalars are
+  not JSON serializable, so annotations are snapshotted before being queued.
+
+  Args:
+    annotation: An ObjectTrackingAnnotation or ShotClassificationAnnotation.
+
+  Returns:
+    The annotation as a Record tuple.
+  """
+  if isinstance(annotation, ShotClassificationAnnotation):
+    return (-1, -1, annotation.class_name, float(annotation.confidence_score),
+            _NAN, _NAN, _NAN, _NAN)
+  bbox = annotation.bbox
+  return (int(annotation.track_id), int(annotation.class_id),
+          annotation.class_name, float(annotation.confidence_score),
+          float(bbox.left), float(bbox.top), float(bbox.right),
+          float(bbox.bottom))
+
+
+def record_to_dict(record):
+  # type: (Record) -> dict
+  """Converts a Record into a JSON-serializable dictionary."""
+  track_id, class_id, class_name, score, left, top, right, bottom = record
+  if math.isnan(left):  # Shot classification annotations have no box.
+    return {'class_name': class_name, 'confidence_score': score}
+  return {
+      'track_id': track_id,
+      'class_id': class_id,
+      'class_name': class_name,
+      'confidence_score': score,
+      'bbox': {
+          'left': left,
+          'top': top,
+          'right': right,
+          'bottom': bottom,
+      },
+  }
+
+
+def annotation_to_dict(annotation):
+  # type: (Annotation) -> dict
+  """Converts an annotation into a JSON-serializable dictionary."""
+  return record_to_dict(snapshot(annotation))
+
+
+class BaseAnnotationSink:
+  """Writes annotations to a file on a background thread.
+
+  Subclasses implement _encode, and optionally _header.
+  """
+
+  extension = ''
+
+  def __init__(self,
+               path,
+               compress=False,
+               rotate_bytes=0,
+               max_queue_size=4096,
+               max_batch_size=512,
+               flush_interval=1.0):
+    """Constructor for BaseAnnotationSink.
+
+    Args:
+      path: Output file path. With compression enabled, '.gz' is appended.
+      compress: Whether to gzip the output.
+      rotate_bytes: Starts a new file once this many bytes have been written to
+        the current one. 0 disables rotation. Rotated files are numbered, e.g.
+        results.jsonl, results.1.jsonl, results.2.jsonl.
+      max_queue_size: How many frames can be waiting to be written before new
+        frames are dropped. 0 never drops frames, at the cost of unbounded
+        memory if the disk cannot keep up.
+      max_batch_size: Most frames encoded and written in a single write call.
+      flush_interval: Longest time, in seconds, written data stays buffered.
+    """
+    self.path = path
+    self.dropped = 0
+    self.written = 0
+    self._compress = compress
+    self._rotate_bytes = rotate_bytes
+    self._max_batch_size = max_batch_size
+    self._flush_interval = flush_interval
+    self._queue = queue.Queue(maxsize=max_queue_size)
+    self._file = None
+    self._file_index = 0
+    self._file_bytes = 0
+    self._closed = False
+    self._error = None
+    self._error_reported = False  # Whether write already raised _error.
+
+    # The full path, so that sinks writing files of the same name in different
+    # directories do not share metrics.
+    labels = {'sink': os.path.abspath(path)}
+    self._dropped_counter = metrics.default_registry.counter(
+        'automl_video_sink_frames_dropped_total',
+        'Frames dropped by annotation sinks because their queue was full.',
+        labels)
+    self._queue_depth = metrics.default_registry.gauge(
+        'automl_video_sink_queue_depth',
+        'Frames waiting to be written by annotation sinks.', labels)
+    self._queue_depth.set_function(self._queue.qsize)
+
+    self._open_next_file()
+    self._thread = threading.Thread(target=self._write_loop, daemon=True)
+    self._thread.start()
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, exc_type, exc_value, traceback):
+    self.close()
+
+  def write(self, timestamp, annotations):
+    # type: (Union[int, float], List[Annotation]) -> bool
+    """Queues the annotations of a single frame to be written.
+
+    Never blocks. Shot classification output may contain None entries, which
+    are skipped.
+
+    Args:
+      timestamp: The timestamp of the frame.
+      annotations: The annotations output by the engine for that frame.
+
+    Returns:
+      True if queued, False if the frame was dropped because the queue is full.
+
+    Raises:
+      ValueError: If the sink is closed.
+      Exception: The error that stopped the writer thread, if any.
+    """
+    if self._closed:
+      raise ValueError('Cannot write to a closed sink.')
+    if self._error is not None:
+      self._error_reported = True
+      raise self._error
+    records = [snapshot(a) for a in annotations if a is not None]
+    try:
+      self._queue.put_nowait((timestamp, records))
+      return True
+    except queue.Full:
+      self.dropped += 1
+      self._dropped_counter.inc()
+      return False
+
+  def close(self):
+    """Writes everything still queued, then closes the file."""
+    if self._closed:
+      return
+    self._closed = True
+    # The writer thread may have stopped on an error, leaving the queue full.
+    while self._thread.is_alive():
+      try:
+        self._queue.put(_STOP, timeout=0.1)
+        break
+      except queue.Full:
+        pass
+    self._thread.join()
+    metrics.default_registry.unregister(self._dropped_counter)
+    metrics.default_registry.unregister(self._queue_depth)
+    if self._error is not None and not self._error_reported:
+      raise self._error
+
+  def file_paths(self):
+    # type: () -> List[str]
+    """Returns every file written so far, in order."""
+    return [self._file_path(i) for i in range(self._file_index + 1)]
+
+  def _file_path(self, index):
+    root, extension = os.path.splitext(self.path)
+    path = self.path if index == 0 else '{}.{}{}'.format(
+        root, index, extension)
+    return path + '.gz' if self._compress else path
+
+  def _open_next_file(self):
+    if self._file is not None:
+      self._file.close()
+      self._file_index += 1
+    path = self._file_path(self._file_index)
+    if self._compress:
+      self._file = gzip.open(path, 'wb', compresslevel=6)
+    else:
+      self._file = open(path, 'wb')
+    self._file_bytes = 0
+    header = self._header()
+    if header:
+      self._file.write(header)
+      self._file_bytes += len(header)
+
+  def _write_loop(self):
+    stop = False
+    next_flush = time.monotonic() + self._flush_interval
+    try:
+      while not stop:
+        # Flushes on time even while frames keep arriving.
+        if time.monotonic() >= next_flush:
+          self._file.flush()
+          next_flush = time.monotonic() + self._flush_interval
+        try:
+          batch = [
+              self._queue.get(timeout=max(0, next_flush - time.monotonic()))
+          ]
+        except queue.Empty:
+          continue
+        while len(batch) < self._max_batch_size:
+          try:
+            batch.append(self._queue.get_nowait())
+          except queue.Empty:
+            break
+        if batch[-1] is _STOP:
+          batch.pop()
+          stop = True
+
+        data = b''.join(
+            self._encode(timestamp, records) for timestamp, records in batch)
+        self._file.write(data)
+        self._file_bytes += len(data)
+        self.written += len(batch)
+        if self._rotate_bytes and self._file_bytes >= self._rotate_bytes:
+          self._open_next_file()
+    except Exception as e:  # pylint: disable=broad-except
+      self._error = e
+    finally:
+      self._file.close()
+
+  def _header(self):
+    # type: () -> bytes
+    return b''
+
+  def _encode(self, timestamp, records):
+    # type: (Union[int, float], List[Record]) -> bytes
+    raise NotImplementedError()
+
+
+class JsonlSink(BaseAnnotationSink):
+  """Writes one JSON object per frame.
+
+  Each line looks like:
+    {"timestamp": 33333, "annotations": [{"track_id": 0, ...}]}
+  """
+
+  extension = '.jsonl'
+
+  def _encode(self, timestamp, records):
+    return (json.dumps({
+        'timestamp': timestamp,
+        'annotations': [record_to_dict(record) for record in records],
+    }) + '\n').encode('utf-8')
+
+
+class CsvSink(BaseAnnotationSink):
+  """Writes one CSV row per annotation, with the columns in CSV_COLUMNS.
+
+  Frames without annotations produce no rows.
+  """
+
+  extension = '.csv'
+
+  def _header(self):
+    return (','.join(CSV_COLUMNS) + '\n').encode('utf-8')
+
+  def _encode(self, timestamp, records):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator='\n')
+    for record in records:
+      writer.writerow((timestamp,) + record)
+    return buffer.getvalue().encode('utf-8')
+
+
+class BinarySink(BaseAnnotationSink):
+  """Writes compact, length-prefixed binary frames. Read with read_binary."""
+
+  extension = '.bin'
+
+  def _encode(self, timestamp, records):
+    parts = [_FRAME_HEADER.pack(timestamp, len(records))]
+    for (track_id, class_id, class_name, score, left, top, right,
+         bottom) in records:
+      # Truncated on a character boundary, so names still decode.
+      name = class_name.encode('utf-8')[:255].decode('utf-8', 'ignore').encode(
+          'utf-8')
+      parts.append(
+          _BINARY_RECORD.pack(track_id, class_id, score, left, top, right,
+                              bottom, len(name)))
+      parts.append(name)
+    payload = b''.join(parts)
+    return _FRAME_LENGTH.pack(len(payload)) + payload
+
+
+def read_binary(path):
+  # type: (str) -> Iterator[Tuple[float, List[ObjectTrackingAnnotation]]]
+  """Reads a file written by BinarySink.
+
+  Args:
+    path: The file path. Files ending in '.gz' are decompressed.
+
+  Yields:
+    Tuples of (timestamp, list of ObjectTrackingAnnotation), one per frame.
+  """
+  opener = gzip.open if path.endswith('.gz') else open
+  with opener(path, 'rb') as f:
+    while True:
+      length_data = f.read(_FRAME_LENGTH.size)
+      if len(length_data) < _FRAME_LENGTH.size:
+        return
+      (length,) = _FRAME_LENGTH.unpack(length_data)
+      payload = f.read(length)
+      timestamp, count = _FRAME_HEADER.unpack_from(payload, 0)
+      offset = _FRAME_HEADER.size
+      annotations = []
+      for _ in range(count):
+        (track_id, class_id, score, left, top, right, bottom,
+         name_length) = _BINARY_RECORD.unpack_from(payload, offset)
+        offset += _BINARY_RECORD.size
+        class_name = payload[offset:offset + name_length].decode('utf-8')
+        offset += name_length
+        annotations.append(
+            ObjectTrackingAnnotation(
+                timestamp=timestamp,
+                track_id=track_id,
+                class_id=class_id,
+                class_name=class_name,
+                confidence_score=score,
+                bbox=NormalizedBoundingBox(
+                    left=left, top=top, right=right, bottom=bottom)))
+      yield timestamp, annotations
+
+
+def read_jsonl(path):
+  # type: (str) -> Iterator[Tuple[float, List[Annotation]]]
+  """Reads a file written by JsonlSink.
+
+  Args:
+    path: The file path. Files ending in '.gz' are decompressed.
+
+  Yields:
+    Tuples of (timestamp, list of annotations), one per frame. Annotations
+    without a box are read as ShotClassificationAnnotation.
+  """
+  opener = gzip.open if path.endswith('.gz') else open
+  with opener(path, 'rt', encoding='utf-8') as f:
+    for line in f:
+      if not line.strip():
+        continue
+      frame = json.loads(line)
+      timestamp = frame['timestamp']
+      annotations = []
+      for item in frame['annotations']:
+        if 'bbox' not in item:
+          annotations.append(
+              ShotClassificationAnnotation(
+                  timestamp=timestamp,
+                  class_name=item['class_name'],
+                  confidence_score=item['confidence_score']))
+          continue
+        annotations.append(
+            ObjectTrackingAnnotation(
+                timestamp=timestamp,
+                track_id=item['track_id'],
+                class_id=item['class_id'],
+                class_name=item['class_name'],
+                confidence_score=item['confidence_score'],
+                bbox=NormalizedBoundingBox(**item['bbox'])))
+      yield timestamp, annotations
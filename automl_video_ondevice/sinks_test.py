@@ -0,0 +1,65 @@
+# Lint as: python3
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+"""Tests for annotation sinks."""
+
+import os
+import tempfile
+import time
+import unittest
+
+from automl_video_ondevice import sinks
+from automl_video_ondevice.types import NormalizedBoundingBox
+from automl_video_ondevice.types import ObjectTrackingAnnotation
+
+
+def _annotation(class_name):
+  return ObjectTrackingAnnotation(
+      timestamp=0,
+      track_id=1,
+      class_id=2,
+      class_name=class_name,
+      confidence_score=0.5,
+      bbox=NormalizedBoundingBox(0.1, 0.2, 0.3, 0.4))
+
+
+class SinkTest(unittest.TestCase):
+
+  def setUp(self):
+    super().setUp()
+    self.directory = tempfile.mkdtemp()
+
+  def test_flushes_while_frames_keep_arriving(self):
+    path = os.path.join(self.directory, 'results.jsonl')
+    with sinks.JsonlSink(path, flush_interval=0.05) as sink:
+      # Never leaves the queue empty for a whole flush interval.
+      for _ in range(20):
+        sink.write(0, [_annotation('car')])
+        time.sleep(0.01)
+      # Less than a file buffer, so only on disk if flushed.
+      self.assertGreater(os.path.getsize(path), 0)
+
+  def test_binary_names_are_truncated_on_a_character_boundary(self):
+    path = os.path.join(self.directory, 'results.bin')
+    # 127 two-byte characters are 254 bytes, so the 128th is cut in half.
+    name = 'é' * 200
+    with sinks.BinarySink(path) as sink:
+      sink.write(0, [_annotation(name)])
+    ((_, annotations),) = list(sinks.read_binary(path))
+    self.assertEqual(annotations[0].class_name, name[:127])
+
+
+if __name__ == '__main__':
+  unittest.main()
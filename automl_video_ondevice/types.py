@@ -51,10 +51,18 @@ class ShotClassificationAnnotation:
   confidence_score: float
 
 
+@dataclasses.dataclass
+class WarmupReport:
+  iterations: int
+  cold_latency_ms: float  # Latency of the first run.
+  warm_latency_ms: float  # Median latency of the other runs, NaN if none.
+
+
 class Format(enum.Enum):
   UNDEFINED = 0
   TFLITE = 1
   TENSORFLOW = 2
+  FAKE = 3  # Replays recorded detections, or generates synthetic ones.
 
 
 class Tracker(enum.Enum):
@@ -15,10 +15,32 @@
 # ==============================================================================
 """Utility functions for object tracking."""
 
+import contextlib
 import json
+import mmap
+import os
 import re
+import statistics
+import time
 
+import numpy as np
 from automl_video_ondevice.types import Format
+from automl_video_ondevice.types import WarmupReport
+
+# Model paths loaded by the fake engine: recorded annotation files, or
+# FAKE_SYNTHETIC_PATH to generate detections.
+FAKE_EXTENSIONS = ('.jsonl', '.jsonl.gz', '.bin', '.bin.gz')
+FAKE_SYNTHETIC_PATH = 'synthetic'
+
+# Suffix of the parsed label map cache, stored next to the label map.
+LABEL_MAP_CACHE_SUFFIX = '.cache.json'
+
+# In-process cache of parsed label maps, keyed by (path, mtime, size).
+_label_map_cache = {}
+
+# Model file contents read ahead of time by preload_model, keyed by real path,
+# modification time and size, so that a file replaced on disk is read again.
+_preloaded_models = {}
 
 
 def parse_label_map(label_map):
@@ -36,6 +58,11 @@ def parse_label_map(label_map):
         2: 'label2'
       }
   """
+  return _label_maps_from_items(_parse_label_map_items(label_map))
+
+
+def _parse_label_map_items(label_map):
+  """Parses label map data into a list of (id, name) tuples, in file order."""
   # Converts the pbtxt into a JSON file and then parses it.
   label_map_json = '[' + re.sub(
       r'[\n\s]*item[\n\s]*', '',
@@ -44,19 +71,260 @@ def parse_label_map(label_map):
           re.sub(r'[\n\s]*name:\s*"', '\n  "name": "',
                  re.sub(r'\n?\s+id:\s*', ',\n  "id": ', label_map)))) + ']'
   parsed_label_map = json.loads(label_map_json)
+  return [(item['id'], item['name']) for item in parsed_label_map]
+
 
+def _label_maps_from_items(items):
   # TensorFlow maps by id to name.
   # TFLite maps by list index to name, ditching the id.
 
   label_map = dict()
   label_list = list()
-  for item in parsed_label_map:
-    label_map[item['id']] = item['name']
-    label_list.append(item['name'])
+  for item_id, name in items:
+    label_map[item_id] = name
+    label_list.append(name)
 
   return label_map, label_list
 
 
+def load_label_map(label_map_path):
+  """Reads and parses a label map file, caching the result.
+
+  Parsed label maps are cached in memory, as well as on disk next to the label
+  map, so that restarted processes skip parsing too. Both caches are
+  invalidated when the label map file changes. Failing to write the on-disk
+  cache, e.g. on a read-only filesystem, is not an error.
+
+  Args:
+    label_map_path: Path to the labelmap .pbtxt file.
+
+  Returns:
+    The same (label map dictionary, label list) tuple as parse_label_map.
+  """
+  stat = os.stat(label_map_path)
+  key = (os.path.abspath(label_map_path), stat.st_mtime_ns, stat.st_size)
+  if key in _label_map_cache:
+    return _label_map_cache[key]
+
+  cache_path = label_map_path + LABEL_MAP_CACHE_SUFFIX
+  items = None
+  try:
+    with open(cache_path, 'r') as f:
+      cache = json.load(f)
+    if cache['mtime_ns'] == stat.st_mtime_ns and cache['size'] == stat.st_size:
+      items = cache['items']
+  except (OSError, ValueError, KeyError):
+    pass
+
+  if items is None:
+    with open(label_map_path, 'r') as f:
+      items = _parse_label_map_items(f.read())
+    # Written to a temporary file first, so that processes starting at the
+    # same time never read a partially written cache.
+    temp_path = '{}.{}.tmp'.format(cache_path, os.getpid())
+    try:
+      with open(temp_path, 'w') as f:
+        json.dump({
+            'mtime_ns': stat.st_mtime_ns,
+            'size': stat.st_size,
+            'items': items
+        }, f)
+      os.replace(temp_path, cache_path)
+    except OSError:
+      try:
+        os.remove(temp_path)
+      except OSError:
+        pass
+
+  _label_map_cache[key] = _label_maps_from_items(items)
+  return _label_map_cache[key]
+
+
+@contextlib.contextmanager
+def map_model_file(model_path):
+  """Memory-maps a model file, instead of reading it into Python bytes.
+
+  Pages are loaded by the OS as they are accessed, and are shared with every
+  other process mapping the same file.
+
+  If the model was preloaded with preload_model, the preloaded copy is used
+  instead.
+
+  Args:
+    model_path: Path to the model file.
+
+  Yields:
+    A read-only memoryview of the file, only valid within the context.
+  """
+  preloaded = preloaded_model(model_path)
+  if preloaded is not None:
+    with memoryview(preloaded) as view:
+      yield view
+    return
+  with open(model_path, 'rb') as f:
+    with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+      with memoryview(mapped) as view:
+        yield view
+
+
+def preload_model(model_path):
+  """Reads a model file into memory, for engines loaded later to use.
+
+  Meant to be called in a parent process before forking workers: the children
+  then create their interpreters or sessions from the parent's copy, which is
+  shared copy-on-write instead of being read by every worker.
+
+  Args:
+    model_path: Path to the model file.
+
+  Returns:
+    The model file contents, as bytes.
+  """
+  key = _preload_key(model_path)
+  if key not in _preloaded_models:
+    # Frees the copy of an older version of the file.
+    release_preloaded_model(model_path)
+    with open(model_path, 'rb') as f:
+      _preloaded_models[key] = f.read()
+  return _preloaded_models[key]
+
+
+def preloaded_model(model_path):
+  """Returns the contents of a model loaded by preload_model, or None.
+
+  None is also returned when the file changed since it was preloaded.
+  """
+  try:
+    return _preloaded_models.get(_preload_key(model_path))
+  except OSError:
+    return None
+
+
+def release_preloaded_model(model_path):
+  """Frees every copy of a model loaded by preload_model."""
+  real_path = os.path.realpath(model_path)
+  for key in [key for key in _preloaded_models if key[0] == real_path]:
+    del _preloaded_models[key]
+
+
+def _preload_key(model_path):
+  stat = os.stat(model_path)
+  return (os.path.realpath(model_path), stat.st_mtime_ns, stat.st_size)
+
+
+class StartupTimer:
+  """Records how long each step of loading an engine takes."""
+
+  def __init__(self):
+    self.timings = {}
+    self._start = time.monotonic()
+
+  @contextlib.contextmanager
+  def measure(self, name):
+    """Times the enclosed block, recording it in milliseconds under name."""
+    start = time.monotonic()
+    try:
+      yield
+    finally:
+      self.timings[name] = (time.monotonic() - start) * 1000
+
+  def finish(self):
+    """Records the total time since construction, and returns all timings."""
+    self.timings['total'] = (time.monotonic() - self._start) * 1000
+    return self.timings
+
+  def summary(self):
+    return ', '.join(
+        '{}: {:.1f}ms'.format(name, ms) for name, ms in self.timings.items())
+
+
+def as_frame(frame, dtype=None):
+  """Returns a frame as an (h, w, 3) array, copying it only when needed.
+
+  Engines take ndarrays, PIL images and any other object exposing the buffer
+  protocol or the array interface. An ndarray is returned as is when it is
+  C-contiguous, and buffer or array interface objects are viewed without a
+  copy where possible. PIL images are always copied into a new array.
+
+  Frames are not converted: when a dtype is given, which engines pass as their
+  input_dtype(), a frame of any other dtype is rejected.
+
+  Args:
+    frame: The RGB image.
+    dtype: The dtype the frame must have, if any.
+
+  Returns:
+    A C-contiguous ndarray of shape (h, w, 3).
+
+  Raises:
+    ValueError: If the frame is not an (h, w, 3) image, or not of dtype.
+  """
+  array = np.asarray(frame)
+  if array.ndim != 3 or array.shape[2] != 3:
+    raise ValueError('Expected an (h, w, 3) RGB frame, got shape {}.'.format(
+        array.shape))
+  if dtype is not None and array.dtype != dtype:
+    raise ValueError('Expected a {} frame, got {}.'.format(
+        np.dtype(dtype).name, array.dtype.name))
+  if not array.flags.c_contiguous:
+    array = np.ascontiguousarray(array)
+  return array
+
+
+def run_warmup(engine, iterations, dtype=np.uint8):
+  """Runs an engine on blank frames, so one-time costs are paid up front.
+
+  The first inference of an accelerator or TF-TRT graph is many times slower
+  than the following ones. The engine's recurrent state is restored before
+  every run and once done, so warming up does not affect later output.
+
+  Args:
+    engine: An object tracking or shot classification engine.
+    iterations: How many times to run inference.
+    dtype: The dtype of the blank frames.
+
+  Returns:
+    A WarmupReport with the cold and warm latencies.
+  """
+  if iterations <= 0:
+    raise ValueError('Warmup needs at least one iteration.')
+  size = engine.input_size()
+  frame = np.zeros((size.height, size.width, 3), dtype=dtype)
+  state = engine.get_state()
+  latencies = []
+  for _ in range(iterations):
+    engine.set_state(state)
+    start = time.monotonic()
+    engine.run(0, frame, [])
+    latencies.append((time.monotonic() - start) * 1000)
+  engine.set_state(state)
+
+  return WarmupReport(
+      iterations=iterations,
+      cold_latency_ms=latencies[0],
+      warm_latency_ms=statistics.median(latencies[1:])
+      if iterations > 1 else float('nan'))
+
+
+def has_trt_ops(graph_def):
+  """Checks if a GraphDef contains TensorRT ops, i.e. was converted by TF-TRT.
+
+  Args:
+    graph_def: The tf.GraphDef to check.
+
+  Returns:
+    True if any node, including those of library functions, is a TensorRT op.
+  """
+  for node in graph_def.node:
+    if node.op == 'TRTEngineOp':
+      return True
+  for function in graph_def.library.function:
+    for node in function.node_def:
+      if node.op == 'TRTEngineOp':
+        return True
+  return False
+
+
 def format_from_filename(filename):
   """Determines format of file from the filename.
 
@@ -70,4 +338,6 @@ def format_from_filename(filename):
     return Format.TFLITE
   if filename.endswith('.pb'):
     return Format.TENSORFLOW
+  if filename == FAKE_SYNTHETIC_PATH or filename.endswith(FAKE_EXTENSIONS):
+    return Format.FAKE
   return Format.UNDEFINED
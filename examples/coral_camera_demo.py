@@ -25,7 +25,6 @@ Press Q key to exit.
 """
 import argparse
 import time
-from PIL import Image
 from automl_video_ondevice import object_tracking as vot
 import utils
 
@@ -68,16 +67,18 @@ def main():
     if not ret:
       break
 
-    # Converts image to PIL Image.
-    pil_im = Image.fromarray(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)).resize(
-        (input_size.width, input_size.height))
+    # Resizes before converting to RGB, so only the small frame is converted.
+    # Engines take the array without copying it again.
+    rgb_frame = cv2.cvtColor(
+        cv2.resize(frame, (input_size.width, input_size.height)),
+        cv2.COLOR_BGR2RGB)
 
     # Grabs current millisecond for timestamp.
     timestamp = current_milli_time()
 
     # Run inference engine to populate annotations array.
     annotations = []
-    if engine.run(timestamp, pil_im, annotations):
+    if engine.run(timestamp, rgb_frame, annotations):
       frame = utils.render_bbox(frame, annotations)
 
     # Calculate FPS, then visualize it.
@@ -25,7 +25,9 @@ Press Q key to exit.
 """
 import argparse
 import time
+from automl_video_ondevice import gstreamer
 from automl_video_ondevice import object_tracking as vot
+from automl_video_ondevice.types import Size
 import utils
 
 try:
@@ -69,36 +71,24 @@ def main():
   input_size = engine.input_size()
   fps_calculator = utils.FpsCalculator()
 
-  if args.video_device >= 0:
-    cap = cv2.VideoCapture(
-        'v4l2src device=/dev/video{} ! videoconvert ! '
-        'videoscale method=0 add-borders=false ! '
-        'video/x-raw, width={}, height={}, format=RGB ! videoconvert ! '
-        'appsink'.format(args.video_device, args.video_width,
-                         args.video_height), cv2.CAP_GSTREAMER)
-  else:
-    cap = cv2.VideoCapture(
-        'nvarguscamerasrc ! nvvidconv ! '
-        'video/x-raw, format=(string)BGRx ! videoconvert ! '
-        'videoscale method=0 add-borders=false ! '
-        'video/x-raw, width={}, height={}, format=RGB ! videoconvert ! '
-        'appsink'.format(args.video_width, args.video_height),
-        cv2.CAP_GSTREAMER)
-
-  while cap.isOpened():
-    ret, frame = cap.read()
-    if not ret:
-      break
+  # GStreamer captures frames at the input size for inference, and at the
+  # video size for rendering, so no frame is resized in Python.
+  capture = gstreamer.Capture(
+      args.video_device
+      if args.video_device >= 0 else gstreamer.NVARGUS_SOURCE,
+      input_size,
+      display=True,
+      capture_size=Size(args.video_width, args.video_height))
 
-    # Resizes frame.
-    resized_frame = cv2.resize(frame, (input_size.width, input_size.height))
+  for captured in capture:
+    frame = captured.display_image
 
     # Grabs current millisecond for timestamp.
     timestamp = current_milli_time()
 
     # Run inference engine to populate annotations array.
     annotations = []
-    if engine.run(timestamp, resized_frame, annotations):
+    if engine.run(timestamp, captured.image, annotations):
       frame = utils.render_bbox(frame, annotations)
 
     # Calculate FPS, then visualize it.
@@ -114,7 +104,7 @@ def main():
     if key & 0xFF == ord('q') or key == 27:
       break
 
-  cap.release()
+  capture.close()
   cv2.destroyAllWindows()
 
 
@@ -45,6 +45,7 @@ python3 examples/video_file_demo.py \
 Press Q key to exit.
 """
 import argparse
+from automl_video_ondevice import frame_source
 from automl_video_ondevice import object_tracking as vot
 import utils
 
@@ -70,56 +71,54 @@ def main():
       '--threshold', type=float, default=0.2, help='class score threshold')
   parser.add_argument(
       '--use_tracker', type=bool, default=False, help='use an object tracker')
+  parser.add_argument(
+      '--motion_threshold',
+      type=float,
+      default=0.0,
+      help='fraction of changed pixels below which inference is skipped, 0 '
+      'to run inference on every frame')
   args = parser.parse_args()
 
   print('Loading %s with %s labels.' % (args.model, args.labels))
 
   config = vot.ObjectTrackingConfig(
       score_threshold=args.threshold,
-      tracker=vot.Tracker.BASIC if args.use_tracker else vot.Tracker.NONE)
+      tracker=vot.Tracker.BASIC if args.use_tracker else vot.Tracker.NONE,
+      motion_threshold=args.motion_threshold)
   engine = vot.load(args.model, args.labels, config)
   input_size = engine.input_size()
 
-  cap = cv2.VideoCapture(args.input_video)
-
-  writer = None
-  if cap.isOpened() and args.output_video:
-    writer = cv2.VideoWriter(args.output_video, cv2.VideoWriter_fourcc(*'mp4v'),
-                             cap.get(cv2.CAP_PROP_FPS),
-                             (int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)),
-                              int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))))
-
-  timestamp = 0
-  while cap.isOpened():
-    ret, frame = cap.read()
-
-    if not ret:
-      break
-
-    # Resizes frame.
-    resized_frame = cv2.resize(frame, (input_size.width, input_size.height))
-    rgb_frame = cv2.cvtColor(resized_frame, cv2.COLOR_BGR2RGB)
-
-    # Calculates current microsecond for timestamp.
-    timestamp = int(timestamp + (1/cap.get(cv2.CAP_PROP_FPS)) * 1000 * 1000)
-
-    # Run inference engine to populate annotations array.
-    annotations = []
-    if engine.run(timestamp, rgb_frame, annotations):
-      frame = utils.render_bbox(frame, annotations)
-
-    if writer:
-      writer.write(frame)
-    else:
-      cv2.imshow('frame', frame)
-      if cv2.waitKey(1) & 0xFF == ord('q'):
-        break
+  # Decodes ahead on a background thread while inference runs.
+  with frame_source.FrameSource(args.input_video) as source:
+    writer = None
+    if args.output_video:
+      writer = cv2.VideoWriter(args.output_video,
+                               cv2.VideoWriter_fourcc(*'mp4v'),
+                               source.frame_rate, source.frame_size)
+
+    for decoded in source:
+      frame = decoded.image
+
+      # Resizes frame.
+      resized_frame = cv2.resize(frame, (input_size.width, input_size.height))
+      rgb_frame = cv2.cvtColor(resized_frame, cv2.COLOR_BGR2RGB)
+
+      # Run inference engine to populate annotations array.
+      annotations = []
+      if engine.run(decoded.timestamp, rgb_frame, annotations):
+        frame = utils.render_bbox(frame, annotations)
+
+      if writer:
+        writer.write(frame)
+      else:
+        cv2.imshow('frame', frame)
+        if cv2.waitKey(1) & 0xFF == ord('q'):
+          break
 
   if writer:
     writer.release()
   else:
     cv2.destroyAllWindows()
-  cap.release()
 
 
 if __name__ == '__main__':
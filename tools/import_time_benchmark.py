@@ -0,0 +1,127 @@
+# Lint as: python3
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+r"""Measures import time of the library, and enforces a budget.
+
+Each scenario runs in a fresh interpreter, so nothing is already imported. A
+scenario fails if it takes longer than its budget, or if it imports a module
+it should not need (e.g. OpenCV without a tracker).
+
+Exits with a non-zero status if any scenario fails.
+
+python3 tools/import_time_benchmark.py \
+  --model data/traffic_model.tflite \
+  --labels data/traffic_label_map.pbtxt \
+  --budget_ms 300
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+REPO_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+# Runs inside of the fresh interpreter. Prints the elapsed time and which of
+# the forbidden modules were imported, as JSON.
+_SCENARIO_TEMPLATE = """
+import json
+import sys
+import time
+start = time.perf_counter()
+{code}
+elapsed_ms = (time.perf_counter() - start) * 1000
+print(json.dumps({{
+    'ms': elapsed_ms,
+    'imported': [m for m in {forbidden!r} if m in sys.modules],
+}}))
+"""
+
+
+def scenarios(model_path, label_map_path):
+  """Returns (name, code, forbidden modules) of each scenario."""
+  return [
+      ('import object_tracking',
+       'from automl_video_ondevice import object_tracking',
+       ['cv2', 'tensorflow']),
+      ('import shot_classification',
+       'from automl_video_ondevice import shot_classification',
+       ['cv2', 'tensorflow']),
+      # Without tflite_runtime installed, TFLite falls back to TensorFlow, so
+      # only OpenCV is forbidden here.
+      ('load tflite without tracker',
+       'from automl_video_ondevice import object_tracking as vot\n'
+       'vot.load({!r}, {!r}, vot.ObjectTrackingConfig())'.format(
+           model_path, label_map_path), ['cv2']),
+  ]
+
+
+def run_scenario(code, forbidden):
+  """Runs a single scenario in a fresh interpreter, returning its result."""
+  env = dict(os.environ)
+  env['PYTHONPATH'] = os.pathsep.join(
+      [REPO_ROOT] + ([env['PYTHONPATH']] if env.get('PYTHONPATH') else []))
+  output = subprocess.run(
+      [sys.executable, '-c',
+       _SCENARIO_TEMPLATE.format(code=code, forbidden=forbidden)],
+      cwd=REPO_ROOT,
+      env=env,
+      stdout=subprocess.PIPE,
+      check=True).stdout.decode('utf-8')
+  # The library prints while loading, so the result is the last line.
+  return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+  parser = argparse.ArgumentParser()
+  parser.add_argument(
+      '--model', help='model path', default='data/traffic_model.tflite')
+  parser.add_argument(
+      '--labels',
+      help='label file path',
+      default='data/traffic_label_map.pbtxt')
+  parser.add_argument(
+      '--budget_ms',
+      type=float,
+      default=500.0,
+      help='maximum time each scenario may take')
+  parser.add_argument(
+      '--repeats',
+      type=int,
+      default=3,
+      help='runs per scenario; the fastest is reported')
+  args = parser.parse_args()
+
+  failed = False
+  for name, code, forbidden in scenarios(args.model, args.labels):
+    results = [run_scenario(code, forbidden) for _ in range(args.repeats)]
+    elapsed_ms = min(result['ms'] for result in results)
+    imported = results[0]['imported']
+
+    errors = []
+    if elapsed_ms > args.budget_ms:
+      errors.append('over budget')
+    if imported:
+      errors.append('imported {}'.format(', '.join(imported)))
+    failed = failed or bool(errors)
+    print('{:<32} {:>8.1f}ms  {}'.format(name, elapsed_ms,
+                                         '; '.join(errors) or 'OK'))
+
+  sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,190 @@
+# Lint as: python3
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+r"""Measures how trackers scale with the number of objects, without a model.
+
+Drives the trackers with synthetic scenarios of moving boxes, and reports the
+cost per frame and tracking quality for each object count:
+
+  camshift   The Camshift TrackerEngine, fed the scenario's noisy detections.
+             Quality is its ID switches and missed objects.
+  validator  MediaPipeTrackValidator, validating the tracks the Camshift
+             tracker outputs against the detections. Its cost excludes the
+             Camshift tracker's, and quality is that of the tracks it keeps.
+
+python3 tools/tracker_benchmark.py \
+  --objects 1,10,100,1000 \
+  --frames 60 \
+  --occlusion 0.02 \
+  --output /tmp/tracker_benchmark.json
+"""
+
+import argparse
+import copy
+import dataclasses
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__),
+                                                '..')))
+# pylint: disable=g-import-not-at-top,wrong-import-position
+from automl_video_ondevice.object_tracking import synthetic
+from automl_video_ondevice.object_tracking.mediapipe_track_validator import MediaPipeTrackValidator
+# pylint: enable=g-import-not-at-top,wrong-import-position
+
+
+@dataclasses.dataclass
+class TrackerResult:
+  tracker: str
+  objects: int
+  frames: int
+  mean_ms_per_frame: float
+  p50_ms_per_frame: float
+  p99_ms_per_frame: float
+  id_switches: int
+  misses: int  # Visible objects without a matching track, over all frames.
+  matches: int
+
+
+def _camshift_tracker():
+  # Imports OpenCV only when a tracker needing it is benchmarked.
+  from automl_video_ondevice.object_tracking.camshift_object_tracker import TrackerEngine  # pylint: disable=g-import-not-at-top,import-outside-toplevel
+  return TrackerEngine()
+
+
+def run_camshift(scenario):
+  """Runs the Camshift tracker, returning per-frame costs and its scorer."""
+  tracker = _camshift_tracker()
+  scorer = synthetic.TrackScorer()
+  costs_ms = []
+  for frame in scenario.frames():
+    predictions = []
+    start = time.perf_counter()
+    tracker.predict(frame.image, predictions)
+    tracker.correct(frame.detections, frame.image)
+    costs_ms.append((time.perf_counter() - start) * 1000)
+    scorer.update(frame.ground_truth, frame.occluded, predictions)
+  return costs_ms, scorer
+
+
+def run_validator(scenario):
+  """Runs the track validator, returning per-frame costs and its scorer."""
+  tracker = _camshift_tracker()
+  validator = MediaPipeTrackValidator()
+  scorer = synthetic.TrackScorer()
+  costs_ms = []
+  for frame in scenario.frames():
+    predictions = []
+    tracker.predict(frame.image, predictions)
+    tracker.correct(frame.detections, frame.image)
+    # The tracker keeps updating its annotations on later frames.
+    managed_tracks = copy.deepcopy(predictions)
+    start = time.perf_counter()
+    tracks, _ = validator.process(frame.detections, managed_tracks)
+    costs_ms.append((time.perf_counter() - start) * 1000)
+    scorer.update(frame.ground_truth, frame.occluded, tracks)
+  return costs_ms, scorer
+
+
+TRACKERS = {
+    'camshift': run_camshift,
+    'validator': run_validator,
+}
+
+
+def main():
+  parser = argparse.ArgumentParser()
+  parser.add_argument(
+      '--objects',
+      default='1,10,100,1000',
+      help='comma separated object counts to run each tracker with')
+  parser.add_argument(
+      '--trackers',
+      default=','.join(TRACKERS),
+      help='comma separated trackers: ' + ', '.join(TRACKERS))
+  parser.add_argument(
+      '--frames', type=int, default=60, help='frames per scenario')
+  parser.add_argument(
+      '--size', type=int, default=256, help='frame width and height')
+  parser.add_argument(
+      '--speed',
+      type=float,
+      default=0.01,
+      help='largest movement per frame, relative to the frame size')
+  parser.add_argument(
+      '--occlusion',
+      type=float,
+      default=0.0,
+      help='chance per frame that an object becomes occluded')
+  parser.add_argument(
+      '--noise',
+      type=float,
+      default=0.005,
+      help='standard deviation of detection box edges')
+  parser.add_argument('--seed', type=int, default=0, help='scenario seed')
+  parser.add_argument('--output', help='file to write JSON results to')
+  args = parser.parse_args()
+
+  results = []
+  for tracker_name in args.trackers.split(','):
+    run_tracker = TRACKERS[tracker_name.strip()]
+    for num_objects in [int(n) for n in args.objects.split(',')]:
+      # Objects shrink as they get more numerous, so that they still fit.
+      max_box_size = min(0.12, 0.8 / np.sqrt(num_objects))
+      scenario = synthetic.Scenario(
+          synthetic.ScenarioConfig(
+              num_objects=num_objects,
+              num_frames=args.frames,
+              width=args.size,
+              height=args.size,
+              min_box_size=max_box_size / 3,
+              max_box_size=max_box_size,
+              speed=args.speed,
+              occlusion_probability=args.occlusion,
+              detection_noise=args.noise,
+              seed=args.seed))
+      costs_ms, scorer = run_tracker(scenario)
+      p50, p99 = np.percentile(costs_ms, [50, 99])
+      result = TrackerResult(
+          tracker=tracker_name.strip(),
+          objects=num_objects,
+          frames=args.frames,
+          mean_ms_per_frame=float(np.mean(costs_ms)),
+          p50_ms_per_frame=float(p50),
+          p99_ms_per_frame=float(p99),
+          id_switches=scorer.id_switches,
+          misses=scorer.misses,
+          matches=scorer.matches)
+      results.append(result)
+      print('{:<10} {:>5} objects: {:>9.2f} ms/frame (p99 {:>9.2f}), '
+            '{} ID switches, {} misses'.format(result.tracker, result.objects,
+                                               result.mean_ms_per_frame,
+                                               result.p99_ms_per_frame,
+                                               result.id_switches,
+                                               result.misses))
+
+  if args.output:
+    with open(args.output, 'w') as f:
+      json.dump([dataclasses.asdict(result) for result in results],
+                f,
+                indent=2)
+
+
+if __name__ == '__main__':
+  main()